@@ -0,0 +1,396 @@
+"""性能ベンチマーク
+
+合成したNIR風のフレーム（解像度・ビット深度を指定）を使い、前処理・検出・保存の
+各段階と process_directory によるディレクトリ全体の処理を計測する。
+結果（スループット、レイテンシのパーセンタイル、ピークRSS）を JSON に保存し、
+基準ファイルと比較して性能の低下を検出する。
+
+使用例:
+    python benchmark.py --resolutions 640x480 1280x1024 --bit-depths 8 16 --workers 1 4
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.1
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import unicodedata
+import contextlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config import Config
+from image_processor import get_preprocessor, preprocess_image
+from landmark_detector import detect_landmarks
+from image_utils import save_processed_files, setup_directories
+from directory_processor import process_directory
+from profiler import PROFILE_JSON
+import model_registry
+
+try:
+    import psutil  # オプション依存（Windowsでのメモリ計測用）
+except ImportError:
+    psutil = None
+
+try:
+    import resource  # Windowsには存在しない
+except ImportError:
+    resource = None
+
+# 比較する指標と、値が大きいほど良いかどうか
+_COMPARED_METRICS = {
+    'frames_per_s': True,
+    'p90_ms': False,
+}
+
+
+def generate_frames(
+    count: int,
+    resolution: Tuple[int, int],
+    bit_depth: int,
+    seed: int = 0
+) -> List[np.ndarray]:
+    """NIR風の合成フレームを生成する
+
+    暗い背景に明るい楕円の顔領域（目・口は暗く抜く）を置き、輝度の勾配・ぼかし・
+    ノイズを加える。顔の位置はフレームごとに少しずつずらす。
+    同じ seed なら常に同じフレームを返す。
+
+    Args:
+        count: フレーム数
+        resolution: (幅, 高さ)
+        bit_depth: ビット深度（8 は uint8、それ以外は uint16 に 2^bit_depth-1 までの値）
+        seed: 乱数シード
+
+    Returns:
+        フレームのリスト
+    """
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+    max_value = (1 << bit_depth) - 1
+    dtype = np.uint8 if bit_depth <= 8 else np.uint16
+    gradient = np.linspace(0.05, 0.2, width, dtype=np.float32)[None, :]
+
+    frames = []
+    for _ in range(count):
+        img = np.repeat(gradient, height, axis=0)
+        cx = int(width * (0.5 + rng.uniform(-0.05, 0.05)))
+        cy = int(height * (0.5 + rng.uniform(-0.05, 0.05)))
+        fw, fh = int(width * 0.18), int(height * 0.3)
+        cv2.ellipse(img, (cx, cy), (fw, fh), 0, 0, 360, 0.75, -1)
+        for dx in (-0.4, 0.4):
+            cv2.ellipse(img, (cx + int(fw * dx), cy - fh // 4), (fw // 6, fh // 12), 0, 0, 360, 0.3, -1)
+        cv2.ellipse(img, (cx, cy + fh // 2), (fw // 3, fh // 14), 0, 0, 360, 0.35, -1)
+        img = cv2.GaussianBlur(img, (0, 0), max(1.0, width / 320))
+        img += rng.normal(0, 0.02, img.shape).astype(np.float32)
+        frames.append((np.clip(img, 0, 1) * max_value).astype(dtype))
+    return frames
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """このプロセスと終了済みの子プロセスのピークRSS(MB)を返す（計測できない場合は None）
+
+    プロセスの開始からの最大値のため、計測した段階だけのメモリ使用量ではない
+    （前に計測したベンチマークの最大値を含む累計の値）。
+    """
+    if resource is not None:
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # Linux は KB 単位、macOS は byte 単位
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    if psutil is not None:
+        info = psutil.Process(os.getpid()).memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    return None
+
+
+def summarize_latencies(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """フレームごとの処理時間（秒）からスループットとパーセンタイルを求める"""
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        'frames': len(latencies),
+        'frames_per_s': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': float(values.mean()) if len(values) else 0.0,
+        'p50_ms': float(np.percentile(values, 50)) if len(values) else 0.0,
+        'p90_ms': float(np.percentile(values, 90)) if len(values) else 0.0,
+        'p99_ms': float(np.percentile(values, 99)) if len(values) else 0.0,
+    }
+
+
+def _time_each(frames: List[Any], func) -> Dict[str, float]:
+    """フレームごとに func を呼び出して計測する"""
+    latencies = []
+    start = time.perf_counter()
+    for frame in frames:
+        frame_start = time.perf_counter()
+        func(frame)
+        latencies.append(time.perf_counter() - frame_start)
+    return summarize_latencies(latencies, time.perf_counter() - start)
+
+
+def check_normalize(frames: List[np.ndarray], config: Config) -> None:
+    """Preprocessor.normalize が cv2.normalize と一致することを確認する（高速化による結果の変化の検出）
+
+    Raises:
+        RuntimeError: 一致しないフレームがある場合
+    """
+    preprocessor = get_preprocessor(config)
+    for i, img in enumerate(frames):
+        expected = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        if not np.array_equal(preprocessor.normalize(img), expected):
+            raise RuntimeError(f"Preprocessor.normalize が cv2.normalize と一致しません（フレーム {i}）")
+
+
+def run_stage_benchmarks(
+    frames: List[np.ndarray],
+    modes: List[str],
+    config: Config,
+    work_dir: str
+) -> Dict[str, Dict[str, float]]:
+    """前処理・検出・保存の各段階を単一プロセスで計測する
+
+    Returns:
+        {'<段階>[/<モード>]': 集計結果} の辞書
+    """
+    check_normalize(frames, config)
+    results = {}
+    results['preprocess_image'] = _time_each(frames, lambda img: preprocess_image(img, config))
+    processed_frames = [preprocess_image(img, config).copy() for img in frames]
+
+    predictor = model_registry.get_predictor(config.LEARNED_MODEL_PATH)
+    detector = model_registry.get_detector()
+    landmarks_list = []
+    for mode in modes:
+        mode_config = copy.copy(config)
+        mode_config.DETECTION_MODE = mode
+        detections = []
+        results[f'detect_landmarks/{mode}'] = _time_each(
+            processed_frames,
+            lambda img: detections.append(detect_landmarks(img, predictor, mode_config, detector=detector))
+        )
+        if not landmarks_list:
+            landmarks_list = [
+                result.landmarks_list[0] if result.is_detected and result.landmarks_list
+                else config.TEMPLATE_LANDMARKS
+                for result in detections
+            ]
+
+    orig_norms = [cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U) for img in frames]
+    orignorm_dir, processed_dir, landmarks_dir = setup_directories(work_dir, 'save_benchmark')
+    comparison_dir = os.path.join(os.path.dirname(orignorm_dir), 'comparisons')
+    os.makedirs(comparison_dir, exist_ok=True)
+    items = [
+        (f'frame_{i:06d}.npy', orig_norms[i], processed_frames[i], landmarks_list[i])
+        for i in range(len(frames))
+    ]
+    results['save_processed_files'] = _time_each(
+        items,
+        lambda item: save_processed_files(
+            item[0], item[1], item[2], item[3],
+            orignorm_dir, processed_dir, landmarks_dir, comparison_dir,
+            is_detected=True, config=config
+        )
+    )
+    return results
+
+
+def run_end_to_end(
+    frames: List[np.ndarray],
+    mode: str,
+    workers: int,
+    config: Config,
+    work_dir: str
+) -> Dict[str, float]:
+    """process_directory でディレクトリ全体を処理して計測する
+
+    フレームごとのレイテンシはプロファイリング（profile.json の total）から求める。
+    処理中の表示は抑制する。
+    """
+    input_dir = os.path.join(work_dir, 'input')
+    if not os.path.isdir(input_dir):
+        os.makedirs(input_dir)
+        for i, frame in enumerate(frames):
+            np.save(os.path.join(input_dir, f'frame_{i:06d}.npy'), frame)
+
+    run_config = copy.copy(config)
+    run_config.OUTPUT_BASE_DIR = os.path.join(work_dir, f'output_{mode}_{workers}')
+    run_config.PROFILE = {**config.PROFILE, 'enabled': True, 'cprofile': False}
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        process_directory(input_dir, mode, run_config, max_workers=workers)
+    elapsed = time.perf_counter() - start
+
+    profile_path = os.path.join(run_config.OUTPUT_BASE_DIR, 'input', PROFILE_JSON)
+    with open(profile_path, encoding='utf-8') as f:
+        total = json.load(f)['stages'].get('total', {})
+    shutil.rmtree(run_config.OUTPUT_BASE_DIR, ignore_errors=True)
+    return {
+        'frames': len(frames),
+        'frames_per_s': len(frames) / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': total.get('mean_ms', 0.0),
+        'p50_ms': total.get('p50_ms', 0.0),
+        'p90_ms': total.get('p90_ms', 0.0),
+        'p99_ms': total.get('p99_ms', 0.0),
+    }
+
+
+def run_benchmarks(args: argparse.Namespace, config: Config) -> Dict[str, Dict[str, float]]:
+    """解像度・ビット深度ごとにすべてのベンチマークを実行する
+
+    Returns:
+        {'<ベンチマーク>/<解像度>/<ビット深度>bit[/<モード>][/w<ワーカー数>]': 集計結果}
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    for resolution in args.resolutions:
+        for bit_depth in args.bit_depths:
+            frames = generate_frames(args.frames, resolution, bit_depth, args.seed)
+            label = f'{resolution[0]}x{resolution[1]}/{bit_depth}bit'
+            print(f"⏱️ {label}: {len(frames)} フレーム")
+            with tempfile.TemporaryDirectory(prefix='nir_benchmark_') as work_dir:
+                stages = run_stage_benchmarks(frames, args.modes, config, work_dir)
+                for name, stats in stages.items():
+                    stage_name, _, mode = name.partition('/')
+                    key = f'{stage_name}/{label}' + (f'/{mode}' if mode else '')
+                    results[key] = {**stats, 'peak_rss_mb': get_peak_rss_mb()}
+                if args.skip_e2e:
+                    continue
+                for mode in args.modes:
+                    for workers in args.workers:
+                        stats = run_end_to_end(frames, mode, workers, config, work_dir)
+                        results[f'process_directory/{label}/{mode}/w{workers}'] = {
+                            **stats, 'peak_rss_mb': get_peak_rss_mb()
+                        }
+    return results
+
+
+def compare_with_baseline(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float
+) -> List[Tuple[str, str, float, float]]:
+    """基準と比較して、閾値を超えて悪化した指標を返す
+
+    Args:
+        results: 今回の結果
+        baseline: 基準の結果
+        threshold: 許容する悪化の割合（0.1 = 10%）
+
+    Returns:
+        (ベンチマーク, 指標, 基準値, 今回の値) のリスト
+    """
+    regressions = []
+    for key, stats in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, higher_is_better in _COMPARED_METRICS.items():
+            before, after = base.get(metric), stats.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append((key, metric, before, after))
+    return regressions
+
+
+def _pad(text: str, width: int, align: str = '>') -> str:
+    """全角文字を2桁として表示幅 width に揃える"""
+    display = sum(2 if unicodedata.east_asian_width(c) in ('F', 'W') else 1 for c in text)
+    padding = ' ' * max(0, width - display)
+    return text + padding if align == '<' else padding + text
+
+
+def print_results(
+    results: Dict[str, Dict[str, float]],
+    baseline: Optional[Dict[str, Dict[str, float]]] = None
+) -> None:
+    """結果を表として表示する（基準がある場合はスループットの変化率も表示）"""
+    print(f"\n{'='*107}")
+    print(f"📊 ベンチマーク結果")
+    print(f"{'='*107}")
+    print(f"{_pad('ベンチマーク', 48, '<')} {_pad('枚/秒', 10)} {_pad('p50ms', 8)} {_pad('p90ms', 8)} "
+          f"{_pad('p99ms', 8)} {_pad('累計RSS MB', 11)} {_pad('変化', 8)}")
+    for key, stats in results.items():
+        change = ''
+        base = (baseline or {}).get(key)
+        if base and base.get('frames_per_s'):
+            change = f"{(stats['frames_per_s'] / base['frames_per_s'] - 1) * 100:+.1f}%"
+        rss = stats.get('peak_rss_mb')
+        print(f"{key:<48} {stats['frames_per_s']:>10.1f} {stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {rss if rss is not None else float('nan'):>11.0f} {change:>8}")
+    print(f"{'='*107}")
+    print("※ 累計RSS はプロセス開始からのピーク（子プロセスを含む）で、各ベンチマーク単独の値ではありません")
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """'幅x高さ' 形式の解像度を解析する"""
+    try:
+        width, height = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"解像度は 幅x高さ の形式で指定してください: {value}")
+    return width, height
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description='合成フレームによる性能ベンチマーク')
+    parser.add_argument('--resolutions', nargs='+', type=parse_resolution,
+                        default=[(640, 480), (1280, 1024)], help='解像度（幅x高さ）')
+    parser.add_argument('--bit-depths', nargs='+', type=int, default=[8, 16],
+                        help='ビット深度（8 は uint8、10/12/16 は uint16）')
+    parser.add_argument('--frames', type=int, default=50, help='解像度・ビット深度ごとのフレーム数')
+    parser.add_argument('--modes', nargs='+', choices=['normal', 'high', 'cascade'], default=['normal'],
+                        help='計測する検出モード')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, os.cpu_count() or 1],
+                        help='process_directory の計測に使うワーカー数')
+    parser.add_argument('--skip-e2e', action='store_true', help='process_directory の計測を行わない')
+    parser.add_argument('--seed', type=int, default=0, help='合成フレームの乱数シード')
+    parser.add_argument('--output', default='benchmark_results.json', help='結果を保存するJSONファイルのパス')
+    parser.add_argument('--baseline', help='比較する基準のJSONファイル')
+    parser.add_argument('--save-baseline', help='今回の結果を基準として保存するJSONファイルのパス')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='性能低下とみなす悪化の割合（スループットの低下・p90の増加）')
+    args = parser.parse_args()
+    args.workers = sorted(set(args.workers))
+
+    config = Config()
+    results = run_benchmarks(args, config)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    document = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'frames': args.frames,
+        'seed': args.seed,
+        'results': results,
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+        print(f"結果を {path} に保存しました")
+
+    if baseline is not None:
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n⚠️ 性能低下を検出しました（閾値 {args.threshold*100:.0f}%）:")
+            for key, metric, before, after in regressions:
+                print(f"   {key} {metric}: {before:.2f} → {after:.2f}")
+            exit(1)
+        print(f"✅ 基準からの性能低下はありません（閾値 {args.threshold*100:.0f}%）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""バウンディングボックス倍率のスイープ
+
+BOUNDING_BOX_SCALE_X/Y の候補ごとのランドマークを、顔検出を1フレーム1回だけ行って
+比較する。各フレームで find_faces の検出矩形を求め、倍率の組ごとに fit_landmarks で
+ランドマーク予測のみを行う。現在の設定の倍率を基準として、ランドマークの変化量と
+予測時間を集計する。
+
+検出矩形は以下の順に再利用し、どちらにも無いフレームのみ顔検出を行う:
+    1. 通常の処理で記録されたマニフェスト（processed_data/<ディレクトリ名>/manifest.json）
+    2. --rects で指定したファイル（このツールが前回求めた検出矩形。実行後に更新される）
+いずれも入力ファイルと検出矩形に影響する設定（検出モード、前処理など）が同じ場合のみ使う。
+
+使用例:
+    python box_scale_sweep.py --dir folder1 --scales 0.7x0.8 0.8x0.9 1.0x1.0 1.2x1.2 --rects rects.json
+"""
+
+import os
+import csv
+import glob
+import json
+import time
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from image_processor import preprocess_image
+from landmark_detector import find_faces, fit_landmarks, get_box_scales
+from frame_source import frame_filename, list_frames, load_frame, split_frame_id
+from manifest import Manifest, config_fingerprint, file_signature, rect_fingerprint
+import model_registry
+
+
+def load_rects_file(path: str, fingerprint: str) -> Dict[str, Dict[str, Any]]:
+    """--rects のファイルから検出矩形を読み込む（設定が異なる場合は空）"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('rect_fingerprint') != fingerprint:
+        return {}
+    return data.get('frames', {})
+
+
+def save_rects_file(path: str, fingerprint: str, frames: Dict[str, Dict[str, Any]]) -> None:
+    """検出矩形を --rects のファイルに保存する"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'rect_fingerprint': fingerprint, 'frames': frames}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def run_sweep(
+    frame_ids: List[str],
+    scale_pairs: List[Tuple[float, float]],
+    config: Config,
+    manifest: Optional[Manifest],
+    rect_records: Dict[str, Dict[str, Any]]
+) -> Tuple[List[Dict[str, float]], np.ndarray, np.ndarray, Dict[str, int]]:
+    """倍率の組ごとにランドマークを予測して集計する
+
+    Args:
+        frame_ids: 入力フレーム（ファイルパス または スタック内のフレームID）
+        scale_pairs: (横幅倍率, 縦幅倍率) のリスト（先頭が基準）
+        config: 設定オブジェクト
+        manifest: 検出矩形を再利用するマニフェスト（無い場合は None）
+        rect_records: --rects のファイルの内容（新たに求めた検出矩形が追加される）
+
+    Returns:
+        (倍率の組ごとの集計結果のリスト,
+         ランドマーク (倍率の組数, フレーム数, 68, 2)（予測できなかったフレームは 0）,
+         予測できたかどうか (倍率の組数, フレーム数),
+         検出矩形の取得元ごとのフレーム数)
+    """
+    predictor = model_registry.get_predictor(config.LEARNED_MODEL_PATH)
+    detector = model_registry.get_detector()
+    fingerprint = rect_fingerprint(config)
+
+    # 顔が画像の端にかかると座標は負になるため、予測できたかどうかは別に記録する
+    all_landmarks = np.zeros((len(scale_pairs), len(frame_ids), 68, 2), dtype=np.int32)
+    fitted = np.zeros((len(scale_pairs), len(frame_ids)), dtype=bool)
+    fit_times: List[List[float]] = [[] for _ in scale_pairs]
+    rect_sources = {'manifest': 0, 'rects_file': 0, 'detected': 0}
+    signatures: Dict[str, Dict[str, Any]] = {}
+    detect_time = 0.0
+
+    for i, frame_id in enumerate(frame_ids):
+        path, _ = split_frame_id(frame_id)
+        signature = signatures.get(path)
+        if signature is None:
+            signature = signatures[path] = file_signature(path)
+        filename = frame_filename(frame_id)
+        processed = preprocess_image(load_frame(frame_id), config)
+
+        # 記録済みの検出矩形を探し、無い場合のみ顔検出を行う
+        found, face_rect = False, None
+        if manifest is not None:
+            found, face_rect = manifest.get_face_rect(filename, signature, fingerprint)
+            if found:
+                rect_sources['manifest'] += 1
+        record = rect_records.get(filename)
+        if not found and record is not None and all(record.get(k) == v for k, v in signature.items()):
+            found, face_rect = True, tuple(record['face_rect']) if record['face_rect'] else None
+            rect_sources['rects_file'] += 1
+        if not found:
+            start = time.perf_counter()
+            faces = find_faces(processed, config, detector)
+            detect_time += time.perf_counter() - start
+            face_rect = faces.rects[0] if faces.rects else None
+            rect_sources['detected'] += 1
+            if not faces.had_error:
+                rect_records[filename] = {**signature, 'face_rect': list(face_rect) if face_rect else None}
+
+        if face_rect is None:
+            continue
+        for j, scales in enumerate(scale_pairs):
+            start = time.perf_counter()
+            landmarks = fit_landmarks(processed, [face_rect], predictor, scales)[0]
+            fit_times[j].append(time.perf_counter() - start)
+            if landmarks is not None:
+                all_landmarks[j, i] = landmarks
+                fitted[j, i] = True
+
+    reference = all_landmarks[0]
+    rows = []
+    for j, (scale_x, scale_y) in enumerate(scale_pairs):
+        both = fitted[j] & fitted[0]
+        # 基準とのランドマーク変化量（各点のユークリッド距離の平均）
+        diffs = np.linalg.norm(
+            all_landmarks[j, both].astype(np.float64) - reference[both], axis=2
+        ).mean(axis=1) if both.any() else np.zeros(0)
+        rows.append({
+            'scale_x': scale_x,
+            'scale_y': scale_y,
+            'frames': len(frame_ids),
+            'fitted': int(fitted[j].sum()),
+            'mean_shift_px': float(diffs.mean()) if len(diffs) else 0.0,
+            'max_shift_px': float(diffs.max()) if len(diffs) else 0.0,
+            'mean_fit_ms': float(np.mean(fit_times[j])) * 1000 if fit_times[j] else 0.0,
+        })
+    rect_sources['detect_ms'] = int(detect_time * 1000)
+    return rows, all_landmarks, fitted, rect_sources
+
+
+def parse_scale_pair(value: str) -> Tuple[float, float]:
+    """'横幅倍率x縦幅倍率' 形式（または共通の1つの値）の倍率を解析する"""
+    try:
+        parts = [float(v) for v in value.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"倍率は 横x縦 の形式で指定してください: {value}")
+    if len(parts) == 1:
+        return parts[0], parts[0]
+    if len(parts) != 2:
+        raise argparse.ArgumentTypeError(f"倍率は 横x縦 の形式で指定してください: {value}")
+    return parts[0], parts[1]
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description='バウンディングボックス倍率のスイープ（顔検出は1回のみ）')
+    parser.add_argument('--dir', required=True, help='NIR画像(.npy)が含まれるディレクトリ')
+    parser.add_argument('--scales', nargs='+', type=parse_scale_pair, required=True,
+                        help='比較する倍率の組（横x縦、例: 0.8x0.9。現在の設定の倍率は常に基準として含まれる）')
+    parser.add_argument('--mode', choices=['normal', 'high'], default='normal', help='検出モード')
+    parser.add_argument('--limit', type=int, help='使用する最大フレーム数')
+    parser.add_argument('--manifest-dir',
+                        help='検出矩形を再利用するマニフェストのディレクトリ（デフォルト: processed_data/<ディレクトリ名>）')
+    parser.add_argument('--rects', help='検出矩形を保存・再利用するJSONファイルのパス')
+    parser.add_argument('--csv', help='結果を保存するCSVファイルのパス')
+    parser.add_argument('--save-landmarks', help='倍率の組ごとのランドマークを保存する .npz のパス')
+    args = parser.parse_args()
+
+    config = Config()
+    config.DETECTION_MODE = args.mode
+    frame_ids = list_frames(sorted(glob.glob(os.path.join(args.dir, '*.npy'))), config)
+    if args.limit:
+        frame_ids = frame_ids[:args.limit]
+    if not frame_ids:
+        print(f"エラー: {args.dir} 内に.npyファイルが見つかりません。")
+        exit(1)
+
+    reference = get_box_scales(config)
+    scale_pairs = [reference] + [pair for pair in args.scales if pair != reference]
+
+    manifest_dir = args.manifest_dir or os.path.join(
+        config.OUTPUT_BASE_DIR, os.path.basename(os.path.normpath(args.dir))
+    )
+    manifest = None
+    if os.path.isdir(manifest_dir):
+        manifest = Manifest.load(manifest_dir, config_fingerprint(config), rect_fingerprint(config))
+    fingerprint = rect_fingerprint(config)
+    rect_records = load_rects_file(args.rects, fingerprint)
+
+    rows, all_landmarks, fitted, rect_sources = run_sweep(frame_ids, scale_pairs, config, manifest, rect_records)
+    if args.rects:
+        save_rects_file(args.rects, fingerprint, rect_records)
+
+    print(f"\n{'='*80}")
+    print(f"📐 バウンディングボックス倍率スイープ（基準: {reference[0]:.2f}x{reference[1]:.2f}, {len(frame_ids)} フレーム）")
+    print(f"   検出矩形: マニフェスト {rect_sources['manifest']} / 矩形ファイル {rect_sources['rects_file']} / "
+          f"顔検出 {rect_sources['detected']}（{rect_sources['detect_ms']} ms）")
+    print(f"{'='*80}")
+    print(f"{'倍率(横x縦)':>12} {'予測数':>8} {'平均変化px':>10} {'最大変化px':>10} {'予測時間ms':>10}")
+    for row in rows:
+        print(f"{row['scale_x']:>7.2f}x{row['scale_y']:<6.2f} {row['fitted']:>8} "
+              f"{row['mean_shift_px']:>12.2f} {row['max_shift_px']:>12.2f} {row['mean_fit_ms']:>12.2f}")
+    print(f"{'='*80}")
+
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"レポートを {args.csv} に保存しました")
+    if args.save_landmarks:
+        np.savez(
+            args.save_landmarks,
+            scales=np.asarray(scale_pairs, dtype=np.float64),
+            frames=np.asarray([frame_filename(frame_id) for frame_id in frame_ids]),
+            landmarks=all_landmarks,
+            fitted=fitted,
+        )
+        print(f"ランドマークを {args.save_landmarks} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
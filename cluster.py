@@ -0,0 +1,670 @@
+"""複数ノードでの分散処理モジュール（共有ファイルシステム上の作業キュー）
+
+同じNASをマウントした複数のマシンで `main.py --worker --list folder_list.txt` を
+実行すると、各ノードは folder_list.txt と同じ場所に置かれた SQLite の作業キュー
+（folder_list.queue.sqlite）からフレームのバッチを取得し、ローカルのワーカープールで
+処理する。調整役のプロセスは無く、最初に起動したノードがキューを作成する。
+
+- バッチの取得はリース方式で、処理中のノードは定期的にリースを延長する。
+  ノードが停止してリースが切れたバッチは、他のノードが取得し直す
+- 各バッチの結果は出力ディレクトリの cluster/batch_<番号>.jsonl に書き出す
+  （書き終えてから置き換えるため、途中で停止したノードの結果は残らない。
+  リースが切れて他のノードが取得し直したバッチの結果は破棄する）
+- ディレクトリの全バッチが完了すると、いずれか1つのノードが結果を組み立て、
+  通常の処理と同じ detection_results.txt、not_detected.txt、manifest.json、
+  ランドマークストアを書き出す。検出失敗フレームの補完もこの時点で
+  ディレクトリ全体のファイル名順に行う
+
+1台のマシンで複数のプロセスを起動すれば、複数ノードの代わりとして動作を確認できる。
+SQLite のロックを使うため、NASはファイルロックに対応している必要がある
+（ネットワークファイルシステムでは WAL モードを使えないため、通常のジャーナルを使う）。
+"""
+
+import os
+import copy
+import json
+import time
+import glob
+import socket
+import sqlite3
+import threading
+import contextlib
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from config import Config
+from data_types import DetectionInfo, ProcessResult
+from directory_processor import DirectoryJob, create_executor, run_jobs
+from frame_source import frame_filename, list_frames, split_frame_id
+from image_utils import setup_directories
+from landmark_detector import adjust_rect, get_box_scales
+from landmark_store import LandmarkStore, get_store_dir
+from manifest import Manifest, artifact_fingerprints, config_fingerprint, file_signature, rect_fingerprint
+from worker_scheduler import ConcurrencyController, plan_workers, print_plan
+
+CLUSTER_DIRNAME = 'cluster'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS directories (
+    input_dir TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL
+);
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY,
+    input_dir TEXT NOT NULL,
+    start_index INTEGER NOT NULL,
+    frames TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS batches_status ON batches (status, id);
+"""
+
+
+def get_queue_path(list_path: str) -> str:
+    """フォルダリストに対応する作業キューのパスを返す（フォルダリストと同じ場所）"""
+    return os.path.splitext(os.path.abspath(list_path))[0] + '.queue.sqlite'
+
+
+def get_node_id() -> str:
+    """このプロセスのノードID（ホスト名とPID）を返す"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Batch:
+    """作業キューから取得したバッチ"""
+
+    def __init__(self, batch_id: int, input_dir: str, start_index: int, frames: List[str]):
+        self.batch_id = batch_id
+        self.input_dir = input_dir
+        self.start_index = start_index  # 先頭フレームのディレクトリ内でのフレーム番号
+        self.frames = frames  # 画像ファイルパス または スタック内のフレームID
+
+
+class WorkQueue:
+    """SQLite による共有の作業キュー
+
+    接続はスレッドごとに作成すること（リース延長のスレッドは別のインスタンスを使う）。
+    """
+
+    def __init__(self, path: str, lease_seconds: float, max_attempts: int = 3):
+        """
+        Args:
+            path: SQLite ファイルのパス
+            lease_seconds: バッチのリース時間（秒）
+            max_attempts: バッチを取得し直す最大回数（超えたバッチは失敗として扱う）
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._conn = sqlite3.connect(path, timeout=120.0, isolation_level=None)
+        self._conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """書き込みロックを取得したトランザクション"""
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def initialize(
+        self,
+        input_dirs: List[str],
+        config: Config,
+        detection_mode: str,
+        batch_frames: int
+    ) -> bool:
+        """キューが空の場合、ディレクトリのフレームをバッチに分けて登録する
+
+        すでに登録済みの場合は、設定が同じであることだけを確認する。
+
+        Args:
+            input_dirs: 入力ディレクトリのリスト
+            config: 設定オブジェクト
+            detection_mode: 検出モード
+            batch_frames: 1バッチのフレーム数
+
+        Returns:
+            このノードと同じ設定のキューであればTrue
+        """
+        # 成果物はバッチを処理したノードが書き込むため、出力の設定もノード間で揃える
+        fingerprint = json.dumps(
+            {'config': config_fingerprint(config), 'artifacts': artifact_fingerprints(config)}, sort_keys=True
+        )
+        if self.get_meta('fingerprint') is None:
+            # 列挙はロックの外で行い、登録はキューが空の場合のみ行う
+            listings = []
+            for input_dir in input_dirs:
+                if not os.path.isdir(input_dir):
+                    print(f"警告: {input_dir} は有効なディレクトリではありません。スキップします。")
+                    continue
+                frames = list_frames(sorted(glob.glob(os.path.join(input_dir, '*.npy'))), config)
+                if not frames:
+                    print(f"エラー: {input_dir} 内に.npyファイルが見つかりません。")
+                    continue
+                listings.append((input_dir, frames))
+            with self._transaction() as conn:
+                if conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone() is None:
+                    for position, (input_dir, frames) in enumerate(listings):
+                        conn.execute(
+                            'INSERT INTO directories (input_dir, position) VALUES (?, ?)',
+                            (input_dir, position)
+                        )
+                        for start in range(0, len(frames), batch_frames):
+                            conn.execute(
+                                'INSERT INTO batches (input_dir, start_index, frames) VALUES (?, ?, ?)',
+                                (input_dir, start, json.dumps(frames[start:start + batch_frames], ensure_ascii=False))
+                            )
+                    conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+                        ('fingerprint', fingerprint),
+                        ('detection_mode', detection_mode),
+                        ('created', time.strftime('%Y-%m-%d %H:%M:%S')),
+                    ])
+        return (self.get_meta('fingerprint') == fingerprint
+                and self.get_meta('detection_mode') == detection_mode)
+
+    def claim(self, node_id: str) -> Optional[Batch]:
+        """未処理のバッチ（またはリースの切れたバッチ）を1つ取得する
+
+        Returns:
+            Batch: 取得したバッチ。取得できるバッチが無い場合は None
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # 取得し直す回数を超えたバッチは失敗として扱う
+            conn.execute(
+                "UPDATE batches SET status = 'failed' "
+                "WHERE status = 'claimed' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT id, input_dir, start_index, frames FROM batches "
+                "WHERE status = 'pending' OR (status = 'claimed' AND lease_until < ?) "
+                "ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE batches SET status = 'claimed', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = ?", (node_id, now + self.lease_seconds, row[0])
+            )
+        return Batch(row[0], row[1], row[2], json.loads(row[3]))
+
+    def renew(self, batch_id: int, node_id: str) -> bool:
+        """リースを延長する（他のノードに取得し直されていた場合はFalse）"""
+        cursor = self._conn.execute(
+            "UPDATE batches SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'claimed'",
+            (time.time() + self.lease_seconds, batch_id, node_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, batch_id: int, node_id: str, on_complete: Optional[Callable[[], None]] = None) -> bool:
+        """このノードがリースを保持しているバッチを完了にする
+
+        Args:
+            batch_id: バッチの番号
+            node_id: このノードのノードID
+            on_complete: 完了にする直前に書き込みロックを保持したまま呼び出す処理
+                （結果ファイルの確定。他のノードの完了と同時に行われない）
+
+        Returns:
+            完了にした場合True。リースが切れて他のノードが取得し直していた場合はFalse
+        """
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM batches WHERE id = ? AND owner = ? AND status = 'claimed'",
+                (batch_id, node_id)
+            ).fetchone()
+            if row is None:
+                return False
+            if on_complete is not None:
+                on_complete()
+            conn.execute("UPDATE batches SET status = 'done', lease_until = NULL WHERE id = ?", (batch_id,))
+        return True
+
+    def release(self, batch_id: int, node_id: str) -> None:
+        """処理できなかったバッチを未処理に戻す"""
+        self._conn.execute(
+            "UPDATE batches SET status = 'pending', owner = NULL, lease_until = NULL "
+            "WHERE id = ? AND owner = ? AND status = 'claimed'", (batch_id, node_id)
+        )
+
+    def claim_assembly(self, node_id: str) -> Optional[str]:
+        """全バッチが完了（または失敗）したディレクトリの組み立てを1つ引き受ける
+
+        Returns:
+            組み立てるディレクトリ。引き受けられるディレクトリが無い場合は None
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT input_dir FROM directories d "
+                "WHERE (status = 'pending' OR (status = 'assembling' AND lease_until < ?)) "
+                "AND NOT EXISTS (SELECT 1 FROM batches b WHERE b.input_dir = d.input_dir "
+                "AND b.status IN ('pending', 'claimed')) "
+                "ORDER BY position LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE directories SET status = 'assembling', owner = ?, lease_until = ? WHERE input_dir = ?",
+                (node_id, now + self.lease_seconds, row[0])
+            )
+        return row[0]
+
+    def renew_assembly(self, input_dir: str, node_id: str) -> bool:
+        """組み立てのリースを延長する"""
+        cursor = self._conn.execute(
+            "UPDATE directories SET lease_until = ? WHERE input_dir = ? AND owner = ? AND status = 'assembling'",
+            (time.time() + self.lease_seconds, input_dir, node_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete_assembly(self, input_dir: str) -> None:
+        self._conn.execute(
+            "UPDATE directories SET status = 'done', lease_until = NULL WHERE input_dir = ?", (input_dir,)
+        )
+
+    def get_directory_batches(self, input_dir: str) -> List[Tuple[int, int, List[str], str]]:
+        """ディレクトリのバッチを (番号, 先頭のフレーム番号, フレーム, 状態) のリストで返す"""
+        rows = self._conn.execute(
+            'SELECT id, start_index, frames, status FROM batches WHERE input_dir = ? ORDER BY start_index',
+            (input_dir,)
+        ).fetchall()
+        return [(row[0], row[1], json.loads(row[2]), row[3]) for row in rows]
+
+    def get_sample_frames(self) -> List[str]:
+        """各ディレクトリの先頭フレームを返す（ワーカー数の決定用）"""
+        rows = self._conn.execute('SELECT frames FROM batches WHERE start_index = 0').fetchall()
+        return [json.loads(row[0])[0] for row in rows if row[0] != '[]']
+
+    def is_finished(self) -> bool:
+        """全ディレクトリの組み立てが完了したかどうか"""
+        row = self._conn.execute("SELECT COUNT(*) FROM directories WHERE status != 'done'").fetchone()
+        return row[0] == 0
+
+    def progress(self) -> Dict[str, int]:
+        """状態ごとのバッチ数を返す"""
+        return dict(self._conn.execute('SELECT status, COUNT(*) FROM batches GROUP BY status').fetchall())
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class LeaseKeeper:
+    """処理中のリースを別スレッドで定期的に延長する"""
+
+    def __init__(self, queue_path: str, lease_seconds: float, renew, *renew_args):
+        """
+        Args:
+            queue_path: 作業キューのパス（スレッド内で別の接続を開く）
+            lease_seconds: リース時間（秒）。その1/3ごとに延長する
+            renew: 延長に使う WorkQueue のメソッド（WorkQueue.renew など）
+            renew_args: renew に渡す引数
+        """
+        self.queue_path = queue_path
+        self.lease_seconds = lease_seconds
+        self.renew = renew
+        self.renew_args = renew_args
+        self.lost = False  # 他のノードにリースを取られたかどうか
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        queue = WorkQueue(self.queue_path, self.lease_seconds)
+        try:
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    if not self.renew(queue, *self.renew_args):
+                        self.lost = True
+                except sqlite3.Error:
+                    # 一時的なロック待ちのタイムアウトなどは次の延長で再試行する
+                    pass
+        finally:
+            queue.close()
+
+    def __enter__(self) -> 'LeaseKeeper':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def get_batch_result_path(output_dir: str, batch_id: int) -> str:
+    """バッチの結果ファイルのパスを返す"""
+    return os.path.join(output_dir, CLUSTER_DIRNAME, f'batch_{batch_id:06d}.jsonl')
+
+
+class _DeferredFallback:
+    """バッチ内では補完を行わない（組み立て時にディレクトリ全体で行う）"""
+
+    def add_detected(self, index: int, landmarks: Any) -> list:
+        return []
+
+    def add_failed(self, index: int, payload: Any) -> list:
+        return []
+
+    def add_skipped(self, index: int) -> list:
+        return []
+
+    def finish(self) -> list:
+        return []
+
+
+class ClusterBatchJob(DirectoryJob):
+    """作業キューから取得した1バッチ分（ディレクトリの一部のフレーム）の処理
+
+    フレームの成果物（.npy、比較画像）は通常の処理と同じ場所に保存し、
+    サマリーの代わりにフレームごとの結果をバッチの結果ファイルに書き出す。
+    補完とランドマークストアへの書き込みは組み立て時に行う。
+    """
+
+    def __init__(self, batch: Batch, config: Config):
+        # ランドマークストアは組み立て時にまとめて書き込む（複数ノードから同じメモリマップに書き込まない）
+        batch_config = copy.copy(config)
+        batch_config.OUTPUTS = {**config.OUTPUTS, 'landmark_store': False}
+        # バッチを完了としてキューに記録する時点で成果物が書き込まれている必要がある
+        batch_config.WRITER = {**config.WRITER, 'enabled': False}
+        super().__init__(batch.input_dir, batch_config)
+        self.batch = batch
+        self.fallback = _DeferredFallback()
+        self.result_path = ''
+        self._tmp_path = ''
+        self._result_fp = None
+
+    def prepare(self) -> bool:
+        """出力ディレクトリの作成と結果ファイルの準備を行う"""
+        self.all_files = list(self.batch.frames)
+        self.img_files = list(self.batch.frames)
+        self.orignorm_dir, self.processed_dir, self.landmarks_dir = setup_directories(
+            self.config.OUTPUT_BASE_DIR, self.input_dir
+        )
+        self.output_dir = os.path.dirname(self.orignorm_dir)
+        self.comparison_dir = os.path.join(self.output_dir, 'comparisons')
+        self.frame_indices = {
+            img_file: self.batch.start_index + i for i, img_file in enumerate(self.batch.frames)
+        }
+        file_signatures: Dict[str, Dict[str, Any]] = {}
+        for img_file in self.img_files:
+            path, _ = split_frame_id(img_file)
+            signature = file_signatures.get(path)
+            if signature is None:
+                signature = file_signatures[path] = file_signature(path, self.config.RESUME['content_hash'])
+            self.signatures[img_file] = signature
+
+        self.result_path = get_batch_result_path(self.output_dir, self.batch.batch_id)
+        os.makedirs(os.path.dirname(self.result_path), exist_ok=True)
+        self._tmp_path = f"{self.result_path}.{get_node_id().replace(':', '_')}.tmp"
+        self._result_fp = open(self._tmp_path, 'w', encoding='utf-8')
+        return True
+
+    def _write_record(self, img_file: str, result: ProcessResult) -> None:
+        """1フレーム分の結果を結果ファイルに書き出す"""
+        record = {
+            'frame': img_file,
+            'signature': self.signatures[img_file],
+            'is_detected': result.is_detected,
+            'error': result.error,
+            'message': result.message,
+            'best_upsample': result.best_upsample,
+            'detection_info': [[info.upsample, info.reason] for info in result.detection_info],
+            'roi_used': result.roi_used,
+            'comparison_saved': result.comparison_saved,
+            'face_rect': list(result.face_rect) if result.face_rect is not None else None,
+            'landmarks': result.landmarks.tolist() if result.landmarks is not None else None,
+        }
+        self._result_fp.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def _record_result(self, img_file: str, frame_index: int, result: ProcessResult) -> None:
+        super()._record_result(img_file, frame_index, result)
+        if not result.deferred:
+            # カスケードの2段目の結果は1段目の検出情報と統合済み
+            self._write_record(img_file, result)
+
+    def handle_failure(self, args: tuple, error: Exception) -> None:
+        super().handle_failure(args, error)
+        img_files = args[0] if isinstance(args[0], list) else [args[0]]
+        for img_file in img_files:
+            if not isinstance(img_file, str):
+                continue  # 比較画像の描き直し（バッチ内では発生しない）
+            self._write_record(img_file, ProcessResult(
+                is_detected=False, message=f"処理例外: {str(error)}", best_upsample=None,
+                detection_info=[], error=True
+            ))
+
+    def finalize(self) -> None:
+        """結果ファイルを書き終える（確定は publish_result で行う）"""
+        self._result_fp.close()
+        tqdm.write(f"📦 バッチ {self.batch.batch_id}（{self.input_dir} のフレーム "
+                   f"{self.batch.start_index}〜{self.batch.start_index + len(self.batch.frames) - 1}）: "
+                   f"成功 {self.success_count} / 失敗 {self.failure_count}")
+
+    def publish_result(self) -> None:
+        """書き終えた結果ファイルを確定する（WorkQueue.complete から呼ばれる）"""
+        os.replace(self._tmp_path, self.result_path)
+
+    def abort(self) -> None:
+        """処理を中断した場合に書きかけの結果ファイルを削除する"""
+        if self._result_fp is not None and not self._result_fp.closed:
+            self._result_fp.close()
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class ClusterAssemblyJob(DirectoryJob):
+    """全バッチの結果からディレクトリのサマリーを組み立てる
+
+    バッチの結果をファイル名順に DirectoryJob の集計処理へ渡し直すことで、
+    マニフェスト・補完・サマリーを通常の処理と同じ手順で作成する。
+    """
+
+    def __init__(self, input_dir: str, config: Config, batches: List[Tuple[int, int, List[str], str]]):
+        super().__init__(input_dir, config)
+        self.batches = batches
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.missing_count = 0
+
+    def prepare(self) -> bool:
+        """バッチの結果を読み込み、マニフェストとランドマークストアを準備する"""
+        self.all_files = [frame for _, _, frames, _ in self.batches for frame in frames]
+        self.img_files = list(self.all_files)
+        self.orignorm_dir, self.processed_dir, self.landmarks_dir = setup_directories(
+            self.config.OUTPUT_BASE_DIR, self.input_dir
+        )
+        self.output_dir = os.path.dirname(self.orignorm_dir)
+        self.comparison_dir = os.path.join(self.output_dir, 'comparisons')
+        self.frame_indices = {img_file: i for i, img_file in enumerate(self.all_files)}
+        self.manifest = Manifest.load(
+            self.output_dir, config_fingerprint(self.config), rect_fingerprint(self.config)
+        )
+
+        for batch_id, _, _, _ in self.batches:
+            path = get_batch_result_path(self.output_dir, batch_id)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.records[record['frame']] = record
+
+        for img_file in self.all_files:
+            record = self.records.get(img_file)
+            if record is not None:
+                self.signatures[img_file] = record['signature']
+            else:
+                # 失敗したバッチのフレームはエラーとして記録する（再実行時に再処理される）
+                path, _ = split_frame_id(img_file)
+                self.signatures[img_file] = file_signature(path, self.config.RESUME['content_hash'])
+
+        if self.config.OUTPUTS['landmark_store']:
+            self.store = LandmarkStore.create(
+                get_store_dir(self.orignorm_dir),
+                [frame_filename(img_file) for img_file in self.all_files]
+            )
+        return True
+
+    def replay(self) -> None:
+        """バッチの結果をファイル名順に集計する（補完した比較画像の描き直しはタスクとして溜まる）"""
+        for img_file in self.all_files:
+            frame_index = self.frame_indices[img_file]
+            record = self.records.get(img_file)
+            if record is None:
+                self.missing_count += 1
+                result = ProcessResult(
+                    is_detected=False, message="処理例外: バッチの処理が完了しませんでした",
+                    best_upsample=None, detection_info=[], error=True
+                )
+            else:
+                result = ProcessResult(
+                    is_detected=record['is_detected'],
+                    message=record['message'],
+                    best_upsample=record['best_upsample'],
+                    detection_info=[DetectionInfo(upsample=u, reason=r) for u, r in record['detection_info']],
+                    roi_used=record['roi_used'],
+                    error=record['error'],
+                    landmarks=np.asarray(record['landmarks'], dtype=np.int32) if record['landmarks'] is not None else None,
+                    comparison_saved=record['comparison_saved'],
+                    face_rect=tuple(record['face_rect']) if record['face_rect'] else None,
+                )
+            if self.store is not None and not result.error:
+                self._write_store_row(frame_index, result)
+            self._record_result(img_file, frame_index, result)
+
+    def _write_store_row(self, frame_index: int, result: ProcessResult) -> None:
+        """ワーカーの代わりにランドマークストアの行を書き込む（補完より先に書き込む）"""
+        bounding_box = result.face_rect
+        if result.is_detected and result.face_rect is not None:
+            bounding_box = adjust_rect(result.face_rect, get_box_scales(self.config))
+        landmarks = result.landmarks if result.landmarks is not None else self.config.TEMPLATE_LANDMARKS
+        self.store.write(frame_index, landmarks, result.is_detected, result.best_upsample, bounding_box)
+
+    def run_followups(self, executor: ProcessPoolExecutor) -> None:
+        """補完したフレームの比較画像の描き直しをワーカープールで実行する"""
+        pending: Dict[Future, tuple] = {}
+        while self.followup_tasks or pending:
+            while self.followup_tasks:
+                fn, args = self.followup_tasks.popleft()
+                pending[executor.submit(fn, args)] = args
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                args = pending.pop(future)
+                try:
+                    self.handle_output(args, future.result())
+                except Exception as e:
+                    self.handle_failure(args, e)
+
+
+def assemble_directory(
+    queue: WorkQueue,
+    input_dir: str,
+    config: Config,
+    executor: ProcessPoolExecutor,
+    node_id: str
+) -> None:
+    """ディレクトリの全バッチの結果からサマリーを組み立てる"""
+    print(f"\n=== ディレクトリ {input_dir} の結果を組み立てます ===")
+    job = ClusterAssemblyJob(input_dir, config, queue.get_directory_batches(input_dir))
+    with LeaseKeeper(queue.path, queue.lease_seconds, WorkQueue.renew_assembly, input_dir, node_id):
+        job.prepare()
+        # フレームごとの結果の表示はバッチの処理時に済んでいるため抑制する
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            job.replay()
+        job.run_followups(executor)
+        job.finalize()
+    if job.missing_count:
+        print(f"⚠️ 完了しなかったバッチのフレーム {job.missing_count} 件はエラーとして記録しました"
+              f"（--resume で再処理できます）")
+    queue.complete_assembly(input_dir)
+    print(f"=== ディレクトリ {input_dir} の処理が完了しました ===\n")
+
+
+def run_cluster_worker(
+    list_path: str,
+    input_dirs: List[str],
+    detection_mode: str = 'normal',
+    config: Optional[Config] = None
+) -> None:
+    """作業キューからバッチを取得して処理するワーカーノードを実行する
+
+    全ディレクトリの組み立てが完了するまで、バッチの取得・処理と、
+    全バッチが完了したディレクトリの組み立てを繰り返す。
+
+    Args:
+        list_path: フォルダリストのパス（作業キューは同じ場所に作成される）
+        input_dirs: 入力ディレクトリのリスト（キューが未作成の場合に登録する）
+        detection_mode: 検出モード ('normal'、'high' または 'cascade')
+        config: 設定オブジェクト（未指定時は Config() を使用）
+    """
+    config = config or Config()
+    config.DETECTION_MODE = detection_mode
+    settings = config.CLUSTER
+    node_id = get_node_id()
+    queue_path = get_queue_path(list_path)
+
+    queue = WorkQueue(queue_path, settings['lease_seconds'], settings['max_attempts'])
+    if not queue.initialize(input_dirs, config, detection_mode, max(1, settings['batch_frames'])):
+        print(f"エラー: 作業キュー {queue_path} は異なる設定で作成されています。"
+              f"設定を揃えるか、キューを削除してから実行してください。")
+        queue.close()
+        return
+    print(f"🛰️ ワーカーノード {node_id}（作業キュー: {queue_path}）")
+
+    plan = plan_workers(config, queue.get_sample_frames())
+    print_plan(plan)
+    # 同時実行数の調整はバッチをまたいで引き継ぐ
+    controller = ConcurrencyController(plan, config)
+    try:
+        with create_executor(config, plan.pool_size) as executor:
+            while not queue.is_finished():
+                input_dir = queue.claim_assembly(node_id)
+                if input_dir is not None:
+                    assemble_directory(queue, input_dir, config, executor, node_id)
+                    continue
+                batch = queue.claim(node_id)
+                if batch is None:
+                    # 他のノードの処理中のバッチの完了（またはリース切れ）を待つ
+                    progress = queue.progress()
+                    tqdm.write(f"⏳ 他のノードの処理を待っています（{progress}）")
+                    time.sleep(settings['poll_seconds'])
+                    continue
+                job = ClusterBatchJob(batch, config)
+                try:
+                    with LeaseKeeper(queue_path, settings['lease_seconds'], WorkQueue.renew,
+                                     batch.batch_id, node_id):
+                        job.prepare()
+                        run_jobs(executor, [job], max_in_flight=plan.initial_limit, controller=controller)
+                except BaseException:
+                    job.abort()
+                    queue.release(batch.batch_id, node_id)
+                    raise
+                if not queue.complete(batch.batch_id, node_id, job.publish_result):
+                    # 他のノードが処理し直しているため、結果はそちらに任せる
+                    job.abort()
+                    tqdm.write(f"⚠️ バッチ {batch.batch_id} のリースが切れ、他のノードが取得し直しました"
+                               f"（このノードの結果は破棄します）")
+    finally:
+        queue.close()
+    controller.print_summary()
+    print(f"✅ 全ディレクトリの処理が完了しました")
@@ -10,7 +10,18 @@ class Config:
     OUTPUT_BASE_DIR = 'processed_data'  # 出力データのベースディレクトリ
     
     # 検出モード設定
-    DETECTION_MODE = 'normal'  # 'normal' または 'high'
+    DETECTION_MODE = 'normal'  # 'normal'、'high' または 'cascade'（normalで失敗したフレームのみhighで再検出）
+    
+    # 顔検出を行う画像の縮小率（1.0=フル解像度、0.5=縦横1/2で検出）
+    # ランドマーク予測は常にフル解像度の画像で行う
+    DETECTION_SCALE = 1.0
+    
+    # 時系列トラッキング設定（連番フレーム用）
+    TRACKING = {
+        'enabled': False,  # Trueでファイル名順に処理し、前フレームの結果から探索窓を予測する
+        'roi_margin': 0.5,  # 前フレームの顔領域に対する探索窓の余白（幅・高さに対する割合）
+        'chunk_size': 200,  # 1ワーカーが連続して処理するフレーム数
+    }
     
     # テンプレートランドマーク（検出失敗時用）
     TEMPLATE_LANDMARKS = np.array([
@@ -43,6 +54,119 @@ class Config:
         'beta': 5,  # 明るさを上げる
     }
     
+    # 前処理の段階別キャッシュの設定（preprocess_sweep.py でのパラメータのスイープに使用）
+    PREPROCESS_CACHE = {
+        'max_mb': 512,  # キャッシュする中間画像の合計サイズの上限（超えた分は最終参照の古い順に削除）
+    }
+    
+    # 成果物のバックグラウンド書き込みの設定（output_writer。ワーカープロセスごと）
+    WRITER = {
+        'enabled': True,  # 成功フレームの成果物を書き込みスレッドで書き込む（--sync-writes で無効化）
+        'threads': 2,  # 書き込みスレッド数
+        'max_queue': 16,  # 書き込み待ちの最大件数（満杯の場合はワーカーが空くまで待つ）
+        'coalesce': 8,  # 書き込みスレッドが1回にまとめて取り出す最大件数
+        'ack_timeout_s': 600,  # ディレクトリの完了時に書き込みの完了通知を待つ最大秒数（届かないフレームはエラー）
+    }
+    
+    # 正規化済みオリジナル画像・前処理済み画像の保存形式（frame_storage。圧縮はワーカーで行う）
+    FRAME_STORAGE = {
+        'format': 'npy',  # 'npy'（非圧縮）、'png'（可逆圧縮）または 'npz'（圧縮した .npy）
+        'codec': 'deflate',  # 'npz' の圧縮方式: 'deflate'、'bzip2' または 'lzma'
+        'level': 6,  # 圧縮レベル（png: 0-9、deflate/bzip2: 1-9。lzma は無視）
+    }
+    
+    # ワーカー数と同時実行数の設定（worker_scheduler）
+    WORKERS = {
+        'max_workers': None,  # ワーカー数を固定する場合に指定（--workers。指定時は自動調整しない）
+        'max_memory_mb': None,  # ワーカーに使うメモリの上限(MB)（--max-memory。None: 空きメモリ × memory_fraction）
+        'memory_fraction': 0.7,  # 上限を指定しない場合に使う空きメモリの割合
+        'model_mb': 150,  # ワーカー1つあたりのモデルとライブラリのメモリ(MB)
+        'bytes_per_pixel': 48,  # フレーム1画素あたりの作業領域（中間画像・アップサンプル・描画）のバイト数
+        'oversubscribe': 1.5,  # ワーカー数の上限（CPUコア数に対する倍率。I/O待ちの間も他のワーカーを動かす）
+        'adaptive': True,  # 処理速度を見ながら同時実行数を増減する
+        'window_s': 5.0,  # 処理速度を比較する区間の長さ（秒）
+        'tolerance': 0.05,  # 処理速度が改善したとみなす割合
+    }
+    
+    # ランドマーク検出サーバー（landmark_server.py）の設定
+    SERVER = {
+        'host': '127.0.0.1',  # 待ち受けるホスト（外部に公開しない）
+        'port': 8765,
+        'max_batch': 8,  # 1タスクにまとめる最大リクエスト数
+        'max_wait_ms': 5.0,  # 最初のリクエストからバッチを作るまでに待つ最大時間(ms)
+        'max_queue': 256,  # 受け付けて待たせておく最大リクエスト数（超えた分は 503 を返す）
+    }
+    
+    # クラスタモード（main.py --worker）の作業キューの設定
+    CLUSTER = {
+        'batch_frames': 256,  # 1バッチ（ノードが一度に取得する単位）のフレーム数
+        'lease_seconds': 300,  # バッチのリース時間（秒）。延長されずに切れたバッチは他のノードが取得し直す
+        'max_attempts': 3,  # バッチを取得し直す最大回数（超えたバッチのフレームはエラーとして記録）
+        'poll_seconds': 10,  # 取得できるバッチが無い場合に他のノードの完了を待つ間隔（秒）
+    }
+    
+    # 保存する成果物の選択（Falseの成果物は計算もしない）
+    OUTPUTS = {
+        'orignorm': True,  # 正規化済みオリジナル画像 (_orignorm.npy。形式は FRAME_STORAGE)
+        'processed': True,  # 前処理済み画像 (_processed.npy。形式は FRAME_STORAGE)
+        'landmarks': True,  # ランドマーク (_landmarks.npy)
+        'comparison': True,  # 比較画像
+        'landmark_store': False,  # ディレクトリ単位のランドマークストア（landmark_store/）
+    }
+    
+    # 複数フレームを積み重ねた入力 (T, H, W) の設定
+    STACK_INPUT = {
+        'mode': 'auto',  # 'auto'（4次元、または最後の次元が3/4でない3次元をスタックとする）、'always' または 'never'
+        'chunk_frames': 64,  # 1タスクで処理するスタック内の連続フレーム数
+    }
+    
+    # 検出失敗フレームのランドマーク補完設定（ファイル名順の前後の成功フレームから補完）
+    FALLBACK = {
+        'mode': 'nearest',  # 'previous'（直前の成功フレーム）、'nearest'（前後で近い方）または 'interpolate'（前後の線形補間）
+    }
+    
+    # プロファイリング設定（段階別の処理時間を profile.json / profile_*.csv に出力）
+    PROFILE = {
+        'enabled': False,
+        'cprofile': False,  # Trueでワーカーごとに cProfile の結果も出力する
+    }
+    
+    # 共有メモリのフレームリングバッファ設定
+    # 検出失敗フレームの比較画像を描き直す際に、ワーカーが作成した画像を
+    # ディスクから読み直さずに共有メモリ経由で受け取る
+    SHARED_FRAMES = {
+        'enabled': True,
+        'slots_per_worker': 2,  # ワーカー1つあたりのスロット数（空きが無い場合はディスク経由）
+    }
+    
+    # 検出キャッシュ設定（前処理済み画像の内容と検出設定をキーに検出結果を再利用する）
+    # 出力先や BOUNDING_BOX_SCALE_X/Y だけを変えて処理し直す場合に顔検出を省略できる
+    DETECTION_CACHE = {
+        'enabled': False,
+        'path': 'detection_cache.sqlite',  # SQLite ファイルのパス（出力先を変えても共有できるよう出力先の外に置く）
+        'max_entries': 1000000,  # 最大エントリ数（超えた分は最終参照の古い順に削除）
+    }
+    
+    # 再実行設定（manifest.json に記録された処理済みフレームをスキップする）
+    RESUME = {
+        'enabled': False,  # Trueで新規・変更・エラーのフレームのみ処理する
+        'content_hash': False,  # Trueでサイズ・更新日時に加えて内容のハッシュで変更を検知する
+    }
+    
+    # 比較画像の間引き設定
+    COMPARISON_SAMPLING = {
+        'every_n': 1,  # Nフレームごとに1枚保存（1=全フレーム、失敗フレームは常に保存）
+        'failures_only': False,  # Trueで検出失敗フレームのみ保存
+    }
+    
+    # 比較画像の描画設定
+    RENDERING = {
+        'backend': 'opencv',  # 'opencv'（高速）または 'matplotlib'（論文用の出力）
+        'format': 'png',  # 'png' または 'jpg'（opencvバックエンドのみ）
+        'png_compression': 3,  # PNGの圧縮レベル (0-9)
+        'jpeg_quality': 90,  # JPEGの品質 (0-100)
+    }
+    
     # バウンディングボックス表示設定
     BOUNDING_BOX_SCALE_X = 0.8  # バウンディングボックスの横幅倍率 (1.0=100%, 1.2=120%など)
     BOUNDING_BOX_SCALE_Y = 0.9  # バウンディングボックスの縦幅倍率 (1.0=100%, 1.2=120%など)
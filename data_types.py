@@ -1,7 +1,7 @@
 """データ型定義モジュール"""
 
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 
 
@@ -12,6 +12,15 @@ class DetectionInfo:
     reason: str
 
 
+@dataclass
+class FaceDetection:
+    """顔検出（ランドマーク予測前）の結果"""
+    rects: List[Tuple[int, int, int, int]]  # 調整前の検出矩形 (x, y, width, height)（画像全体の座標、検出順）
+    best_upsample: Optional[int]
+    detection_info: List[DetectionInfo]
+    had_error: bool = False  # 検出中に例外が発生したかどうか
+
+
 @dataclass
 class DetectionResult:
     """ランドマーク検出の結果"""
@@ -20,6 +29,35 @@ class DetectionResult:
     detection_info: List[DetectionInfo]
     is_detected: bool
     bounding_box: Optional[Tuple[int, int, int, int]] = None  # (x, y, width, height)
+    face_rect: Optional[Tuple[int, int, int, int]] = None  # 調整前の検出矩形 (x, y, width, height)
+    roi_used: bool = False  # 探索窓（ROI）内で検出したかどうか
+
+
+@dataclass
+class WorkerStats:
+    """ワーカープロセスの統計情報"""
+    pid: int
+    model_load_time: float  # モデルロードに要した時間（秒）
+    memory_mb: Optional[float] = None  # メモリ使用量（MB）
+
+
+@dataclass
+class WorkerPlan:
+    """ワーカープールの大きさと同時実行数の計画"""
+    pool_size: int  # ワーカープロセス数
+    initial_limit: int  # 同時に実行するタスク数の初期値
+    budget_mb: Optional[float]  # ワーカーに使えるメモリ(MB)（不明な場合は None）
+    task_mb: float  # ワーカー1つあたりの推定メモリ(MB)（モデル + フレームの作業領域）
+    adaptive: bool  # 処理速度に応じて同時実行数を調整するかどうか
+    reason: str  # ワーカー数を決めた要因（表示用）
+
+
+@dataclass
+class SharedFrame:
+    """共有メモリのリングバッファに書き込んだ画像の情報"""
+    slot: int
+    orig_shape: Tuple[int, ...]  # 正規化済みオリジナル画像の形状
+    processed_shape: Tuple[int, ...]  # 前処理済み画像の形状
 
 
 @dataclass
@@ -29,3 +67,32 @@ class ProcessResult:
     message: str
     best_upsample: Optional[int]
     detection_info: List[DetectionInfo]
+    worker_stats: Optional[WorkerStats] = None
+    roi_used: bool = False  # トラッキングの探索窓（ROI）で検出したかどうか
+    deferred: bool = False  # カスケードモードの1段目で失敗し、2段目に回されたかどうか
+    error: bool = False  # 処理中に例外が発生したかどうか（再実行時に再処理される）
+    shared_frame: Optional[SharedFrame] = None  # 比較画像の描き直し用に共有メモリに置いた画像
+    landmarks: Optional[np.ndarray] = None  # 検出したランドマーク (68, 2)（検出成功時のみ）
+    comparison_saved: bool = False  # ワーカーが比較画像を保存したかどうか
+    timings: Optional[Dict[str, float]] = None  # 段階ごとの処理時間（秒、プロファイリング時のみ）
+    face_rect: Optional[Tuple[int, int, int, int]] = None  # 調整前の検出矩形 (x, y, width, height)
+    write_ticket: Optional[str] = None  # バックグラウンドの書き込みのチケット（完了通知を待ってからマニフェストに記録する）
+
+
+@dataclass
+class RenderRequest:
+    """検出失敗フレームの比較画像を補完したランドマークで描き直す依頼"""
+    frame_id: str  # 画像ファイルパス または スタック内のフレームID
+    landmarks: np.ndarray  # 補完したランドマーク (68, 2)
+    comparison_path: str
+    orignorm_path: str
+    processed_path: str
+    shared_frame: Optional[SharedFrame] = None  # 共有メモリに置かれた画像（ある場合）
+
+
+@dataclass
+class BatchResult:
+    """バッチ推論の結果"""
+    landmarks: np.ndarray  # (N, 68, 2) int32（検出失敗時はテンプレート）
+    is_detected: np.ndarray  # (N,) bool
+    bounding_boxes: np.ndarray  # (N, 4) int32 (x, y, width, height)（無い場合は -1）
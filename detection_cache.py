@@ -0,0 +1,231 @@
+"""内容アドレス方式の検出キャッシュモジュール
+
+前処理済み画像の内容のハッシュと、検出結果に影響する設定のフィンガープリントを
+キーとして、顔検出の結果（検出矩形、採用したアップサンプリング回数）と
+ランドマークを SQLite に保存する。出力先や表示用の設定だけを変えて同じフレームを
+処理し直す場合に、HOG による顔検出をやり直さずに済む。
+
+キーに含めるのは検出矩形に影響する項目（画像内容、アップサンプリング回数、
+DETECTION_SCALE、探索窓）のみで、ランドマークに影響する項目（学習済みモデル、
+BOUNDING_BOX_SCALE_X/Y）はランドマーク側のフィンガープリントとして別に記録する。
+後者だけが変わった場合はキャッシュの検出矩形からランドマーク予測のみやり直す。
+
+エントリ数が上限を超えると、最後に参照された時刻が古いものから削除する（LRU）。
+複数のワーカープロセスから同じファイルを使うため WAL モードで開き、
+接続はプロセスごとに作成する。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from data_types import DetectionInfo
+
+if TYPE_CHECKING:
+    from config import Config
+
+# 上限の確認を行う書き込み回数の間隔
+_EVICT_INTERVAL = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    key TEXT PRIMARY KEY,
+    face_rect TEXT,
+    best_upsample INTEGER,
+    detection_info TEXT NOT NULL,
+    landmark_fingerprint TEXT,
+    landmarks BLOB,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used);
+"""
+
+# プロセスごとに開いたキャッシュ（(PID, パス) ごと。fork 後に親の接続を使わないため）
+_caches: Dict[Tuple[int, str], 'DetectionCache'] = {}
+
+
+def frame_hash(img: np.ndarray) -> str:
+    """画像の内容のハッシュを返す（形状と型を含む）"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.shape}{img.dtype.str}".encode('ascii'))
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+
+def detection_fingerprint(config: 'Config', upsample_times: List[int]) -> str:
+    """検出矩形に影響する設定のフィンガープリントを返す
+
+    Args:
+        config: 設定オブジェクト
+        upsample_times: 試行するアップサンプリング回数（検出モードから決まる）
+    """
+    encoded = json.dumps([upsample_times, config.DETECTION_SCALE]).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def landmark_fingerprint(config: 'Config') -> str:
+    """検出矩形からランドマークを求める処理に影響する設定のフィンガープリントを返す"""
+    encoded = json.dumps([
+        config.LEARNED_MODEL_PATH, config.BOUNDING_BOX_SCALE_X, config.BOUNDING_BOX_SCALE_Y
+    ]).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+class CachedDetection:
+    """キャッシュから読み出した検出結果"""
+
+    def __init__(
+        self,
+        face_rect: Optional[Tuple[int, int, int, int]],
+        best_upsample: Optional[int],
+        detection_info: List[DetectionInfo],
+        landmark_fingerprint: Optional[str],
+        landmarks: Optional[np.ndarray]
+    ):
+        self.face_rect = face_rect  # 調整前の検出矩形 (x, y, width, height)。検出失敗時は None
+        self.best_upsample = best_upsample
+        self.detection_info = detection_info
+        self.landmark_fingerprint = landmark_fingerprint
+        self.landmarks = landmarks  # (68, 2) int32。予測に失敗した場合は None
+
+
+class DetectionCache:
+    """SQLite による検出キャッシュ"""
+
+    def __init__(self, path: str, max_entries: int):
+        """
+        Args:
+            path: SQLite ファイルのパス
+            max_entries: 保持する最大エントリ数
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hit_count = 0
+        self.miss_count = 0
+        self._writes_since_evict = 0
+        self._conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def make_key(
+        img: np.ndarray,
+        fingerprint: str,
+        roi: Optional[Tuple[int, int, int, int]] = None
+    ) -> str:
+        """キャッシュのキーを返す
+
+        Args:
+            img: 前処理済み画像
+            fingerprint: detection_fingerprint の値
+            roi: 探索窓 (left, top, right, bottom)
+        """
+        key = f"{frame_hash(img)}:{fingerprint}"
+        if roi is not None:
+            key += ':' + ','.join(str(int(v)) for v in roi)
+        return key
+
+    def get(self, key: str) -> Optional[CachedDetection]:
+        """キャッシュを参照する（見つかった場合は最終参照時刻を更新する）"""
+        row = self._conn.execute(
+            'SELECT face_rect, best_upsample, detection_info, landmark_fingerprint, landmarks '
+            'FROM detections WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        self._conn.execute('UPDATE detections SET last_used = ? WHERE key = ?', (time.time(), key))
+        face_rect, best_upsample, info, fingerprint, landmarks = row
+        return CachedDetection(
+            face_rect=tuple(json.loads(face_rect)) if face_rect else None,
+            best_upsample=best_upsample,
+            detection_info=[DetectionInfo(upsample=u, reason=r) for u, r in json.loads(info)],
+            landmark_fingerprint=fingerprint,
+            landmarks=(
+                np.frombuffer(landmarks, dtype=np.int32).reshape(-1, 2).copy()
+                if landmarks is not None else None
+            ),
+        )
+
+    def put(
+        self,
+        key: str,
+        face_rect: Optional[Tuple[int, int, int, int]],
+        best_upsample: Optional[int],
+        detection_info: List[DetectionInfo],
+        fingerprint: Optional[str] = None,
+        landmarks: Optional[np.ndarray] = None
+    ) -> None:
+        """検出結果を保存する
+
+        Args:
+            key: make_key の値
+            face_rect: 調整前の検出矩形 (x, y, width, height)。検出失敗時は None
+            best_upsample: 採用したアップサンプリング回数
+            detection_info: 各アップサンプリング回数での検出情報
+            fingerprint: landmark_fingerprint の値
+            landmarks: ランドマーク (68, 2)
+        """
+        self._conn.execute(
+            'INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (
+                key,
+                json.dumps([int(v) for v in face_rect]) if face_rect is not None else None,
+                best_upsample,
+                json.dumps([[info.upsample, info.reason] for info in detection_info], ensure_ascii=False),
+                fingerprint,
+                np.ascontiguousarray(landmarks, dtype=np.int32).tobytes() if landmarks is not None else None,
+                time.time(),
+            )
+        )
+        self._writes_since_evict += 1
+        if self._writes_since_evict >= _EVICT_INTERVAL:
+            self.evict()
+
+    def evict(self) -> int:
+        """上限を超えたエントリを最終参照時刻の古い順に削除する
+
+        Returns:
+            削除したエントリ数
+        """
+        self._writes_since_evict = 0
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM detections').fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        self._conn.execute(
+            'DELETE FROM detections WHERE key IN '
+            '(SELECT key FROM detections ORDER BY last_used LIMIT ?)', (excess,)
+        )
+        return excess
+
+    def stats(self) -> Dict[str, Any]:
+        """エントリ数とこのプロセスでのヒット数・ミス数を返す"""
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM detections').fetchone()
+        return {'entries': count, 'hits': self.hit_count, 'misses': self.miss_count}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def get_cache(config: 'Config') -> Optional[DetectionCache]:
+    """設定に対応するキャッシュを返す（無効な場合は None。プロセスごとにキャッシュ）"""
+    settings = config.DETECTION_CACHE
+    if not settings['enabled']:
+        return None
+    path = os.path.abspath(settings['path'])
+    cache_key = (os.getpid(), path)
+    cache = _caches.get(cache_key)
+    if cache is None:
+        cache = _caches[cache_key] = DetectionCache(path, settings['max_entries'])
+    return cache
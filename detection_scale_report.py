@@ -0,0 +1,135 @@
+"""検出縮小率の精度・速度比較レポート
+
+フル解像度での検出（現行の処理）を基準として、DETECTION_SCALE を変えた場合の
+ランドマーク誤差と検出時間を比較する。
+
+使用例:
+    python detection_scale_report.py --dir folder1 --scales 0.75 0.5 0.35 --limit 200
+"""
+
+import os
+import csv
+import glob
+import time
+import argparse
+import copy
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from image_processor import preprocess_image
+from landmark_detector import detect_landmarks
+import model_registry
+
+
+def build_report(
+    img_files: List[str],
+    scales: List[float],
+    config: Config
+) -> List[Dict[str, float]]:
+    """縮小率ごとの精度と速度を計測する
+
+    Args:
+        img_files: 入力画像ファイルのリスト
+        scales: 比較する縮小率のリスト
+        config: 設定オブジェクト
+
+    Returns:
+        縮小率ごとの集計結果のリスト（先頭はフル解像度の基準）
+    """
+    predictor = model_registry.get_predictor(config.LEARNED_MODEL_PATH)
+    detector = model_registry.get_detector()
+
+    all_scales = [1.0] + [scale for scale in scales if scale != 1.0]
+    configs = {}
+    for scale in all_scales:
+        scaled_config = copy.copy(config)
+        scaled_config.DETECTION_SCALE = scale
+        configs[scale] = scaled_config
+
+    times: Dict[float, List[float]] = {scale: [] for scale in all_scales}
+    detected: Dict[float, int] = {scale: 0 for scale in all_scales}
+    agreements: Dict[float, int] = {scale: 0 for scale in all_scales}
+    errors: Dict[float, List[float]] = {scale: [] for scale in all_scales}
+
+    for img_file in img_files:
+        processed = preprocess_image(np.load(img_file), config)
+        reference: Optional[np.ndarray] = None
+
+        for scale in all_scales:
+            start = time.perf_counter()
+            result = detect_landmarks(processed, predictor, configs[scale], detector=detector)
+            times[scale].append(time.perf_counter() - start)
+
+            is_detected = result.is_detected and len(result.landmarks_list) > 0
+            if scale == 1.0:
+                reference = result.landmarks_list[0] if is_detected else None
+            if is_detected:
+                detected[scale] += 1
+            if is_detected == (reference is not None):
+                agreements[scale] += 1
+            if is_detected and reference is not None:
+                # 基準とのランドマーク誤差（各点のユークリッド距離の平均）
+                diff = result.landmarks_list[0].astype(np.float64) - reference
+                errors[scale].append(float(np.linalg.norm(diff, axis=1).mean()))
+
+    rows = []
+    base_time = np.mean(times[1.0]) if times[1.0] else 0.0
+    for scale in all_scales:
+        mean_time = float(np.mean(times[scale])) if times[scale] else 0.0
+        rows.append({
+            'scale': scale,
+            'frames': len(img_files),
+            'detection_rate': detected[scale] / len(img_files) * 100 if img_files else 0.0,
+            'agreement_rate': agreements[scale] / len(img_files) * 100 if img_files else 0.0,
+            'mean_error_px': float(np.mean(errors[scale])) if errors[scale] else 0.0,
+            'max_error_px': float(np.max(errors[scale])) if errors[scale] else 0.0,
+            'mean_time_ms': mean_time * 1000,
+            'speedup': base_time / mean_time if mean_time > 0 else 0.0,
+        })
+    return rows
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description='検出縮小率の精度・速度比較レポート')
+    parser.add_argument('--dir', required=True, help='NIR画像(.npy)が含まれるディレクトリ')
+    parser.add_argument('--scales', nargs='+', type=float, default=[0.75, 0.5, 0.35],
+                        help='比較する縮小率（フル解像度は常に基準として含まれる）')
+    parser.add_argument('--mode', choices=['normal', 'high'], default='normal', help='検出モード')
+    parser.add_argument('--limit', type=int, help='使用する最大フレーム数')
+    parser.add_argument('--csv', help='結果を保存するCSVファイルのパス')
+    args = parser.parse_args()
+
+    img_files = sorted(glob.glob(os.path.join(args.dir, '*.npy')))
+    if args.limit:
+        img_files = img_files[:args.limit]
+    if not img_files:
+        print(f"エラー: {args.dir} 内に.npyファイルが見つかりません。")
+        exit(1)
+
+    config = Config()
+    config.DETECTION_MODE = args.mode
+    rows = build_report(img_files, args.scales, config)
+
+    print(f"\n{'='*86}")
+    print(f"📐 検出縮小率レポート（基準: フル解像度, {len(img_files)} フレーム）")
+    print(f"{'='*86}")
+    print(f"{'縮小率':>6} {'検出率':>8} {'一致率':>8} {'平均誤差px':>10} {'最大誤差px':>10} {'検出時間ms':>10} {'高速化':>6}")
+    for row in rows:
+        print(f"{row['scale']:>8.2f} {row['detection_rate']:>9.1f}% {row['agreement_rate']:>9.1f}% "
+              f"{row['mean_error_px']:>12.2f} {row['max_error_px']:>12.2f} "
+              f"{row['mean_time_ms']:>12.1f} {row['speedup']:>7.2f}x")
+    print(f"{'='*86}")
+
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"レポートを {args.csv} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,180 +1,911 @@
 """ディレクトリ処理モジュール"""
 
 import os
+import copy
 import glob
 import numpy as np
-import multiprocessing
+from collections import deque
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Tuple, Optional
 
 from config import Config
 from logger import LogManager
-from data_types import DetectionInfo
-from image_utils import setup_directories, visualize_comparison
-from processor import process_image_wrapper
+from data_types import DetectionInfo, FaceDetection, ProcessResult, RenderRequest, SharedFrame, WorkerStats
+from image_utils import comparison_filename, setup_directories
+from processor import process_image_wrapper, process_sequence_wrapper, render_fallback_wrapper
+from frame_source import frame_base_name, frame_filename, list_frames, split_frame_id
+from model_registry import init_worker
+from landmark_store import LandmarkStore, get_store_dir
+from frame_ring import FrameRing, estimate_slot_bytes
+from frame_storage import STORAGE_EXTENSIONS, frame_path, frame_paths
+from landmark_fallback import FallbackFiller
+from profiler import ProfileCollector
+from output_writer import WriteFailures, get_ack_queue, take_write_acks
+from manifest import Manifest, artifact_fingerprints, config_fingerprint, file_signature, rect_fingerprint
+from worker_scheduler import ConcurrencyController, get_cpu_workers, plan_workers, print_plan
 
+# (実行する関数, 引数タプル) の組
+Task = Tuple[Callable[..., Any], tuple]
+
+DETECTION_RESULTS_HEADER = "ファイル名,最適なパラメータ,検出結果\n"
+
+
+def format_detection_result(base_name: str, best_upsample: Optional[int], success: bool) -> str:
+    """detection_results.txt の1行を返す"""
+    result_filename = f"{base_name}{'_ng' if not success else ''}.npy"
+    if best_upsample is not None:
+        line = f"{result_filename},upsample:{best_upsample}"
+    else:
+        line = f"{result_filename},検出失敗"
+    return f"{line},{'成功' if success else '失敗'}\n"
+
+
+def get_max_workers() -> int:
+    """使用するワーカー数を返す（CPUコア数 - 2、最低1）
+
+    メモリを考慮したワーカー数は worker_scheduler.plan_workers で決める。
+    """
+    return get_cpu_workers()
+
+
+def create_executor(
+    config: Config,
+    max_workers: Optional[int] = None,
+    ring: Optional[FrameRing] = None
+) -> ProcessPoolExecutor:
+    """モデルを常駐させたワーカープールを作成する
 
-def process_directory(input_dir: str, detection_mode: str = 'normal') -> None:
-    """ディレクトリ内のすべての画像を処理する
-    
     Args:
-        input_dir: 入力ディレクトリパス
-        detection_mode: 検出モード ('normal' または 'high')
+        config: 設定オブジェクト
+        max_workers: ワーカー数（未指定時は get_max_workers() の値）
+        ring: ワーカーが接続する共有メモリのフレームリング（オプション）
+
+    Returns:
+        ProcessPoolExecutor: ワーカープール
     """
-    config = Config()
-    config.DETECTION_MODE = detection_mode
-    log_manager = LogManager()
-    
-    not_detected: List[Tuple[str, str, List[DetectionInfo]]] = []
-    detection_results: List[Tuple[str, Optional[int], bool]] = []
-    last_successful_landmarks: Optional[np.ndarray] = None
-    
-    # 入力ディレクトリ内の.npyファイルを取得
-    img_files = glob.glob(os.path.join(input_dir, '*.npy'))
-    if not img_files:
-        print(f"エラー: {input_dir} 内に.npyファイルが見つかりません。")
-        return
-    
-    # 出力ディレクトリの設定
-    orignorm_dir, processed_dir, landmarks_dir = setup_directories(
-        config.OUTPUT_BASE_DIR, input_dir
+    # モデルはワーカーごとに1回だけロードする
+    return ProcessPoolExecutor(
+        max_workers=max_workers or get_max_workers(),
+        initializer=init_worker,
+        initargs=(config.LEARNED_MODEL_PATH, ring.spec if ring is not None else None, get_ack_queue())
     )
-    
-    # CPUコア数を取得
-    if multiprocessing.cpu_count() > 2:
-        max_workers = multiprocessing.cpu_count() - 2
-    else:
-        max_workers = 1
-    
-    # 画像処理の実行
-    args_list = [
-        (img_file, orignorm_dir, processed_dir, landmarks_dir, config)
-        for img_file in img_files
-    ]
-    
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {
-            executor.submit(process_image_wrapper, args): args[0]
-            for args in args_list
-        }
-        
-        # 進捗バーの設定
-        pbar = tqdm(total=len(future_to_file), desc="画像処理中", 
-                   bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]')
-        
-        success_count = 0
-        failure_count = 0
-        
-        for future in as_completed(future_to_file):
-            img_file = future_to_file[future]
-            base_filename = os.path.basename(img_file).replace('.npy', '')
-            
+
+
+def create_frame_ring(
+    config: Config,
+    jobs: List['DirectoryJob'],
+    max_workers: int
+) -> Optional[FrameRing]:
+    """検出失敗フレームの受け渡しに使う共有メモリのフレームリングを作成する
+
+    スロットの大きさは各ディレクトリの先頭フレームから決める。
+    比較画像を保存しない場合や、設定で無効化されている場合は作成しない。
+
+    Args:
+        config: 設定オブジェクト
+        jobs: prepare済みのディレクトリ
+        max_workers: ワーカー数
+
+    Returns:
+        FrameRing: フレームリング（作成しない場合は None）
+    """
+    shared = config.SHARED_FRAMES
+    if not shared['enabled'] or not config.OUTPUTS['comparison'] or not jobs:
+        return None
+    slot_bytes = estimate_slot_bytes(job.all_files[0] for job in jobs)
+    num_slots = max(1, max_workers * shared['slots_per_worker'])
+    return FrameRing.create(slot_bytes, num_slots)
+
+
+def print_worker_stats(worker_stats: Dict[int, WorkerStats]) -> None:
+    """ワーカーごとのモデルロード時間とメモリ使用量を表示する
+
+    Args:
+        worker_stats: PIDをキーとしたワーカー統計情報
+    """
+    if not worker_stats:
+        return
+    load_times = [stats.model_load_time for stats in worker_stats.values()]
+    memories = [stats.memory_mb for stats in worker_stats.values() if stats.memory_mb is not None]
+    print(f"🧠 ワーカー統計:")
+    print(f"   • ワーカー数: {len(worker_stats)}")
+    print(f"   • モデルロード時間: 平均 {sum(load_times)/len(load_times):.2f}秒 / 最大 {max(load_times):.2f}秒")
+    if memories:
+        print(f"   • ワーカーメモリ: 平均 {sum(memories)/len(memories):.1f}MB / 最大 {max(memories):.1f}MB")
+    print(f"")
+
+
+class DirectoryJob:
+    """1ディレクトリ分の処理状態を管理するクラス
+
+    タスクの生成、結果の集計、サマリーファイルの書き出しを担当する。
+    ワーカープールの管理は run_jobs 側で行うため、複数ディレクトリで
+    1つのプールを共有できる。
+    """
+
+    def __init__(self, input_dir: str, config: Config, log_manager: Optional[LogManager] = None):
+        self.input_dir = input_dir
+        self.config = config
+        self.log_manager = log_manager or LogManager()
+        self.prepared: Optional[bool] = None  # prepare の結果（未実行の場合は None）
+
+        # 画像ファイルパスまたはスタック内のフレームID（frame_source.make_frame_id）
+        self.all_files: List[str] = []
+        self.img_files: List[str] = []  # 今回処理するフレーム（再実行時は新規・変更・エラーのみ）
+        self.output_dir = ''
+        self.orignorm_dir = ''
+        self.processed_dir = ''
+        self.landmarks_dir = ''
+        self.comparison_dir = ''
+        self.store: Optional[LandmarkStore] = None
+        self.frame_ring: Optional[FrameRing] = None  # ワーカーと共有するフレームリング（run側で設定）
+        self.manifest: Optional[Manifest] = None
+        self.signatures: Dict[str, Dict[str, Any]] = {}
+        self.artifacts = artifact_fingerprints(config)  # 現在の出力の設定の成果物ごとのフィンガープリント
+        # 出力の設定だけが変わったフレームの記録済みの顔検出の結果（顔検出を省略して成果物を作り直す）
+        self.recorded: Dict[str, FaceDetection] = {}
+        # 書き込みの完了通知を待っているフレーム（チケット -> (フレーム, マニフェストに記録する内容)）
+        self.unacked_writes: Dict[str, Tuple[str, Optional[tuple]]] = {}
+        self.write_error_count = 0
+
+        self.not_detected: List[Tuple[str, str, List[DetectionInfo]]] = []
+        self.detection_results: List[Tuple[str, Optional[int], bool]] = []
+        self.worker_stats: Dict[int, WorkerStats] = {}
+        self.success_count = 0
+        self.failure_count = 0
+        self.roi_hit_count = 0
+        self.resumed_success_count = 0
+        self.resumed_failure_count = 0
+
+        # カスケードモード: 1段目で失敗したフレームを high モードで再検出する
+        self.retry_config: Optional[Config] = None
+        if config.DETECTION_MODE == 'cascade':
+            self.retry_config = copy.copy(config)
+            self.retry_config.DETECTION_MODE = 'high'
+            self.retry_config.TRACKING = {**config.TRACKING, 'enabled': False}
+        self.first_pass_info: Dict[str, List[DetectionInfo]] = {}
+        self.first_pass_timings: Dict[str, Dict[str, float]] = {}
+        self.frame_indices: Dict[str, int] = {}
+        self.followup_tasks: Deque[Task] = deque()
+        self.retry_success_count = 0
+
+        # 検出失敗フレームの補完（ファイル名順で前後の成功フレームが確定した時点で行う）
+        self.fallback = FallbackFiller(config.FALLBACK['mode'])
+        self.filled_count = 0
+        self.pending_renders = 0  # ワーカーで描き直し中の比較画像の数
+
+        # 段階別の処理時間の集計（config.PROFILE['enabled'] の場合のみ）
+        self.profile: Optional[ProfileCollector] = None
+        self.profile_path: Optional[str] = None
+
+    @property
+    def total(self) -> int:
+        """処理対象の画像数"""
+        return len(self.img_files)
+
+    @property
+    def completed(self) -> int:
+        """処理済みの画像数"""
+        return self.success_count + self.failure_count
+
+    @property
+    def is_done(self) -> bool:
+        """全画像の処理、成果物の書き込みと比較画像の描き直しが完了したかどうか"""
+        return (bool(self.prepared) and self.completed >= self.total and self.pending_renders == 0
+                and not self.unacked_writes)
+
+    def prepare(self) -> bool:
+        """入力ファイルの列挙と出力ディレクトリの作成を行う
+
+        複数フレームのスタック (T, H, W) はフレーム単位に展開する。
+        再実行モード（config.RESUME['enabled']）では、マニフェストに記録された
+        処理済みフレームのうち入力と設定が変わっていないものを処理対象から外し、
+        その結果をサマリーに引き継ぐ。検出結果に影響しない出力の設定だけが変わった
+        フレームは、記録済みの検出結果を使い、顔検出を行わずに成果物だけを作り直す。
+        2回目以降の呼び出しでは列挙をやり直さず、最初の結果を返す。
+
+        Returns:
+            処理対象の画像が存在する場合True
+        """
+        if self.prepared is None:
+            self.prepared = self._prepare()
+        return self.prepared
+
+    def _prepare(self) -> bool:
+        """prepare の本体"""
+        # 入力ディレクトリ内の.npyファイルをファイル名順に取得し、フレーム単位に展開
+        self.all_files = list_frames(
+            sorted(glob.glob(os.path.join(self.input_dir, '*.npy'))), self.config
+        )
+        if not self.all_files:
+            tqdm.write(f"エラー: {self.input_dir} 内に.npyファイルが見つかりません。")
+            return False
+
+        # 出力ディレクトリの設定
+        self.orignorm_dir, self.processed_dir, self.landmarks_dir = setup_directories(
+            self.config.OUTPUT_BASE_DIR, self.input_dir
+        )
+        self.output_dir = os.path.dirname(self.orignorm_dir)
+        self.comparison_dir = os.path.join(self.output_dir, 'comparisons')
+        self.frame_indices = {img_file: i for i, img_file in enumerate(self.all_files)}
+        self._setup_profile()
+
+        # マニフェストを読み込み、処理が必要なフレームを選ぶ
+        resume = self.config.RESUME
+        self.manifest = Manifest.load(
+            self.output_dir, config_fingerprint(self.config), rect_fingerprint(self.config)
+        )
+        self.img_files = []
+        file_signatures: Dict[str, Dict[str, Any]] = {}  # スタックはファイルごとに1回だけ計算する
+        for img_file in self.all_files:
+            path, _ = split_frame_id(img_file)
+            signature = file_signatures.get(path)
+            if signature is None:
+                signature = file_signatures[path] = file_signature(path, resume['content_hash'])
+            entry = None
+            if resume['enabled']:
+                entry = self.manifest.get_valid_entry(frame_filename(img_file), signature)
+            if entry is not None and not self.manifest.has_artifacts(entry, self.artifacts):
+                recorded = self._recorded_detection(entry)
+                if recorded is not None:
+                    self.recorded[img_file] = recorded
+                entry = None
+            if entry is None:
+                self.img_files.append(img_file)
+                self.signatures[img_file] = signature
+                continue
+            # 前回の結果をサマリーに引き継ぐ
+            base_filename = frame_base_name(img_file)
+            frame_index = self.frame_indices[img_file]
+            is_detected = entry['status'] == 'detected'
+            if is_detected:
+                self.resumed_success_count += 1
+                # 今回の失敗フレームの補完に必要になった場合のみ読み込む
+                self.fallback.add_detected(
+                    frame_index,
+                    lambda img_file=img_file, frame_index=frame_index:
+                        self._load_saved_landmarks(img_file, frame_index)
+                )
+            else:
+                self.resumed_failure_count += 1
+                self.fallback.add_skipped(frame_index)
+            self._add_summary(base_filename, entry['best_upsample'], is_detected, entry['message'], [])
+
+        if resume['enabled']:
+            tqdm.write(f"再実行: {len(self.all_files) - len(self.img_files)} ファイルは処理済みのためスキップします"
+                       f"（処理対象: {len(self.img_files)} ファイル、"
+                       f"うち成果物のみ作り直し: {len(self.recorded)} ファイル）")
+
+        # ランドマークストアを事前確保する（各ワーカーが自分の行に書き込む）
+        if self.config.OUTPUTS['landmark_store']:
+            self.store = LandmarkStore.create(
+                get_store_dir(self.orignorm_dir),
+                [frame_filename(img_file) for img_file in self.all_files],
+                carry_over=resume['enabled']
+            )
+        return True
+
+    @staticmethod
+    def _recorded_detection(entry: Dict[str, Any]) -> Optional[FaceDetection]:
+        """マニフェストの記録から顔検出の結果を作る（検出矩形が記録されていない場合は None）"""
+        face_rect = entry.get('face_rect')
+        if entry['status'] == 'detected' and face_rect is None:
+            return None
+        return FaceDetection(
+            rects=[tuple(face_rect)] if face_rect is not None else [],
+            best_upsample=entry['best_upsample'],
+            detection_info=[]
+        )
+
+    def iter_tasks(self) -> Iterator[Task]:
+        """ワーカーに投入するタスクを順に返す
+
+        トラッキングモードでは連続するフレームを chunk_size 枚ずつまとめて
+        1つのタスクとし、ワーカー内でファイル名順に処理させる。
+        スタック内のフレームは STACK_INPUT['chunk_frames'] 枚ずつまとめ、
+        ワーカーが同じメモリマップから連続して読み込むようにする。
+        """
+        if self.config.TRACKING['enabled']:
+            chunk_size = max(1, self.config.TRACKING['chunk_size'])
+            for start in range(0, len(self.img_files), chunk_size):
+                chunk = self.img_files[start:start + chunk_size]
+                yield self._sequence_task(chunk)
+            return
+
+        chunk_frames = max(1, self.config.STACK_INPUT['chunk_frames'])
+        chunk: List[str] = []
+        for img_file in self.img_files:
+            path, index = split_frame_id(img_file)
+            if chunk and (len(chunk) >= chunk_frames or split_frame_id(chunk[0])[0] != path):
+                yield self._sequence_task(chunk)
+                chunk = []
+            if index is not None:
+                chunk.append(img_file)
+                continue
+            yield process_image_wrapper, (
+                img_file, self.orignorm_dir, self.processed_dir, self.landmarks_dir, self.config,
+                self.frame_indices[img_file], self.recorded.get(img_file)
+            )
+        if chunk:
+            yield self._sequence_task(chunk)
+
+    def _sequence_task(self, frames: List[str]) -> Task:
+        """連続するフレームを1つのワーカーで処理するタスクを返す"""
+        return process_sequence_wrapper, (
+            frames, self.orignorm_dir, self.processed_dir, self.landmarks_dir, self.config,
+            [self.frame_indices[frame] for frame in frames],
+            [self.recorded.get(frame) for frame in frames]
+        )
+
+    def handle_output(self, args: tuple, output) -> None:
+        """ワーカーの処理結果を集計する
+
+        Args:
+            args: タスクの引数タプル
+            output: 処理結果（トラッキングモードとスタックでは処理結果のリスト、
+                比較画像の描き直しでは成功したかどうか）
+        """
+        if isinstance(args[0], RenderRequest):
+            self.pending_renders -= 1
+            return
+        if isinstance(args[0], list):
+            for img_file, frame_index, result in zip(args[0], args[5], output):
+                self._record_result(img_file, frame_index, result)
+        else:
+            self._record_result(args[0], args[5], output)
+
+    def _record_result(self, img_file: str, frame_index: int, result: ProcessResult) -> None:
+        """1画像分の処理結果を集計する
+
+        Args:
+            img_file: 画像ファイルパス または スタック内のフレームID
+            frame_index: ディレクトリ内でのフレーム番号
+            result: 処理結果
+        """
+        base_filename = frame_base_name(img_file)
+
+        if result.worker_stats is not None:
+            self.worker_stats[result.worker_stats.pid] = result.worker_stats
+        if result.roi_used:
+            self.roi_hit_count += 1
+        if result.deferred:
+            # カスケード1段目の失敗: 集計せずに2段目のタスクを予約する
+            # （処理時間は2段目の結果と合算して1フレームとして記録する）
+            self.first_pass_info[img_file] = result.detection_info
+            if result.timings:
+                self.first_pass_timings[img_file] = result.timings
+            self.followup_tasks.append((process_image_wrapper, (
+                img_file, self.orignorm_dir, self.processed_dir, self.landmarks_dir, self.retry_config,
+                frame_index
+            )))
+            return
+        if img_file in self.first_pass_info:
+            # カスケード2段目の結果: 1段目の検出情報と統合する
+            result.detection_info = self.first_pass_info.pop(img_file) + result.detection_info
+            if result.is_detected:
+                self.retry_success_count += 1
+        if self.profile is not None:
+            timings = result.timings
+            first_pass = self.first_pass_timings.pop(img_file, None)
+            if first_pass:
+                timings = dict(first_pass)
+                for stage_name, seconds in (result.timings or {}).items():
+                    timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+            self.profile.add(base_filename, timings)
+
+        # マニフェストに記録し、前回と検出結果が変わった場合は古い成果物を削除する
+        # （バックグラウンドで書き込み中のフレームは、書き込みの完了通知を受けてから記録する）
+        record_args = None
+        if self.manifest is not None:
+            filename = frame_filename(img_file)
+            previous = self.manifest.entries.get(filename)
+            if previous is not None and (previous['status'] == 'detected') != result.is_detected:
+                self._remove_outputs(base_filename, '' if previous['status'] == 'detected' else '_ng')
+            elif previous is not None:
+                self._remove_stale_frames(base_filename, '' if result.is_detected else '_ng')
+            if result.error:
+                status = 'error'
+            else:
+                status = 'detected' if result.is_detected else 'not_detected'
+            record_args = (
+                filename, self.signatures[img_file], status, result.best_upsample, result.message,
+                result.face_rect, None if result.error else self.artifacts
+            )
+        if result.write_ticket is not None:
+            self.unacked_writes[result.write_ticket] = (img_file, record_args)
+        elif record_args is not None:
+            self.manifest.record(*record_args)
+
+        if result.is_detected:
+            # 成功時
+            self.success_count += 1
+            tqdm.write(f"✅ 成功: {base_filename}")
+            if result.landmarks is not None:
+                resolved = self.fallback.add_detected(frame_index, result.landmarks)
+            else:
+                resolved = self.fallback.add_skipped(frame_index)
+        else:
+            # 失敗時
+            self.failure_count += 1
+            tqdm.write(f"❌ 失敗: {base_filename} - {result.message}")
+            if result.error:
+                # 処理エラーのフレームは成果物が無いため補完しない
+                self._release_shared_frame(result.shared_frame)
+                resolved = self.fallback.add_skipped(frame_index)
+            else:
+                # ファイル名順の前後の成功フレームが確定した時点で補完する
+                resolved = self.fallback.add_failed(
+                    frame_index, (img_file, frame_index, result.comparison_saved, result.shared_frame)
+                )
+
+        self._add_summary(
+            base_filename, result.best_upsample, result.is_detected,
+            result.message, result.detection_info
+        )
+        self._apply_fallback(resolved)
+        if self._all_results_recorded():
+            self.finish_fallback()
+
+    def acknowledge_writes(self, acks: Dict[str, WriteFailures]) -> None:
+        """書き込みの完了通知を受け取ったフレームをマニフェストに記録する
+
+        書き込みに失敗したフレームはエラーとして記録し、再実行時に処理し直されるようにする。
+
+        Args:
+            acks: チケットごとの失敗した書き込み（このディレクトリのチケットは取り除く）
+        """
+        for ticket in [ticket for ticket in acks if ticket in self.unacked_writes]:
+            failures = acks.pop(ticket)
+            img_file, record_args = self.unacked_writes.pop(ticket)
+            if failures:
+                path, error = failures[0]
+                record_args = self._write_failed(img_file, f"書き込みエラー: {path} - {error}")
+            if record_args is not None:
+                self.manifest.record(*record_args)
+
+    def abandon_writes(self) -> None:
+        """完了通知が届かなかったフレームを書き込みエラーとして記録する"""
+        for img_file, _ in self.unacked_writes.values():
+            record_args = self._write_failed(img_file, "書き込みエラー: 書き込みの完了通知が届きませんでした")
+            if record_args is not None:
+                self.manifest.record(*record_args)
+        self.unacked_writes.clear()
+
+    def _write_failed(self, img_file: str, message: str) -> Optional[tuple]:
+        """書き込みに失敗したフレームを集計し、マニフェストに記録する内容を返す"""
+        self.write_error_count += 1
+        self.log_manager.log_error(f"{frame_base_name(img_file)} - {message}")
+        tqdm.write(f"❌ エラー: {frame_base_name(img_file)} - {message}")
+        if self.manifest is None:
+            return None
+        return frame_filename(img_file), self.signatures[img_file], 'error', None, message
+
+    def _all_results_recorded(self) -> bool:
+        """全フレームの結果が揃ったかどうか（残りの失敗フレームの補完を確定させる）"""
+        return self.completed >= self.total
+
+    def finish_fallback(self) -> None:
+        """次の成功フレームが無い残りの失敗フレームを直前の成功フレームで補完する"""
+        self._apply_fallback(self.fallback.finish())
+
+    def _apply_fallback(self, resolved: List[Tuple[Any, Optional[np.ndarray]]]) -> None:
+        """補完したランドマークを保存し、比較画像の描き直しをワーカーに依頼する
+
+        Args:
+            resolved: FallbackFiller が返した (失敗フレームの情報, 補完したランドマーク) のリスト
+        """
+        outputs = self.config.OUTPUTS
+        for (img_file, frame_index, comparison_saved, shared_frame), landmarks in resolved:
+            if landmarks is None:
+                # 補完に使える成功フレームが無い場合はテンプレートのまま
+                self._release_shared_frame(shared_frame)
+                continue
+            self.filled_count += 1
+            base_filename = frame_base_name(img_file)
+            if outputs['landmarks']:
+                np.save(
+                    os.path.join(self.landmarks_dir, f"{base_filename}_landmarks_ng.npy"), landmarks
+                )
+            if self.store is not None:
+                self.store.landmarks[frame_index] = landmarks
+            if not comparison_saved:
+                self._release_shared_frame(shared_frame)
+                continue
+            # 比較画像の描き直しはワーカーで行う（共有メモリのスロットはワーカーが空きに戻す）
+            request = RenderRequest(
+                frame_id=img_file,
+                landmarks=landmarks,
+                comparison_path=os.path.join(
+                    self.comparison_dir, comparison_filename(base_filename, '_ng', self.config)
+                ),
+                orignorm_path=frame_path(self.orignorm_dir, base_filename, 'orignorm', '_ng', self.config),
+                processed_path=frame_path(self.processed_dir, base_filename, 'processed', '_ng', self.config),
+                shared_frame=shared_frame
+            )
+            self.followup_tasks.append((render_fallback_wrapper, (request, self.config)))
+            self.pending_renders += 1
+
+    def _release_shared_frame(self, shared_frame: Optional[SharedFrame]) -> None:
+        """使わなかった共有メモリのスロットを空きに戻す"""
+        if shared_frame is not None and self.frame_ring is not None:
+            self.frame_ring.release(shared_frame)
+
+    def _load_saved_landmarks(self, img_file: str, frame_index: int) -> Optional[np.ndarray]:
+        """前回の実行で保存された成功フレームのランドマークを読み込む（再実行時の補完用）"""
+        if self.store is not None:
+            return np.array(self.store.landmarks[frame_index])
+        landmarks_path = os.path.join(self.landmarks_dir, f"{frame_base_name(img_file)}_landmarks.npy")
+        if os.path.exists(landmarks_path):
+            return np.load(landmarks_path)
+        return None
+
+    def handle_failure(self, args: tuple, error: Exception) -> None:
+        """処理自体の例外を集計する
+
+        Args:
+            args: タスクの引数タプル
+            error: 発生した例外
+        """
+        if isinstance(args[0], RenderRequest):
+            self.pending_renders -= 1
+            self.log_manager.log_error(f"比較画像の描き直しエラー: {str(error)}")
+            return
+        img_files = args[0] if isinstance(args[0], list) else [args[0]]
+        frame_indices = args[5] if isinstance(args[0], list) else [args[5]]
+        error_msg = f"処理例外: {str(error)}"
+        self.log_manager.log_error(error_msg)
+        for img_file, frame_index in zip(img_files, frame_indices):
+            base_filename = frame_base_name(img_file)
+            if self.manifest is not None:
+                self.manifest.record(
+                    frame_filename(img_file), self.signatures[img_file], 'error', None, error_msg
+                )
+            self.failure_count += 1
+            tqdm.write(f"❌ エラー: {base_filename} - {error_msg}")
+            self._add_summary(base_filename, None, False, error_msg, [])
+            self._apply_fallback(self.fallback.add_skipped(frame_index))
+        if self._all_results_recorded():
+            self.finish_fallback()
+
+    def _setup_profile(self) -> None:
+        """プロファイリングが有効な場合、処理時間の集計を開始する"""
+        if self.config.PROFILE['enabled']:
+            self.profile = ProfileCollector(self.output_dir)
+
+    def _finish_profile(self) -> None:
+        """処理時間の集計結果を profile.json / profile_stages.csv に書き出す"""
+        if self.profile is not None:
+            self.profile_path = self.profile.write()
+
+    def _remove_outputs(self, base_filename: str, suffix: str) -> None:
+        """前回の実行で保存された成果物を削除する
+
+        Args:
+            base_filename: 入力ファイルのベース名
+            suffix: 削除する成果物の接尾辞（'' または '_ng'）
+        """
+        # orignorm / processed は前回と保存形式が異なる場合があるため、すべての形式を削除する
+        paths = [
+            *frame_paths(os.path.join(self.orignorm_dir, f"{base_filename}_orignorm{suffix}.npy")),
+            *frame_paths(os.path.join(self.processed_dir, f"{base_filename}_processed{suffix}.npy")),
+            os.path.join(self.landmarks_dir, f"{base_filename}_landmarks{suffix}.npy"),
+            os.path.join(self.comparison_dir, f"{base_filename}_comparison{suffix}.png"),
+            os.path.join(self.comparison_dir, f"{base_filename}_comparison{suffix}.jpg"),
+        ]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _remove_stale_frames(self, base_filename: str, suffix: str) -> None:
+        """前回の実行で別の保存形式で保存された orignorm / processed を削除する
+
+        Args:
+            base_filename: 入力ファイルのベース名
+            suffix: 成果物の接尾辞（'' または '_ng'）
+        """
+        keep = {STORAGE_EXTENSIONS[self.config.FRAME_STORAGE['format']]}
+        if self.config.FRAME_STORAGE['format'] == 'png':
+            keep.add(STORAGE_EXTENSIONS['npz'])  # PNG にできない画像は .npz で保存される
+        for directory, kind in ((self.orignorm_dir, 'orignorm'), (self.processed_dir, 'processed')):
+            for path in frame_paths(frame_path(directory, base_filename, kind, suffix)):
+                if os.path.splitext(path)[1] not in keep and os.path.exists(path):
+                    os.remove(path)
+
+    def _add_summary(
+        self,
+        base_filename: str,
+        best_upsample: Optional[int],
+        is_detected: bool,
+        message: str,
+        detection_info: List[DetectionInfo]
+    ) -> None:
+        """サマリー（detection_results.txt / not_detected.txt）用の結果を追加する"""
+        self.detection_results.append((base_filename, best_upsample, is_detected))
+        if not is_detected:
+            self.not_detected.append((base_filename, message, detection_info))
+
+    def finalize(self) -> None:
+        """検出結果ファイルの書き出しとサマリーの表示を行う"""
+        config = self.config
+        if self.store is not None:
+            self.store.flush()
+        if self.manifest is not None:
+            self.manifest.save()
+
+        # サマリーはファイル名順に書き出す（再実行時の引き継ぎ分を含む）
+        self.detection_results.sort(key=lambda item: item[0])
+        self.not_detected.sort(key=lambda item: item[0])
+
+        # 検出結果をファイルに保存
+        result_file = os.path.join(config.OUTPUT_BASE_DIR, 'detection_results.txt')
+        with open(result_file, 'w', encoding='utf-8') as f:
+            f.write(DETECTION_RESULTS_HEADER)
+            for base_name, best_upsample, success in self.detection_results:
+                f.write(format_detection_result(base_name, best_upsample, success))
+
+        # 検出失敗の結果をファイルに保存
+        if self.not_detected:
+            out_txt = os.path.join(self.output_dir, 'not_detected.txt')
+            with open(out_txt, 'w', encoding='utf-8') as f:
+                for base_name, message, detection_info in self.not_detected:
+                    f.write(f"{base_name}_ng.npy - {message}\n")
+            print(f"\n顔が検出できなかったファイル一覧を {out_txt} に保存しました（{len(self.not_detected)}件）")
+        else:
+            print("\nすべての画像で顔が検出されました！")
+
+        self._finish_profile()
+        self.print_summary(result_file)
+
+    def print_summary(self, result_file: str) -> None:
+        """処理完了サマリーを表示する
+
+        Args:
+            result_file: 検出結果ファイルのパス
+        """
+        config = self.config
+
+        # 最終結果の表示（再実行時に引き継いだ結果を含む）
+        success_count = self.success_count + self.resumed_success_count
+        failure_count = self.failure_count + self.resumed_failure_count
+        total_processed = success_count + failure_count
+        success_rate = (success_count / total_processed * 100) if total_processed > 0 else 0
+
+        print(f"\n{'='*60}")
+        print(f"🎯 処理完了サマリー")
+        print(f"{'='*60}")
+        print(f"📊 処理統計:")
+        print(f"   • 総処理数: {total_processed} ファイル")
+        print(f"   • 成功: {success_count} ファイル")
+        print(f"   • 失敗: {failure_count} ファイル")
+        print(f"   • 成功率: {success_rate:.1f}%")
+        if config.RESUME['enabled']:
+            print(f"   • 前回の結果を再利用: {self.resumed_success_count + self.resumed_failure_count} ファイル")
+        if self.retry_config is not None:
+            print(f"   • 2段目（high）で再検出: {self.retry_success_count} ファイル")
+        print(f"   • 前後の成功フレームから補完（{self.config.FALLBACK['mode']}）: {self.filled_count} ファイル")
+        if self.write_error_count:
+            print(f"   • 成果物の書き込みエラー: {self.write_error_count} ファイル（再実行時に処理し直されます）")
+        if config.TRACKING['enabled']:
+            print(f"   • ROI内検出: {self.roi_hit_count} ファイル（残りは画像全体で検出）")
+        print(f"")
+        print_worker_stats(self.worker_stats)
+        if self.profile is not None:
+            self.profile.print_summary()
+        print(f"📁 出力ディレクトリ:")
+        print(f"   • オリジナル正規化画像: {self.orignorm_dir}")
+        print(f"   • 処理済み画像: {self.processed_dir}")
+        print(f"   • ランドマーク: {self.landmarks_dir}")
+        print(f"   • 比較画像: {self.comparison_dir}")
+        if self.store is not None:
+            print(f"   • ランドマークストア: {self.store.store_dir}")
+        print(f"   • 検出結果: {result_file}")
+        if self.profile_path is not None:
+            print(f"   • プロファイル: {self.profile_path}")
+        if config.PROFILE['enabled'] and config.PROFILE['cprofile']:
+            print(f"   • cProfile（ワーカー終了時に出力）: {os.path.join(config.OUTPUT_BASE_DIR, 'cprofile')}")
+        print(f"{'='*60}")
+
+
+def deliver_write_acks(
+    jobs: Iterable[DirectoryJob],
+    received: Dict[str, WriteFailures],
+    timeout: float = 0
+) -> bool:
+    """ワーカーから届いた書き込みの完了通知を各ディレクトリに渡す
+
+    Args:
+        jobs: 通知を受け取るディレクトリ
+        received: まだ渡していない通知（タスクの結果より先に届いたものはここに残る）
+        timeout: 通知が1件も届いていない場合に待つ最大秒数（0 の場合は待たない）
+
+    Returns:
+        通知が1件以上届いた場合True
+    """
+    acks = take_write_acks(timeout)
+    received.update(acks)
+    for job in jobs:
+        if job.unacked_writes:
+            job.acknowledge_writes(received)
+    return bool(acks)
+
+
+def wait_for_writes(
+    jobs: Iterable[DirectoryJob],
+    job: DirectoryJob,
+    received: Dict[str, WriteFailures]
+) -> None:
+    """ディレクトリの成果物の書き込み完了の通知がすべて届くまで待つ
+
+    WRITER['ack_timeout_s'] 秒待っても通知が届かない場合は、残りのフレームを書き込みエラーにする。
+
+    Args:
+        jobs: 待っている間に届いた通知を受け取るディレクトリ（job を含む）
+        job: 完了を待つディレクトリ
+        received: まだ渡していない通知
+    """
+    while job.unacked_writes:
+        if not deliver_write_acks(jobs, received, job.config.WRITER['ack_timeout_s']):
+            job.abandon_writes()
+
+
+def run_jobs(
+    executor: ProcessPoolExecutor,
+    jobs: List[DirectoryJob],
+    max_in_flight: int,
+    on_job_start: Optional[Callable[[DirectoryJob], None]] = None,
+    on_job_done: Optional[Callable[[DirectoryJob], None]] = None,
+    controller: Optional[ConcurrencyController] = None
+) -> None:
+    """複数ディレクトリのタスクを1つのグローバルキューとしてワーカープールに投入する
+
+    ディレクトリの境界でプールがアイドルにならないよう、前のディレクトリの
+    完了を待たずに次のディレクトリのタスクを投入する。各ディレクトリの
+    finalize は jobs の順序で呼び出されるため、出力内容は逐次処理と同じになる。
+    結果の集計中に追加されたタスク（カスケードの2段目など）は優先して投入する。
+
+    ディレクトリの prepare（入力の列挙）は実行前にまとめて行わず、タスクを投入しながら
+    1つ先のディレクトリの分をスレッドで行う。処理対象が無いディレクトリは飛ばす。
+    成果物の書き込みの完了通知は結果の集計ごとに受け取り、ディレクトリの finalize の前に
+    残りの通知をまとめて待つ。
+
+    Args:
+        executor: ワーカープール
+        jobs: 処理するディレクトリのリスト（prepare済みでなくてもよい）
+        max_in_flight: 同時に投入しておくタスクの最大数
+        on_job_start: ディレクトリのタスク投入開始時のコールバック
+        on_job_done: ディレクトリの finalize 後のコールバック
+        controller: 同時実行数の調整（指定時は max_in_flight の代わりに controller.limit を使う）
+    """
+    def capacity() -> int:
+        return controller.limit if controller is not None else max_in_flight
+
+    # 進捗バーの設定（総数はディレクトリの prepare ごとに加算する）
+    pbar = tqdm(total=0, desc="画像処理中",
+               bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]')
+
+    def iter_all_tasks() -> Iterator[Tuple[DirectoryJob, Task]]:
+        with ThreadPoolExecutor(max_workers=1) as preparer:
+            next_prepared = preparer.submit(jobs[0].prepare) if jobs else None
+            for i, job in enumerate(jobs):
+                ready = next_prepared.result()
+                # 次のディレクトリの列挙は、このディレクトリのタスクを投入している間に行う
+                if i + 1 < len(jobs):
+                    next_prepared = preparer.submit(jobs[i + 1].prepare)
+                if not ready:
+                    continue
+                pbar.total += job.total
+                pbar.refresh()
+                if on_job_start:
+                    on_job_start(job)
+                for task in job.iter_tasks():
+                    yield job, task
+
+    task_iter = iter_all_tasks()
+    followups: Deque[Tuple[DirectoryJob, Task]] = deque()
+    pending: Dict[Future, Tuple[DirectoryJob, tuple]] = {}
+    write_acks: Dict[str, WriteFailures] = {}
+    next_to_finalize = 0
+
+    def submit_next() -> bool:
+        if followups:
+            job, (fn, args) = followups.popleft()
+        else:
+            try:
+                job, (fn, args) = next(task_iter)
+            except StopIteration:
+                return False
+        pending[executor.submit(fn, args)] = (job, args)
+        return True
+
+    while len(pending) < capacity() and submit_next():
+        pass
+
+    while pending or next_to_finalize < len(jobs):
+        if pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        else:
+            done = set()
+
+        for future in done:
+            job, args = pending.pop(future)
+            completed_before = job.completed
             try:
-                result = future.result()
-                
-                if result.is_detected:
-                    # 成功時
-                    success_count += 1
-                    tqdm.write(f"✅ 成功: {base_filename}")
-                    # 成功したランドマークを保存
-                    landmarks_path = os.path.join(
-                        landmarks_dir, f"{base_filename}_landmarks.npy"
-                    )
-                    if os.path.exists(landmarks_path):
-                        last_successful_landmarks = np.load(landmarks_path)
-                else:
-                    # 失敗時
-                    failure_count += 1
-                    tqdm.write(f"❌ 失敗: {base_filename} - {result.message}")
-                    not_detected.append((base_filename, result.message, result.detection_info))
-                    
-                    # 直前の成功したランドマークがある場合はそれを使用
-                    if last_successful_landmarks is not None:
-                        landmarks_path = os.path.join(
-                            landmarks_dir, f"{base_filename}_landmarks_ng.npy"
-                        )
-                        np.save(landmarks_path, last_successful_landmarks)
-                        # 比較画像も更新
-                        orig_norm = np.load(
-                            os.path.join(orignorm_dir, f"{base_filename}_orignorm_ng.npy")
-                        )
-                        processed = np.load(
-                            os.path.join(processed_dir, f"{base_filename}_processed_ng.npy")
-                        )
-                        comparison_dir = os.path.join(os.path.dirname(orignorm_dir), 'comparisons')
-                        comparison_path = os.path.join(
-                            comparison_dir, f"{base_filename}_comparison_ng.png"
-                        )
-                        visualize_comparison(
-                            orig_norm, processed, [last_successful_landmarks], comparison_path, None
-                        )
-                
-                detection_results.append((
-                    base_filename,
-                    result.best_upsample,
-                    result.is_detected
-                ))
-                
+                job.handle_output(args, future.result())
             except Exception as e:
-                # 処理自体の例外
-                failure_count += 1
-                error_msg = f"処理例外: {str(e)}"
-                tqdm.write(f"❌ エラー: {base_filename} - {error_msg}")
-                log_manager.log_error(error_msg)
-                not_detected.append((base_filename, error_msg, []))
-                detection_results.append((base_filename, None, False))
-            
+                job.handle_failure(args, e)
+            while job.followup_tasks:
+                followups.append((job, job.followup_tasks.popleft()))
+
             # 進捗バーを更新
-            pbar.update(1)
-            pbar.set_postfix({
-                '成功': success_count, 
+            success_count = sum(j.success_count for j in jobs)
+            failure_count = sum(j.failure_count for j in jobs)
+            pbar.update(job.completed - completed_before)
+            postfix = {
+                '成功': success_count,
                 '失敗': failure_count,
                 '成功率': f"{success_count/(success_count+failure_count)*100:.1f}%" if (success_count+failure_count) > 0 else "0%"
-            })
-        
-        # 進捗バーを閉じる
-        pbar.close()
-    
-    # 検出結果をファイルに保存
-    result_file = os.path.join(config.OUTPUT_BASE_DIR, 'detection_results.txt')
-    with open(result_file, 'w', encoding='utf-8') as f:
-        f.write("ファイル名,最適なパラメータ,検出結果\n")
-        for base_name, best_upsample, success in detection_results:
-            result_filename = f"{base_name}{'_ng' if not success else ''}.npy"
-            if best_upsample is not None:
-                f.write(f"{result_filename},upsample:{best_upsample}")
-            else:
-                f.write(f"{result_filename},検出失敗")
-            f.write(f",{'成功' if success else '失敗'}\n")
-    
-    # 検出失敗の結果をファイルに保存
-    if not_detected:
-        out_txt = os.path.join(os.path.dirname(orignorm_dir), 'not_detected.txt')
-        with open(out_txt, 'w', encoding='utf-8') as f:
-            for base_name, message, detection_info in not_detected:
-                f.write(f"{base_name}_ng.npy - {message}\n")
-        print(f"\n顔が検出できなかったファイル一覧を {out_txt} に保存しました（{len(not_detected)}件）")
-    else:
-        print("\nすべての画像で顔が検出されました！")
-    
-    # 最終結果の表示
-    total_processed = success_count + failure_count
-    success_rate = (success_count / total_processed * 100) if total_processed > 0 else 0
-    
-    print(f"\n{'='*60}")
-    print(f"🎯 処理完了サマリー")
-    print(f"{'='*60}")
-    print(f"📊 処理統計:")
-    print(f"   • 総処理数: {total_processed} ファイル")
-    print(f"   • 成功: {success_count} ファイル")
-    print(f"   • 失敗: {failure_count} ファイル")
-    print(f"   • 成功率: {success_rate:.1f}%")
-    print(f"")
-    print(f"📁 出力ディレクトリ:")
-    print(f"   • オリジナル正規化画像: {orignorm_dir}")
-    print(f"   • 処理済み画像: {processed_dir}")
-    print(f"   • ランドマーク: {landmarks_dir}")
-    print(f"   • 比較画像: {os.path.join(os.path.dirname(orignorm_dir), 'comparisons')}")
-    print(f"   • 検出結果: {result_file}")
-    print(f"{'='*60}")
+            }
+            if job.profile is not None and 'total' in job.profile.stages:
+                postfix['平均ms/枚'] = f"{job.profile.stages['total'].mean * 1000:.1f}"
+            pbar.set_postfix(postfix)
+            if controller is not None:
+                controller.record(job.completed - completed_before, job.worker_stats.values())
+            # 追加タスクがあればその分も投入する
+            while len(pending) < capacity() and submit_next():
+                pass
+        deliver_write_acks(jobs, write_acks)
+
+        # 完了したディレクトリを入力順に finalize する
+        # （実行中のタスクが無くなった時点で残りのディレクトリもすべて prepare 済みで完了している）
+        while next_to_finalize < len(jobs) and (
+                jobs[next_to_finalize].is_done or jobs[next_to_finalize].prepared is False or not pending):
+            job = jobs[next_to_finalize]
+            if not job.prepared:
+                # 処理対象が無いディレクトリ
+                next_to_finalize += 1
+                continue
+            wait_for_writes(jobs, job, write_acks)
+            tqdm.write("")
+            job.finalize()
+            if on_job_done:
+                on_job_done(job)
+            next_to_finalize += 1
+
+    # 進捗バーを閉じる
+    pbar.close()
+
+
+def process_directory(
+    input_dir: str,
+    detection_mode: str = 'normal',
+    config: Optional[Config] = None,
+    max_workers: Optional[int] = None
+) -> None:
+    """ディレクトリ内のすべての画像を処理する
+
+    Args:
+        input_dir: 入力ディレクトリパス
+        detection_mode: 検出モード ('normal'、'high' または 'cascade')
+        config: 設定オブジェクト（未指定時は Config() を使用）
+        max_workers: ワーカー数（未指定時はメモリとCPUコア数から決め、同時実行数を自動調整する）
+    """
+    config = config or Config()
+    config.DETECTION_MODE = detection_mode
+
+    job = DirectoryJob(input_dir, config)
+    if not job.prepare():
+        return
+
+    plan = plan_workers(config, job.all_files[:1], max_workers)
+    print_plan(plan)
+    controller = ConcurrencyController(plan, config)
+    ring = create_frame_ring(config, [job], plan.pool_size)
+    job.frame_ring = ring
+    try:
+        with create_executor(config, plan.pool_size, ring) as executor:
+            run_jobs(executor, [job], max_in_flight=plan.initial_limit, controller=controller)
+    finally:
+        if ring is not None:
+            ring.close()
+    controller.print_summary()
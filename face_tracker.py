@@ -0,0 +1,116 @@
+"""時系列トラッキングモジュール
+
+連番フレームでは被写体の位置がフレーム間でほとんど変化しないため、
+前フレームの顔矩形とランドマークから探索窓（ROI）を予測し、その範囲だけで
+顔検出を行う。ROI内で検出できなかった場合のみ画像全体での検出に戻る。
+"""
+
+from typing import Optional, Tuple, TYPE_CHECKING
+
+import dlib
+import numpy as np
+
+from data_types import DetectionResult
+from landmark_detector import detect_landmarks
+
+if TYPE_CHECKING:
+    from config import Config
+    from logger import LogManager
+
+
+class FaceTracker:
+    """前フレームの検出結果から探索窓を予測するトラッカー"""
+
+    def __init__(self, config: 'Config'):
+        self.config = config
+        self.prev_rect: Optional[Tuple[int, int, int, int]] = None  # (x, y, width, height)
+        self.prev_landmarks: Optional[np.ndarray] = None
+        self.roi_hits = 0
+        self.full_frame_detections = 0
+
+    def reset(self) -> None:
+        """トラッキング状態を破棄する"""
+        self.prev_rect = None
+        self.prev_landmarks = None
+
+    def predict_roi(self, img_shape: Tuple[int, ...]) -> Optional[Tuple[int, int, int, int]]:
+        """前フレームの結果から探索窓を予測する
+
+        前フレームの顔矩形とランドマークの外接矩形を合わせた領域を、
+        TRACKING['roi_margin'] の割合だけ上下左右に広げる。
+
+        Args:
+            img_shape: 画像の形状
+
+        Returns:
+            探索窓 (left, top, right, bottom)。前フレームの結果が無い場合は None
+        """
+        if self.prev_rect is None:
+            return None
+
+        x, y, w, h = self.prev_rect
+        left, top, right, bottom = x, y, x + w, y + h
+        if self.prev_landmarks is not None:
+            left = min(left, int(self.prev_landmarks[:, 0].min()))
+            top = min(top, int(self.prev_landmarks[:, 1].min()))
+            right = max(right, int(self.prev_landmarks[:, 0].max()))
+            bottom = max(bottom, int(self.prev_landmarks[:, 1].max()))
+
+        margin = self.config.TRACKING['roi_margin']
+        margin_x = int((right - left) * margin)
+        margin_y = int((bottom - top) * margin)
+        height, width = img_shape[:2]
+        roi = (
+            max(0, left - margin_x),
+            max(0, top - margin_y),
+            min(width, right + margin_x),
+            min(height, bottom + margin_y)
+        )
+        if roi[2] <= roi[0] or roi[3] <= roi[1]:
+            return None
+        return roi
+
+    def detect(
+        self,
+        processed_img: np.ndarray,
+        predictor: dlib.shape_predictor,
+        log_manager: Optional['LogManager'] = None,
+        detector: Optional[dlib.fhog_object_detector] = None
+    ) -> DetectionResult:
+        """探索窓内で検出し、見つからなければ画像全体で検出する
+
+        Args:
+            processed_img: 前処理済み画像
+            predictor: dlibのランドマーク予測器
+            log_manager: ログマネージャー（オプション）
+            detector: dlibの顔検出器（オプション）
+
+        Returns:
+            DetectionResult: 検出結果
+        """
+        roi = self.predict_roi(processed_img.shape)
+        roi_info = []
+        if roi is not None:
+            result = detect_landmarks(
+                processed_img, predictor, self.config, log_manager, detector, roi=roi
+            )
+            if result.is_detected and result.landmarks_list:
+                self.roi_hits += 1
+                self._update(result)
+                return result
+            roi_info = result.detection_info
+
+        # ROIで見つからなかった場合は画像全体で検出
+        result = detect_landmarks(processed_img, predictor, self.config, log_manager, detector)
+        result.detection_info = roi_info + result.detection_info
+        self.full_frame_detections += 1
+        self._update(result)
+        return result
+
+    def _update(self, result: DetectionResult) -> None:
+        """検出結果でトラッキング状態を更新する"""
+        if result.is_detected and result.landmarks_list and result.face_rect is not None:
+            self.prev_rect = result.face_rect
+            self.prev_landmarks = result.landmarks_list[0]
+        else:
+            self.reset()
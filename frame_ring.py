@@ -0,0 +1,171 @@
+"""共有メモリのフレームリングバッファモジュール
+
+ワーカーが作成した正規化済みオリジナル画像と前処理済み画像を、親プロセスが
+multiprocessing.shared_memory 上の固定長スロットから直接読めるようにする。
+検出失敗フレームの比較画像を親プロセスで描き直す際に、_orignorm_ng と
+_processed_ng をディスクから読み直したり、画像を pickle して送ったりせずに済む。
+
+リングは親プロセスが作成・所有し、ワーカーは init_worker で名前を指定して接続する。
+空きスロットの番号は multiprocessing.Queue で管理し、ワーカーは空きが無い場合や
+フレームがスロットに収まらない場合は待たずに従来通りディスク経由にする。
+"""
+
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from data_types import SharedFrame
+from frame_source import READ_ERRORS, frame_shape
+
+# ワーカープロセス内で接続したリング
+_worker_ring: Optional['FrameRing'] = None
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """既存の共有メモリに接続する（接続側では解放の追跡を行わない）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.12以前: 接続側でも追跡に登録されるが、ワーカーは親プロセスの
+        # resource_tracker を共有しており登録は名前の集合のため重複しても問題ない。
+        # ここで登録を外すと親プロセスの登録も消え、親の unlink() で KeyError が表示される
+        return shared_memory.SharedMemory(name=name)
+
+
+class FrameRing:
+    """固定長スロットの共有メモリリングバッファ"""
+
+    def __init__(
+        self,
+        shm: shared_memory.SharedMemory,
+        slot_bytes: int,
+        num_slots: int,
+        free_slots: 'multiprocessing.Queue',
+        owner: bool
+    ):
+        self.shm = shm
+        self.slot_bytes = slot_bytes
+        self.num_slots = num_slots
+        self.free_slots = free_slots
+        self.owner = owner
+        self.published_count = 0
+        self.overflow_count = 0
+
+    @classmethod
+    def create(cls, slot_bytes: int, num_slots: int) -> 'FrameRing':
+        """親プロセスでリングを作成する
+
+        Args:
+            slot_bytes: 1スロットのバイト数（オリジナル画像と前処理済み画像の合計）
+            num_slots: スロット数
+
+        Returns:
+            FrameRing: 全スロットが空きのリング
+        """
+        shm = shared_memory.SharedMemory(create=True, size=slot_bytes * num_slots)
+        free_slots = multiprocessing.Queue()
+        for slot in range(num_slots):
+            free_slots.put(slot)
+        return cls(shm, slot_bytes, num_slots, free_slots, owner=True)
+
+    @property
+    def spec(self) -> Tuple[str, int, int, 'multiprocessing.Queue']:
+        """ワーカーが接続するための情報（init_worker の引数）"""
+        return self.shm.name, self.slot_bytes, self.num_slots, self.free_slots
+
+    @classmethod
+    def attach(cls, spec: Tuple[str, int, int, 'multiprocessing.Queue']) -> 'FrameRing':
+        """ワーカープロセスから既存のリングに接続する"""
+        name, slot_bytes, num_slots, free_slots = spec
+        return cls(_attach_shared_memory(name), slot_bytes, num_slots, free_slots, owner=False)
+
+    def _view(self, slot: int, offset: int, shape: Tuple[int, ...]) -> np.ndarray:
+        """スロット内の領域を uint8 配列として返す（コピーしない）"""
+        start = slot * self.slot_bytes + offset
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=start)
+
+    def publish(self, orig_norm: np.ndarray, processed: np.ndarray) -> Optional[SharedFrame]:
+        """画像を空きスロットに書き込む
+
+        Args:
+            orig_norm: 正規化済みオリジナル画像 (uint8)
+            processed: 前処理済み画像 (uint8)
+
+        Returns:
+            SharedFrame: 書き込んだスロットの情報。空きスロットが無いか、
+            画像がスロットに収まらない場合は None（呼び出し側はディスク経由にする）
+        """
+        if orig_norm.nbytes + processed.nbytes > self.slot_bytes:
+            self.overflow_count += 1
+            return None
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            self.overflow_count += 1
+            return None
+        self._view(slot, 0, orig_norm.shape)[...] = orig_norm
+        self._view(slot, orig_norm.nbytes, processed.shape)[...] = processed
+        self.published_count += 1
+        return SharedFrame(slot=slot, orig_shape=orig_norm.shape, processed_shape=processed.shape)
+
+    def read(self, frame: SharedFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """スロットの画像を返す（コピーしない。release までに使い終えること）
+
+        Returns:
+            (正規化済みオリジナル画像, 前処理済み画像)
+        """
+        orig_norm = self._view(frame.slot, 0, frame.orig_shape)
+        processed = self._view(frame.slot, orig_norm.nbytes, frame.processed_shape)
+        return orig_norm, processed
+
+    def release(self, frame: SharedFrame) -> None:
+        """スロットを空きに戻す"""
+        self.free_slots.put(frame.slot)
+
+    def close(self) -> None:
+        """共有メモリを閉じる（作成したプロセスでは削除も行う）"""
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            self.free_slots.close()
+
+    def __enter__(self) -> 'FrameRing':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def estimate_slot_bytes(frame_ids: Iterable[str]) -> int:
+    """フレームを格納するのに必要なスロットのバイト数を返す
+
+    正規化済みオリジナル画像（入力と同じ形状）と前処理済み画像（高さ×幅）の合計。
+
+    Args:
+        frame_ids: 大きさを調べるフレーム（各ディレクトリの先頭フレームなど）
+
+    Returns:
+        スロットのバイト数
+    """
+    slot_bytes = 0
+    for frame_id in frame_ids:
+        try:
+            shape = frame_shape(frame_id)
+        except READ_ERRORS:
+            continue  # 読み込めないフレームはそのフレームの処理でエラーとして記録される
+        slot_bytes = max(slot_bytes, int(np.prod(shape)) + shape[0] * shape[1])
+    return slot_bytes
+
+
+def init_worker_ring(spec: Optional[Tuple[str, int, int, 'multiprocessing.Queue']]) -> None:
+    """ワーカープロセスでリングに接続する（model_registry.init_worker から呼ばれる）"""
+    global _worker_ring
+    _worker_ring = FrameRing.attach(spec) if spec is not None else None
+
+
+def get_worker_ring() -> Optional[FrameRing]:
+    """ワーカープロセスで接続したリングを返す（未接続の場合は None）"""
+    return _worker_ring
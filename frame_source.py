@@ -0,0 +1,190 @@
+"""入力フレームの列挙と読み込みモジュール
+
+入力の.npyファイルは1ファイル1フレーム (H, W) / (H, W, C) のほか、
+複数フレームを積み重ねたスタック (T, H, W) / (T, H, W, C) にも対応する。
+スタック内のフレームは「フレームID」（<パス>::<フレーム番号>）で表し、
+ワーカーはメモリマップ経由で自分のフレームだけを読み込む（ファイル全体をコピーしない）。
+
+スタックのフレームの成果物は <ファイル名>_f<フレーム番号6桁> をベース名として保存する
+（例: cube.npy の12フレーム目 → cube_f000012_processed.npy）。
+"""
+
+import os
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from logger import LogManager
+
+if TYPE_CHECKING:
+    from config import Config
+
+FRAME_SEPARATOR = '::'
+
+# カラー画像 (H, W, C) とみなすチャンネル数
+_CHANNEL_COUNTS = (3, 4)
+
+# 壊れた・空の .npy を読み込んだ場合の例外
+READ_ERRORS = (OSError, ValueError, EOFError)
+
+
+def make_frame_id(path: str, index: int) -> str:
+    """スタック内のフレームIDを返す"""
+    return f"{path}{FRAME_SEPARATOR}{index}"
+
+
+def split_frame_id(frame_id: str) -> Tuple[str, Optional[int]]:
+    """フレームIDをファイルパスとフレーム番号に分ける
+
+    Args:
+        frame_id: フレームID または 画像ファイルパス
+
+    Returns:
+        (ファイルパス, フレーム番号)。1ファイル1フレームの場合、フレーム番号は None
+        （'::' を含むファイルパスは、続く部分が数字のみの場合だけフレームIDとみなす）
+    """
+    path, sep, index = frame_id.rpartition(FRAME_SEPARATOR)
+    if not sep or not index.isdecimal():
+        return frame_id, None
+    return path, int(index)
+
+
+def frame_base_name(frame_id: str) -> str:
+    """成果物のファイル名に使うベース名を返す
+
+    Args:
+        frame_id: フレームID または 画像ファイルパス
+
+    Returns:
+        1ファイル1フレームの場合はファイル名から .npy を除いたもの、
+        スタック内のフレームの場合は <ファイル名>_f<フレーム番号6桁>
+    """
+    path, index = split_frame_id(frame_id)
+    base_name = os.path.basename(path).replace('.npy', '')
+    if index is None:
+        return base_name
+    return f"{base_name}_f{index:06d}"
+
+
+def frame_filename(frame_id: str) -> str:
+    """マニフェストやランドマークストアに記録するフレーム名を返す"""
+    return f"{frame_base_name(frame_id)}.npy"
+
+
+def is_stack_shape(shape: Tuple[int, ...], mode: str = 'auto') -> bool:
+    """配列の形状が複数フレームのスタックかどうかを判定する
+
+    Args:
+        shape: 配列の形状
+        mode: 'auto'（4次元、または最後の次元がチャンネル数でない3次元をスタックとする）、
+            'always'（3次元以上をスタックとする）、'never'（常に1フレームとする）
+
+    Returns:
+        スタックの場合True
+    """
+    if mode == 'never':
+        return False
+    if mode == 'always':
+        return len(shape) >= 3
+    return len(shape) == 4 or (len(shape) == 3 and shape[2] not in _CHANNEL_COUNTS)
+
+
+def read_npy_shape(path: str) -> Tuple[int, ...]:
+    """.npyファイルのヘッダーだけを読み、配列の形状を返す
+
+    データのメモリマップは作らずにファイルを閉じるため、入力の列挙で
+    ファイルごとにマッピングが残らない。
+    """
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, _ = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, _ = np.lib.format.read_array_header_2_0(f)
+    return shape
+
+
+def frame_shape(frame_id: str) -> Tuple[int, ...]:
+    """フレームの形状をヘッダーから返す（スタック内のフレームは先頭の次元を除いた形状）"""
+    path, index = split_frame_id(frame_id)
+    shape = read_npy_shape(path)
+    return shape if index is None else shape[1:]
+
+
+@lru_cache(maxsize=8)
+def _open_memmap(path: str, mtime_ns: int) -> np.ndarray:
+    """読み込み専用のメモリマップを開く（プロセスごとにキャッシュ）"""
+    return np.load(path, mmap_mode='r')
+
+
+def open_npy(path: str) -> np.ndarray:
+    """.npyファイルを読み込み専用のメモリマップとして開く
+
+    同じファイルの複数フレームを処理するワーカーでファイルを開き直さないよう、
+    更新日時とともにキャッシュする。
+    """
+    return _open_memmap(path, os.stat(path).st_mtime_ns)
+
+
+def list_frames(img_files: List[str], config: 'Config') -> List[str]:
+    """入力ファイルをフレーム単位に展開する
+
+    Args:
+        img_files: 入力ファイルパスのリスト
+        config: 設定オブジェクト（STACK_INPUT['mode'] でスタックの判定方法を指定）
+
+    Returns:
+        画像ファイルパスとフレームIDのリスト（スタックはフレーム番号順に展開）
+    """
+    frames: List[str] = []
+    for img_file in img_files:
+        frames.extend(iter_file_frames(img_file, config))
+    return frames
+
+
+def iter_file_frames(img_file: str, config: 'Config') -> Iterator[str]:
+    """1つの入力ファイルに含まれるフレームを順に返す
+
+    Args:
+        img_file: 入力ファイルパス
+        config: 設定オブジェクト
+
+    Yields:
+        スタックの場合は各フレームのフレームID、それ以外は img_file
+        （読み込めないファイルは1フレームとして返し、そのフレームの処理でエラーとして記録させる）
+    """
+    mode = config.STACK_INPUT['mode']
+    if mode == 'never':
+        yield img_file
+        return
+    # ヘッダーのみ読み込む
+    try:
+        shape = read_npy_shape(img_file)
+    except READ_ERRORS as e:
+        LogManager().log_error(f"❌ 読み込みエラー: {img_file} - {str(e)}")
+        yield img_file
+        return
+    if not is_stack_shape(shape, mode):
+        yield img_file
+        return
+    for index in range(shape[0]):
+        yield make_frame_id(img_file, index)
+
+
+def load_frame(frame_id: str) -> np.ndarray:
+    """フレームを読み込む
+
+    スタックの場合は該当フレームのメモリマップ上のビューを返し、
+    ファイル全体は読み込まない。
+
+    Args:
+        frame_id: フレームID または 画像ファイルパス
+
+    Returns:
+        フレーム画像（読み込み専用のメモリマップ）
+    """
+    path, index = split_frame_id(frame_id)
+    if index is None:
+        return np.load(path, mmap_mode='r')
+    return open_npy(path)[index]
@@ -0,0 +1,164 @@
+"""正規化済みオリジナル画像・前処理済み画像の保存形式モジュール
+
+orignorm / processed の画像を以下のいずれかの形式で保存し、形式によらず読み込む。
+
+- 'npy': 非圧縮の .npy（従来の形式）
+- 'png': 可逆圧縮の PNG（uint8 の (H, W) / (H, W, 3) / (H, W, 4) のみ。他の配列は .npz で保存）
+- 'npz': 圧縮した .npy を1つ格納した ZIP（np.load でそのまま読める）。
+         圧縮方式は 'deflate'、'bzip2' または 'lzma'
+
+圧縮はワーカーで行い（バックグラウンド書き込みが有効な場合は書き込みスレッドで行う）、
+ワーカーごとに並列に処理される。圧縮レベルは FRAME_STORAGE['level'] で指定する。
+"""
+
+import io
+import os
+import zipfile
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+import cv2
+import numpy as np
+
+if TYPE_CHECKING:
+    from config import Config
+    from output_writer import OutputWriter
+
+STORAGE_EXTENSIONS = {'npy': '.npy', 'png': '.png', 'npz': '.npz'}
+
+_ZIP_CODECS = {
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+_NPZ_MEMBER = 'frame'
+
+
+def can_store_png(array: np.ndarray) -> bool:
+    """PNG として可逆に保存できる配列かどうか"""
+    if array.dtype != np.uint8:
+        return False
+    return array.ndim == 2 or (array.ndim == 3 and array.shape[2] in (3, 4))
+
+
+def get_format(array: np.ndarray, storage: Dict[str, Any]) -> str:
+    """配列を保存する形式を返す（PNG にできない配列は npz にする）"""
+    fmt = storage['format']
+    if fmt == 'png' and not can_store_png(array):
+        return 'npz'
+    return fmt
+
+
+def frame_path(directory: str, base_name: str, kind: str, suffix: str, config: Optional['Config'] = None) -> str:
+    """保存する画像のパスを返す
+
+    Args:
+        directory: 保存先ディレクトリ
+        base_name: 入力ファイルのベース名
+        kind: 'orignorm' または 'processed'
+        suffix: 検出失敗時の接尾辞（'' または '_ng'）
+        config: 設定オブジェクト（未指定時は .npy）
+
+    Returns:
+        <directory>/<base_name>_<kind><suffix>.<拡張子>
+    """
+    fmt = config.FRAME_STORAGE['format'] if config is not None else 'npy'
+    return os.path.join(directory, f'{base_name}_{kind}{suffix}{STORAGE_EXTENSIONS[fmt]}')
+
+
+def frame_paths(path: str) -> List[str]:
+    """path と拡張子だけが異なる、すべての保存形式のパスを返す（前回と形式が異なる場合の削除・検索用）"""
+    stem = os.path.splitext(path)[0]
+    return [stem + ext for ext in STORAGE_EXTENSIONS.values()]
+
+
+def encode_frame(array: np.ndarray, fmt: str, storage: Dict[str, Any]) -> bytes:
+    """画像を保存形式のバイト列に変換する
+
+    Args:
+        array: 画像
+        fmt: 保存形式（get_format の戻り値）
+        storage: 保存形式の設定（Config.FRAME_STORAGE）
+
+    Returns:
+        ファイルに書き込むバイト列
+    """
+    if fmt == 'png':
+        ok, encoded = cv2.imencode('.png', array, [cv2.IMWRITE_PNG_COMPRESSION, storage['level']])
+        if not ok:
+            raise RuntimeError("PNGのエンコードに失敗しました")
+        return encoded.tobytes()
+
+    npy = io.BytesIO()
+    np.save(npy, np.ascontiguousarray(array))
+    if fmt == 'npy':
+        return npy.getvalue()
+
+    codec = _ZIP_CODECS[storage['codec']]
+    # lzma は圧縮レベルを指定できない
+    level = storage['level'] if codec != zipfile.ZIP_LZMA else None
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=codec, compresslevel=level) as zf:
+        zf.writestr(f'{_NPZ_MEMBER}.npy', npy.getvalue())
+    return buffer.getvalue()
+
+
+def save_frame(
+    path: str,
+    array: np.ndarray,
+    config: Optional['Config'] = None,
+    writer: Optional['OutputWriter'] = None
+) -> None:
+    """画像を保存する（path の拡張子は frame_path で決めたもの）
+
+    Args:
+        path: 保存先パス
+        array: 画像
+        config: 設定オブジェクト（未指定時は .npy）
+        writer: バックグラウンドの書き込みスレッド（指定時は圧縮も書き込みスレッドで行う）
+    """
+    storage = config.FRAME_STORAGE if config is not None else {'format': 'npy'}
+    fmt = get_format(array, storage)
+    if fmt == 'npy':
+        if writer is not None:
+            writer.save_npy(path, array)
+        else:
+            np.save(path, array)
+        return
+    if fmt != storage['format']:
+        # PNG にできない配列（カラー以外の多チャンネルなど）
+        path = os.path.splitext(path)[0] + STORAGE_EXTENSIONS[fmt]
+    if writer is not None:
+        writer.write_encoded(path, lambda: encode_frame(array, fmt, storage))
+        return
+    # cv2.imwrite は日本語パスに対応しないため、エンコードしてから書き込む
+    with open(path, 'wb') as f:
+        f.write(encode_frame(array, fmt, storage))
+
+
+def load_saved_frame(path: str) -> np.ndarray:
+    """保存した画像を読み込む（形式は拡張子で判定）
+
+    Args:
+        path: 画像のパス（.npy、.png または .npz）
+
+    Returns:
+        保存時と同じ形状・型の配列
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.png':
+        img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise RuntimeError(f"画像の読み込みに失敗しました: {path}")
+        return img
+    if ext == '.npz':
+        with np.load(path) as data:
+            return data[_NPZ_MEMBER]
+    return np.load(path)
+
+
+def find_saved_frame(path: str) -> Optional[str]:
+    """保存された画像を形式によらず探す（path が無い場合は他の拡張子を探し、見つからない場合は None）"""
+    for candidate in [path] + frame_paths(path):
+        if os.path.exists(candidate):
+            return candidate
+    return None
@@ -31,11 +31,11 @@ class FolderListCreator:
         ttk.Label(mode_frame, text="検出モード:").pack(side=tk.LEFT)
         self.mode_var = tk.StringVar(value="normal")
         mode_combo = ttk.Combobox(mode_frame, textvariable=self.mode_var, 
-                                 values=["normal", "high"], state="readonly", width=10)
+                                 values=["normal", "high", "cascade"], state="readonly", width=10)
         mode_combo.pack(side=tk.LEFT, padx=5)
         
         # モード説明ラベル
-        mode_info = ttk.Label(mode_frame, text="(normal: 高速, high: 高精度)", 
+        mode_info = ttk.Label(mode_frame, text="(normal: 高速, high: 高精度, cascade: 失敗時のみ高精度)", 
                              font=("TkDefaultFont", 8), foreground="gray")
         mode_info.pack(side=tk.LEFT, padx=5)
         
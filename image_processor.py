@@ -1,49 +1,241 @@
 """画像処理モジュール"""
 
+import threading
+import time
 import cv2
 import numpy as np
-from typing import TYPE_CHECKING
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from config import Config
 
+# LUTによる正規化とガンマ補正の一括処理が可能な入力型
+_LUT_DTYPES = (np.uint8, np.uint16)
+
+# スレッドごとの前処理エンジンのキャッシュ（バッファを共有しないため）
+_local = threading.local()
+
+# グレースケール変換後の前処理の段階と、各段階の結果に影響するパラメータ（IMAGE_PROCESSING のキー）
+PREPROCESS_STAGES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ('normalize_gamma', ('gamma',)),
+    ('bilateral', ('bilateral_d', 'bilateral_sigma_color', 'bilateral_sigma_space')),
+    ('clahe', ('contrast_clip',)),
+    ('convert_scale_abs', ('alpha', 'beta')),
+    ('morph_close', ()),
+)
+
+
+def build_gamma_lut(gamma: float) -> np.ndarray:
+    """ガンマ補正用のLUTを作成する
+
+    Args:
+        gamma: ガンマ値
+
+    Returns:
+        形状 (256,) の uint8 LUT
+    """
+    values = np.arange(256, dtype=np.float64) / 255.0
+    return np.clip(np.power(values, gamma) * 255.0, 0, 255).astype(np.uint8)
+
+
+class Preprocessor:
+    """再利用可能な前処理エンジン
+
+    ガンマ補正のLUT、CLAHEオブジェクト、モルフォロジー用カーネルを生成時に
+    1回だけ作成し、中間バッファも画像サイズごとに使い回す。
+    uint8/uint16 の入力では、0-255への正規化とガンマ補正を1回のLUT処理にまとめる。
+
+    中間バッファを保持するため、1つのインスタンスを複数スレッドから
+    同時に使用してはならない。
+    """
+
+    def __init__(self, params: Dict):
+        """
+        Args:
+            params: 前処理パラメータ（Config.IMAGE_PROCESSING と同じ形式）
+        """
+        self.params = dict(params)
+        self.gamma_lut = build_gamma_lut(params['gamma'])
+        self.clahe = cv2.createCLAHE(clipLimit=params['contrast_clip'], tileGridSize=(16, 16))
+        self.kernel = np.ones((3, 3), np.uint8)
+        self._buffers: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+        # 直近の呼び出しと累計の各段階の処理時間（秒）
+        self.last_timings: Dict[str, float] = {}
+        self.total_timings: Dict[str, float] = {}
+        self.call_count = 0
+
+    @classmethod
+    def from_config(cls, config: 'Config') -> 'Preprocessor':
+        """設定オブジェクトから前処理エンジンを作成する"""
+        return cls(config.IMAGE_PROCESSING)
+
+    def _get_buffers(self, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """画像サイズに対応する中間バッファを返す"""
+        buffers = self._buffers.get(shape)
+        if buffers is None:
+            buffers = (np.empty(shape, np.uint8), np.empty(shape, np.uint8))
+            self._buffers[shape] = buffers
+        return buffers
+
+    def _record(self, stage: str, start: float) -> float:
+        """段階の処理時間を記録し、次の段階の開始時刻を返す"""
+        now = time.perf_counter()
+        elapsed = now - start
+        self.last_timings[stage] = elapsed
+        self.total_timings[stage] = self.total_timings.get(stage, 0.0) + elapsed
+        return now
+
+    def _normalize_lut(self, img: np.ndarray, lut: Optional[np.ndarray]) -> np.ndarray:
+        """0-255への正規化と lut の適用をまとめた変換テーブルを作成する
+
+        画像の最小値から最大値までの値の列を cv2.normalize(NORM_MINMAX) 自体で変換するため、
+        最小値・最大値（したがって変換の係数と丸め）が画像と一致し、結果は
+        cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8) とビット単位で一致する。
+        lut が指定されていればその結果にさらに lut を適用する。
+        """
+        min_val, max_val, _, _ = cv2.minMaxLoc(img)
+        low, high = int(min_val), int(max_val)
+        values = np.arange(low, high + 1, dtype=img.dtype)
+        table = np.zeros(np.iinfo(img.dtype).max + 1, dtype=np.uint8)  # 画像に無い値は参照されない
+        table[low:high + 1] = cv2.normalize(values, None, 0, 255, cv2.NORM_MINMAX).reshape(-1).astype(np.uint8)
+        if lut is not None:
+            table = lut[table]
+        return table
+
+    def _apply_normalize(self, img: np.ndarray, out: np.ndarray, lut: Optional[np.ndarray]) -> np.ndarray:
+        """正規化（と lut の適用）を out に書き込む"""
+        if img.dtype in _LUT_DTYPES:
+            table = self._normalize_lut(img, lut)
+            if img.dtype == np.uint8:
+                return cv2.LUT(img, table, dst=out)
+            return np.take(table, img, out=out, mode='clip')
+
+        # LUTが使えない型（float等）は従来通り正規化後にuint8へ変換する
+        normalized = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX)
+        np.copyto(out, normalized, casting='unsafe')
+        if lut is not None:
+            cv2.LUT(out, lut, dst=out)
+        return out
+
+    def _to_gray(self, img: np.ndarray) -> np.ndarray:
+        """カラー画像の場合はグレースケールに変換する"""
+        if len(img.shape) == 3:
+            return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return img
+
+    def normalize(self, img: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """画像を0-255のuint8に正規化する
+
+        Args:
+            img: 入力画像
+            out: 出力先バッファ（uint8、入力と同じ形状）。未指定時は新規に確保
+
+        Returns:
+            正規化済み画像
+        """
+        if out is None:
+            out = np.empty(img.shape, np.uint8)
+        if len(img.shape) == 3:
+            # カラー画像はチャンネルをまとめて正規化する（cv2.normalize と同じ）
+            flat = img.reshape(img.shape[0], -1)
+            self._apply_normalize(flat, out.reshape(img.shape[0], -1), None)
+            return out
+        return self._apply_normalize(img, out, None)
+
+    def to_gray(self, img: np.ndarray) -> np.ndarray:
+        """カラー画像の場合はグレースケールに変換する（前処理の最初の段階）"""
+        return self._to_gray(img)
+
+    def apply_stage(self, stage: str, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        """前処理の1段階を適用する
+
+        Args:
+            stage: PREPROCESS_STAGES の段階名
+            src: 前の段階の出力（normalize_gamma ではグレースケール画像）
+            dst: 出力先バッファ（uint8、src と同じ高さ・幅。src と別の配列）
+
+        Returns:
+            dst
+        """
+        params = self.params
+        if stage == 'normalize_gamma':
+            # 正規化とガンマ補正（可能な場合は1回のLUT処理）
+            return self._apply_normalize(src, dst, self.gamma_lut)
+        if stage == 'bilateral':
+            return cv2.bilateralFilter(
+                src,
+                params['bilateral_d'],
+                params['bilateral_sigma_color'],
+                params['bilateral_sigma_space'],
+                dst=dst
+            )
+        if stage == 'clahe':
+            return self.clahe.apply(src, dst=dst)
+        if stage == 'convert_scale_abs':
+            return cv2.convertScaleAbs(src, dst=dst, alpha=params['alpha'], beta=params['beta'])
+        if stage == 'morph_close':
+            return cv2.morphologyEx(src, cv2.MORPH_CLOSE, self.kernel, dst=dst)
+        raise ValueError(f"不明な前処理の段階です: {stage}")
+
+    def process(self, img: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """画像の前処理を行う
+
+        Args:
+            img: 入力画像
+            out: 出力先バッファ（uint8、入力の高さ・幅と同じ形状）。未指定時は新規に確保
+
+        Returns:
+            前処理済み画像
+        """
+        start = time.perf_counter()
+
+        gray = self._to_gray(img)
+        start = self._record('grayscale', start)
+
+        shape = gray.shape[:2]
+        buf_a, buf_b = self._get_buffers(shape)
+        if out is None:
+            out = np.empty(shape, np.uint8)
+
+        # 2つの中間バッファを交互に使い、最後の段階のみ out に書き込む
+        src = gray
+        for (stage, _), dst in zip(PREPROCESS_STAGES, (buf_a, buf_b, buf_a, buf_b, out)):
+            src = self.apply_stage(stage, src, dst)
+            start = self._record(stage, start)
+
+        self.call_count += 1
+        return out
+
+
+def get_preprocessor(config: 'Config') -> Preprocessor:
+    """設定に対応する前処理エンジンを返す（スレッドごとにキャッシュ）
+
+    Args:
+        config: 設定オブジェクト
+
+    Returns:
+        Preprocessor: 前処理エンジン
+    """
+    cache = getattr(_local, 'preprocessors', None)
+    if cache is None:
+        cache = _local.preprocessors = {}
+    key = tuple(sorted(config.IMAGE_PROCESSING.items()))
+    preprocessor = cache.get(key)
+    if preprocessor is None:
+        preprocessor = Preprocessor.from_config(config)
+        cache[key] = preprocessor
+    return preprocessor
+
 
 def preprocess_image(img: np.ndarray, config: 'Config') -> np.ndarray:
     """画像の前処理を行う
-    
+
     Args:
         img: 入力画像
         config: 設定オブジェクト
-        
+
     Returns:
         前処理済み画像
     """
-    params = config.IMAGE_PROCESSING
-    processed = img.copy()
-    if len(processed.shape) == 3:
-        processed = cv2.cvtColor(processed, cv2.COLOR_BGR2GRAY)
-    
-    # 画像をuint8に変換
-    processed = cv2.normalize(processed, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-    
-    # ガンマ補正用のLUTを作成
-    gamma = params['gamma']
-    lookUpTable = np.zeros((256, 1), dtype=np.uint8)
-    for i in range(256):
-        lookUpTable[i, 0] = np.clip(pow(i / 255.0, gamma) * 255.0, 0, 255)
-    
-    # LUTを適用
-    processed = cv2.LUT(processed, lookUpTable)
-    
-    processed = cv2.bilateralFilter(
-        processed,
-        params['bilateral_d'],
-        params['bilateral_sigma_color'],
-        params['bilateral_sigma_space']
-    )
-    clahe = cv2.createCLAHE(clipLimit=params['contrast_clip'], tileGridSize=(16,16))
-    processed = clahe.apply(processed)
-    processed = cv2.convertScaleAbs(processed, alpha=params['alpha'], beta=params['beta'])
-    kernel = np.ones((3,3), np.uint8)
-    processed = cv2.morphologyEx(processed, cv2.MORPH_CLOSE, kernel)
-    return processed
+    return get_preprocessor(config).process(img)
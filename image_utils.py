@@ -1,9 +1,24 @@
 """画像処理ユーティリティモジュール"""
 
+import io
 import os
+import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+from frame_source import frame_base_name
+from frame_storage import frame_path, save_frame
+import profiler
+
+if TYPE_CHECKING:
+    from config import Config
+    from output_writer import OutputWriter
+
+# 比較画像の描画色 (BGR)
+_BOX_COLOR = (255, 0, 0)  # 青
+_LANDMARK_COLOR = (0, 0, 255)  # 赤
+_TITLE_HEIGHT = 40
+_PANEL_TITLES = ('Original Image', 'Processed Image', 'Landmarks + Bounding Box')
 
 
 def setup_directories(output_base_path: str, input_dir: str) -> Tuple[str, str, str]:
@@ -26,12 +41,103 @@ def setup_directories(output_base_path: str, input_dir: str) -> Tuple[str, str,
     return orignorm_dir, processed_dir, landmarks_dir
 
 
+def comparison_filename(base_name: str, suffix: str, config: Optional['Config'] = None) -> str:
+    """比較画像のファイル名を返す
+    
+    Args:
+        base_name: 入力ファイルのベース名
+        suffix: 検出失敗時の接尾辞（'' または '_ng'）
+        config: 設定オブジェクト（未指定時はPNG）
+        
+    Returns:
+        比較画像のファイル名
+    """
+    ext = 'png'
+    if config is not None and config.RENDERING['backend'] == 'opencv':
+        ext = 'jpg' if config.RENDERING['format'] in ('jpg', 'jpeg') else 'png'
+    return f'{base_name}_comparison{suffix}.{ext}'
+
+
+def render_comparison(
+    original: np.ndarray,
+    processed: np.ndarray,
+    landmarks: List[np.ndarray],
+    bounding_box: Optional[Tuple[int, int, int, int]] = None
+) -> np.ndarray:
+    """3つのパネルを横に並べた比較画像を1枚のuint8画像として描画する
+    
+    Args:
+        original: オリジナル画像
+        processed: 処理済み画像
+        landmarks: ランドマークのリスト
+        bounding_box: バウンディングボックス (x, y, width, height) - 既に調整済み
+        
+    Returns:
+        BGR形式の比較画像
+    """
+    height, width = processed.shape[:2]
+    canvas = np.full((_TITLE_HEIGHT + height, width * 3, 3), 255, dtype=np.uint8)
+    
+    # グレースケール画像はブロードキャストで3チャンネルに書き込む
+    panels = [canvas[_TITLE_HEIGHT:, i * width:(i + 1) * width] for i in range(3)]
+    panels[0][...] = original[:, :, None] if original.ndim == 2 else original
+    panels[1][...] = processed[:, :, None]
+    panels[2][...] = panels[1]
+    
+    for i, panel in enumerate(panels):
+        if bounding_box:
+            x, y, w, h = bounding_box
+            cv2.rectangle(panel, (int(x), int(y)), (int(x + w), int(y + h)), _BOX_COLOR, 2)
+        text_size, _ = cv2.getTextSize(_PANEL_TITLES[i], cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+        cv2.putText(
+            canvas, _PANEL_TITLES[i],
+            (i * width + max(0, (width - text_size[0]) // 2), (_TITLE_HEIGHT + text_size[1]) // 2),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2, cv2.LINE_AA
+        )
+    
+    if len(landmarks) > 0:
+        for x, y in landmarks[0]:
+            cv2.circle(panels[2], (int(x), int(y)), 2, _LANDMARK_COLOR, -1)
+    
+    return canvas
+
+
+def _save_comparison_opencv(
+    original: np.ndarray,
+    processed: np.ndarray,
+    landmarks: List[np.ndarray],
+    save_path: str,
+    bounding_box: Optional[Tuple[int, int, int, int]],
+    config: Optional['Config'],
+    writer: Optional['OutputWriter'] = None
+) -> None:
+    """OpenCVで比較画像を描画して保存する"""
+    canvas = render_comparison(original, processed, landmarks, bounding_box)
+    rendering = config.RENDERING if config is not None else {}
+    if save_path.lower().endswith(('.jpg', '.jpeg')):
+        params = [cv2.IMWRITE_JPEG_QUALITY, rendering.get('jpeg_quality', 90)]
+        ext = '.jpg'
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, rendering.get('png_compression', 3)]
+        ext = '.png'
+    # 日本語パスに対応するため imencode + tofile で保存する
+    ok, encoded = cv2.imencode(ext, canvas, params)
+    if not ok:
+        raise RuntimeError(f"比較画像のエンコードに失敗しました: {save_path}")
+    if writer is not None:
+        writer.write_bytes(save_path, encoded.tobytes())
+        return
+    encoded.tofile(save_path)
+
+
 def visualize_comparison(
     original: np.ndarray,
     processed: np.ndarray,
     landmarks: List[np.ndarray],
     save_path: str,
-    bounding_box: Optional[Tuple[int, int, int, int]] = None
+    bounding_box: Optional[Tuple[int, int, int, int]] = None,
+    config: Optional['Config'] = None,
+    writer: Optional['OutputWriter'] = None
 ) -> None:
     """オリジナル画像、処理済み画像、ランドマークを比較する画像を作成
     
@@ -41,7 +147,26 @@ def visualize_comparison(
         landmarks: ランドマークのリスト
         save_path: 保存先パス
         bounding_box: バウンディングボックス (x, y, width, height) - 既に調整済み
+        config: 設定オブジェクト（描画バックエンドの選択。未指定時はmatplotlib）
+        writer: バックグラウンドの書き込みスレッド（指定時は描画とエンコードのみ行い、書き込みを任せる）
     """
+    if config is not None and config.RENDERING['backend'] == 'opencv':
+        _save_comparison_opencv(original, processed, landmarks, save_path, bounding_box, config, writer)
+    else:
+        _save_comparison_matplotlib(original, processed, landmarks, save_path, bounding_box, writer)
+
+
+def _save_comparison_matplotlib(
+    original: np.ndarray,
+    processed: np.ndarray,
+    landmarks: List[np.ndarray],
+    save_path: str,
+    bounding_box: Optional[Tuple[int, int, int, int]] = None,
+    writer: Optional['OutputWriter'] = None
+) -> None:
+    """matplotlibで比較画像を描画して保存する（論文用の出力向け）"""
+    import matplotlib.pyplot as plt  # 遅延import（オプション依存）
+    
     plt.figure(figsize=(15, 5))
     
     # オリジナル画像
@@ -77,13 +202,48 @@ def visualize_comparison(
     plt.axis('off')
     
     plt.tight_layout()
+    if writer is not None:
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format='png')
+        plt.close()
+        writer.write_bytes(save_path, buffer.getvalue())
+        return
     plt.savefig(save_path)
     plt.close()
 
 
+def should_save_comparison(
+    config: Optional['Config'],
+    frame_index: Optional[int],
+    is_detected: bool
+) -> bool:
+    """このフレームの比較画像を保存するかどうかを判定する
+    
+    Args:
+        config: 設定オブジェクト（未指定時は常に保存）
+        frame_index: ディレクトリ内でのフレーム番号（ファイル名順）
+        is_detected: 検出成功フラグ
+        
+    Returns:
+        比較画像を保存する場合True
+    """
+    if config is None:
+        return True
+    if not config.OUTPUTS['comparison']:
+        return False
+    sampling = config.COMPARISON_SAMPLING
+    if sampling['failures_only']:
+        return not is_detected
+    every_n = max(1, sampling['every_n'])
+    if every_n > 1 and frame_index is not None:
+        # 失敗したフレームは間引かずに保存する
+        return not is_detected or frame_index % every_n == 0
+    return True
+
+
 def save_processed_files(
     img_path: str,
-    orig_norm: np.ndarray,
+    orig_norm: Optional[np.ndarray],
     processed: np.ndarray,
     landmarks: np.ndarray,
     orignorm_dir: str,
@@ -91,13 +251,21 @@ def save_processed_files(
     landmarks_dir: str,
     comparison_dir: str,
     is_detected: bool,
-    bounding_box: Optional[Tuple[int, int, int, int]] = None
+    bounding_box: Optional[Tuple[int, int, int, int]] = None,
+    config: Optional['Config'] = None,
+    save_comparison: bool = True,
+    writer: Optional['OutputWriter'] = None
 ) -> None:
     """処理済みファイルを保存する
     
+    config.OUTPUTS で無効化された成果物は保存しない。orignorm / processed は
+    config.FRAME_STORAGE の形式（.npy / .png / .npz）で保存する。
+    writer を指定した場合、ファイルの書き込みはバックグラウンドのスレッドで行われ、
+    この関数は書き込みの完了を待たずに戻る（書き込み待ちが満杯の場合のみ待つ）。
+    
     Args:
-        img_path: 画像ファイルパス
-        orig_norm: 正規化済みオリジナル画像
+        img_path: 画像ファイルパス または スタック内のフレームID
+        orig_norm: 正規化済みオリジナル画像（orignorm と比較画像が不要な場合は None）
         processed: 処理済み画像
         landmarks: ランドマーク
         orignorm_dir: オリジナル正規化画像の保存先
@@ -105,27 +273,41 @@ def save_processed_files(
         landmarks_dir: ランドマークの保存先
         comparison_dir: 比較画像の保存先
         is_detected: 検出成功フラグ
+        bounding_box: バウンディングボックス (x, y, width, height)
+        config: 設定オブジェクト（出力の選択と比較画像の描画設定。未指定時はすべて保存）
+        save_comparison: 比較画像を保存するかどうか（should_save_comparison の判定結果）
+        writer: バックグラウンドの書き込みスレッド（未指定時はその場で書き込む）
     """
     suffix = '' if is_detected else '_ng'
-    base_name = os.path.basename(img_path).replace('.npy', '')
+    base_name = frame_base_name(img_path)
+    outputs = config.OUTPUTS if config is not None else {}
+    save = writer.save_npy if writer is not None else np.save
     
     # ファイルの保存
-    np.save(
-        os.path.join(orignorm_dir, f'{base_name}_orignorm{suffix}.npy'),
-        orig_norm
-    )
-    np.save(
-        os.path.join(processed_dir, f'{base_name}_processed{suffix}.npy'),
-        processed
-    )
-    np.save(
-        os.path.join(landmarks_dir, f'{base_name}_landmarks{suffix}.npy'),
-        landmarks
-    )
+    with profiler.stage('save'):
+        if outputs.get('orignorm', True):
+            save_frame(
+                frame_path(orignorm_dir, base_name, 'orignorm', suffix, config),
+                orig_norm, config, writer
+            )
+        if outputs.get('processed', True):
+            save_frame(
+                frame_path(processed_dir, base_name, 'processed', suffix, config),
+                processed, config, writer
+            )
+        if outputs.get('landmarks', True):
+            save(
+                os.path.join(landmarks_dir, f'{base_name}_landmarks{suffix}.npy'),
+                landmarks
+            )
     
     # 比較画像の保存
-    comparison_path = os.path.join(
-        comparison_dir,
-        f'{base_name}_comparison{suffix}.png'
-    )
-    visualize_comparison(orig_norm, processed, [landmarks], comparison_path, bounding_box)
+    if save_comparison and outputs.get('comparison', True):
+        comparison_path = os.path.join(
+            comparison_dir,
+            comparison_filename(base_name, suffix, config)
+        )
+        with profiler.stage('render'):
+            visualize_comparison(
+                orig_norm, processed, [landmarks], comparison_path, bounding_box, config, writer
+            )
@@ -1,25 +1,64 @@
 """単一画像からランドマーク座標を返す推論ユーティリティ"""
 
 import os
-from typing import Optional, Tuple, Union
+import copy
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple, Union
 
 import dlib
 import numpy as np
 
 from config import Config
-from image_processor import preprocess_image
-from landmark_detector import detect_landmarks
+from data_types import BatchResult
+from image_processor import get_preprocessor
+from landmark_detector import NUM_LANDMARKS, detect_landmarks
+import model_registry
+
+_local = threading.local()
+
+
+def _get_thread_detector() -> dlib.fhog_object_detector:
+    """このスレッド用の顔検出器を返す（スレッドごとに生成し、スレッド間で共有しない）"""
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        detector = _local.detector = dlib.get_frontal_face_detector()
+    return detector
 
 
 def _ensure_predictor(model_path: str) -> dlib.shape_predictor:
-    """shape_predictor のロードを行う。
+    """shape_predictor のロードを行う（プロセス内で1回だけロードし、以降は再利用する）。
     
     Raises:
         FileNotFoundError: 学習済みモデルが存在しない場合
     """
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"学習済みモデルが見つかりません: {model_path}")
-    return dlib.shape_predictor(model_path)
+    return model_registry.get_predictor(model_path)
+
+
+def _detect_array(
+    img: np.ndarray,
+    cfg: Config,
+    pred: dlib.shape_predictor,
+    detector: Optional[dlib.fhog_object_detector] = None,
+) -> Tuple[np.ndarray, bool, Optional[Tuple[int, int, int, int]]]:
+    """前処理からランドマーク検出までを行い、(landmarks, is_detected, bounding_box) を返す。"""
+    # 0-255 正規化は前処理側で行われるため、そのまま渡す
+    processed = get_preprocessor(cfg).process(img)
+
+    result = detect_landmarks(processed, pred, cfg, log_manager=None, detector=detector)
+
+    # 整合性チェック
+    if result.is_detected and len(result.landmarks_list) == 0:
+        result.is_detected = False
+
+    if result.is_detected:
+        landmarks = result.landmarks_list[0]
+    else:
+        landmarks = cfg.TEMPLATE_LANDMARKS
+
+    return landmarks.astype(np.int32), result.is_detected, result.bounding_box
 
 
 def landmarks_from_array(
@@ -34,6 +73,9 @@ def landmarks_from_array(
         config: 設定。未指定時は `Config()` を使用。
         predictor: 既にロード済みの dlib.shape_predictor。未指定時は自動ロード。
 
+    config.DETECTION_CACHE が有効な場合は、検出前に検出キャッシュを参照する
+    （同じ画像・同じ検出設定の結果があれば顔検出を省略する）。
+
     Returns:
         (landmarks, is_detected, bounding_box)
         - landmarks: np.ndarray[int32] 形状 (68, 2)。検出失敗時はテンプレートを返す。
@@ -42,22 +84,7 @@ def landmarks_from_array(
     """
     cfg = config or Config()
     pred = predictor or _ensure_predictor(cfg.LEARNED_MODEL_PATH)
-
-    # 0-255 正規化は前処理側で行われるため、そのまま渡す
-    processed = preprocess_image(img, cfg)
-
-    result = detect_landmarks(processed, pred, cfg, log_manager=None)
-
-    # 整合性チェック
-    if result.is_detected and len(result.landmarks_list) == 0:
-        result.is_detected = False
-
-    if result.is_detected:
-        landmarks = result.landmarks_list[0]
-    else:
-        landmarks = cfg.TEMPLATE_LANDMARKS
-
-    return landmarks.astype(np.int32), result.is_detected, result.bounding_box
+    return _detect_array(img, cfg, pred)
 
 
 def landmarks_from_path(
@@ -97,3 +124,174 @@ def landmarks_from_path(
     return landmarks_from_array(img, cfg, pred)
 
 
+def _detect_chunk(
+    args: Tuple[List[np.ndarray], Config],
+) -> List[Tuple[np.ndarray, bool, Optional[Tuple[int, int, int, int]]]]:
+    """プロセスプール用: ワーカー常駐のモデルで複数フレームを処理する。"""
+    frames, cfg = args
+    pred = model_registry.get_predictor(cfg.LEARNED_MODEL_PATH)
+    detector = model_registry.get_detector()
+    return [_detect_array(frame, cfg, pred, detector) for frame in frames]
+
+
+class LandmarkEngine:
+    """メモリ上のフレーム列をまとめて処理するバッチ推論エンジン。
+
+    予測器・検出器を保持し、呼び出しごとの初期化を行わない（検出器と前処理エンジンはスレッドごとに保持される）。
+    フレームは内部のスレッドプールまたはプロセスプールに分散して処理される。
+    executor="process" では予測器は各ワーカーがロードし、親プロセスでは detect などで
+    自分で処理する場合にのみロードする。
+
+    使用例:
+        with LandmarkEngine(max_workers=4) as engine:
+            result = engine.detect_batch(stack)  # stack: (N, H, W)
+            result.landmarks  # (N, 68, 2)
+    """
+
+    def __init__(
+        self,
+        config: Optional[Config] = None,
+        predictor: Optional[dlib.shape_predictor] = None,
+        predictor_path: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        executor: str = "process",
+        chunk_size: Optional[int] = None,
+    ):
+        """
+        Args:
+            config: 設定。未指定時は `Config()` を使用。
+            predictor: 既にロード済みの dlib.shape_predictor。未指定時は自動ロード。
+                ワーカープロセスには渡せないため、executor="thread" の場合のみ指定できる。
+            predictor_path: 学習済みモデルのパス。未指定時は config.LEARNED_MODEL_PATH。
+                executor="process" の場合は各ワーカーもこのモデルをロードする。
+            max_workers: ワーカー数。未指定時は CPU コア数。1 の場合はプールを使わずに逐次処理。
+            executor: "process"（ワーカーごとにモデルを常駐）または "thread"（モデルを共有）
+            chunk_size: 1タスクあたりのフレーム数。未指定時はワーカー数から自動決定。
+        """
+        if executor not in ("process", "thread"):
+            raise ValueError(f"executor は 'process' または 'thread' を指定してください: {executor}")
+        if predictor is not None and executor == "process":
+            raise ValueError(
+                "executor='process' ではロード済みの predictor をワーカーに渡せません。"
+                "predictor_path を指定してください"
+            )
+        self.config = config or Config()
+        if predictor_path is not None:
+            # ワーカーの初期化（init_worker）とタスク（_detect_chunk）は config のパスからロードする
+            self.config = copy.copy(self.config)
+            self.config.LEARNED_MODEL_PATH = predictor_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor_type = executor
+        self.chunk_size = chunk_size
+        self._pool: Optional[Executor] = None
+        self._predictor = predictor
+        if executor == "thread" or self.max_workers <= 1:
+            # 呼び出し元のスレッドやスレッドプールで処理する場合のみ、ここでロードする
+            self._predictor = predictor or _ensure_predictor(self.config.LEARNED_MODEL_PATH)
+        elif not os.path.exists(self.config.LEARNED_MODEL_PATH):
+            raise FileNotFoundError(f"学習済みモデルが見つかりません: {self.config.LEARNED_MODEL_PATH}")
+
+    @property
+    def predictor(self) -> dlib.shape_predictor:
+        """このプロセスの予測器（未ロードの場合はロードする。スレッド間で共有する）"""
+        if self._predictor is None:
+            self._predictor = _ensure_predictor(self.config.LEARNED_MODEL_PATH)
+        return self._predictor
+
+    @property
+    def detector(self) -> dlib.fhog_object_detector:
+        """呼び出し元のスレッド用の顔検出器"""
+        return _get_thread_detector()
+
+    def __enter__(self) -> "LandmarkEngine":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """内部のワーカープールを終了する。"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.executor_type == "process":
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=model_registry.init_worker,
+                    initargs=(self.config.LEARNED_MODEL_PATH,),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def detect(self, img: np.ndarray) -> Tuple[np.ndarray, bool, Optional[Tuple[int, int, int, int]]]:
+        """1フレームを処理する（呼び出し元のスレッドで実行）。
+
+        顔検出器と前処理エンジンはスレッドごとに保持されるため、複数スレッドから同時に呼び出せる。
+
+        Returns:
+            (landmarks, is_detected, bounding_box) - `landmarks_from_array` と同じ
+        """
+        return _detect_array(img, self.config, self.predictor, self.detector)
+
+    def submit_batch(
+        self, frames: List[np.ndarray]
+    ) -> "Future[List[Tuple[np.ndarray, bool, Optional[Tuple[int, int, int, int]]]]]":
+        """複数フレームを1タスクとしてワーカープールに投入する（結果を待たない）。
+
+        呼び出し元のスレッドをブロックしないため、複数のリクエストをまとめて
+        処理するサーバー（landmark_server）から使用する。
+
+        Returns:
+            Future: フレームごとの (landmarks, is_detected, bounding_box) のリストを返す
+        """
+        if self.executor_type == "thread":
+            return self._get_pool().submit(lambda: [self.detect(frame) for frame in frames])
+        return self._get_pool().submit(_detect_chunk, (list(frames), self.config))
+
+    def detect_batch(self, frames: Union[np.ndarray, Iterable[np.ndarray]]) -> BatchResult:
+        """複数フレームをまとめて処理する。
+
+        Args:
+            frames: (N, H, W) のスタック、または2D/3D配列のイテラブル
+
+        Returns:
+            BatchResult: landmarks (N, 68, 2)、is_detected (N,)、bounding_boxes (N, 4)
+        """
+        if isinstance(frames, np.ndarray):
+            if frames.ndim == 2:
+                frames = frames[np.newaxis]
+            frame_list: Union[np.ndarray, List[np.ndarray]] = frames
+        else:
+            frame_list = list(frames)
+        n = len(frame_list)
+
+        if self.max_workers <= 1 or (n <= 1 and self.executor_type == "thread"):
+            outputs = [self.detect(frame) for frame in frame_list]
+        elif self.executor_type == "thread":
+            # 顔検出器と前処理エンジンはスレッドごとに作成される
+            outputs = list(self._get_pool().map(self.detect, frame_list))
+        else:
+            chunk_size = self.chunk_size or max(1, -(-n // (self.max_workers * 4)))
+            chunks = [
+                (list(frame_list[start:start + chunk_size]), self.config)
+                for start in range(0, n, chunk_size)
+            ]
+            outputs = [
+                output
+                for chunk_outputs in self._get_pool().map(_detect_chunk, chunks)
+                for output in chunk_outputs
+            ]
+
+        landmarks = np.empty((n, NUM_LANDMARKS, 2), dtype=np.int32)
+        is_detected = np.zeros(n, dtype=bool)
+        bounding_boxes = np.full((n, 4), -1, dtype=np.int32)
+        for i, (frame_landmarks, detected, bbox) in enumerate(outputs):
+            landmarks[i] = frame_landmarks
+            is_detected[i] = detected
+            if bbox is not None:
+                bounding_boxes[i] = bbox
+        return BatchResult(landmarks=landmarks, is_detected=is_detected, bounding_boxes=bounding_boxes)
@@ -0,0 +1,261 @@
+"""ランドマーク検出サーバーのクライアントと負荷生成ツール
+
+landmark_server.py に検出リクエストを送る。NumPy 以外のライブラリ（OpenCV、dlib など）を
+import しないため、呼び出し側のプロセスの起動は軽い。
+
+負荷生成ツールは指定した並列数でリクエストを送り続け、クライアント側で計測した
+スループットとレイテンシのパーセンタイル、およびサーバーの統計（/metrics）を表示する。
+
+使用例:
+    python landmark_client.py --url http://127.0.0.1:8765 --dir folder1 --concurrency 8 --requests 2000
+    python landmark_client.py --unix-socket /tmp/landmark.sock --resolution 640x480 --requests 500
+"""
+
+import os
+import json
+import glob
+import time
+import socket
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """Unix ソケットに接続する HTTPConnection"""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class LandmarkClient:
+    """ランドマーク検出サーバーのクライアント
+
+    接続を使い回すため、1つのインスタンスを複数スレッドから同時に使用してはならない
+    （スレッドごとにインスタンスを作成する）。
+
+    使用例:
+        client = LandmarkClient('http://127.0.0.1:8765')
+        landmarks, is_detected, bounding_box = client.detect(img)
+    """
+
+    def __init__(self, url: str = 'http://127.0.0.1:8765', unix_socket: Optional[str] = None, timeout: float = 60.0):
+        """
+        Args:
+            url: サーバーのURL
+            unix_socket: Unix ソケットのパス（指定時は url の代わりに使用）
+            timeout: タイムアウト（秒）
+        """
+        self.url = url
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            if self.unix_socket:
+                self._conn = _UnixHTTPConnection(self.unix_socket, self.timeout)
+            else:
+                parsed = urlparse(self.url)
+                self._conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self.timeout)
+        return self._conn
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, Any]]:
+        """リクエストを送り、(ステータス, JSON) を返す（切断されていた場合は1回だけ再接続する）"""
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, json.loads(response.read().decode('utf-8'))
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt == 1:
+                    raise
+        raise RuntimeError("unreachable")
+
+    def detect(self, img: np.ndarray) -> Tuple[np.ndarray, bool, Optional[Tuple[int, int, int, int]]]:
+        """1フレームのランドマークを検出する
+
+        Returns:
+            (landmarks, is_detected, bounding_box) - inference.landmarks_from_array と同じ
+
+        Raises:
+            RuntimeError: サーバーがエラーを返した場合
+        """
+        img = np.ascontiguousarray(img)
+        status, payload = self._request('POST', '/detect', body=img.tobytes(), headers={
+            'Content-Type': 'application/octet-stream',
+            'X-Shape': ','.join(str(dim) for dim in img.shape),
+            'X-Dtype': img.dtype.str,
+        })
+        if status != 200:
+            raise RuntimeError(f"サーバーエラー ({status}): {payload.get('error')}")
+        bounding_box = tuple(payload['bounding_box']) if payload['bounding_box'] is not None else None
+        return np.asarray(payload['landmarks'], dtype=np.int32), payload['is_detected'], bounding_box
+
+    def detect_npy(self, path: str) -> Tuple[np.ndarray, bool, Optional[Tuple[int, int, int, int]]]:
+        """.npy ファイルをそのまま送ってランドマークを検出する"""
+        with open(path, 'rb') as f:
+            body = f.read()
+        status, payload = self._request('POST', '/detect', body=body,
+                                        headers={'Content-Type': 'application/x-npy'})
+        if status != 200:
+            raise RuntimeError(f"サーバーエラー ({status}): {payload.get('error')}")
+        bounding_box = tuple(payload['bounding_box']) if payload['bounding_box'] is not None else None
+        return np.asarray(payload['landmarks'], dtype=np.int32), payload['is_detected'], bounding_box
+
+    def metrics(self) -> Dict[str, Any]:
+        """サーバーの統計情報を返す"""
+        return self._request('GET', '/metrics')[1]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def run_load(
+    make_client,
+    frames: List[np.ndarray],
+    concurrency: int,
+    total_requests: int
+) -> Dict[str, Any]:
+    """並列にリクエストを送り続け、クライアント側のスループットとレイテンシを計測する
+
+    Args:
+        make_client: LandmarkClient を作成する関数（スレッドごとに呼び出す）
+        frames: 送信するフレーム（順に繰り返し使う）
+        concurrency: 並列数
+        total_requests: 送信するリクエストの総数
+
+    Returns:
+        集計結果（requests, errors, detected, requests_per_s, mean/p50/p90/p99_ms）
+    """
+    latencies: List[float] = []
+    errors: List[str] = []
+    detected = [0]
+    counter = iter(range(total_requests))
+    lock = threading.Lock()
+
+    def worker() -> None:
+        client = make_client()
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    _, is_detected, _ = client.detect(frames[i % len(frames)])
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                latency = time.perf_counter() - start
+                with lock:
+                    latencies.append(latency)
+                    detected[0] += int(is_detected)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'detected': detected[0],
+        'elapsed_s': elapsed,
+        'requests_per_s': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': float(values.mean()) if len(values) else 0.0,
+        'p50_ms': float(np.percentile(values, 50)) if len(values) else 0.0,
+        'p90_ms': float(np.percentile(values, 90)) if len(values) else 0.0,
+        'p99_ms': float(np.percentile(values, 99)) if len(values) else 0.0,
+    }
+
+
+def load_frames(input_dir: Optional[str], resolution: Tuple[int, int], limit: int, seed: int) -> List[np.ndarray]:
+    """負荷生成に使うフレームを用意する（ディレクトリの .npy、無い場合はランダムなフレーム）"""
+    if input_dir:
+        paths = sorted(glob.glob(os.path.join(input_dir, '*.npy')))[:limit]
+        return [np.load(path) for path in paths]
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 1024, size=(height, width), dtype=np.uint16) for _ in range(min(limit, 16))]
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description='ランドマーク検出サーバーの負荷生成ツール')
+    parser.add_argument('--url', default='http://127.0.0.1:8765', help='サーバーのURL')
+    parser.add_argument('--unix-socket', help='Unix ソケットのパス（指定時は --url の代わりに使用）')
+    parser.add_argument('--dir', help='送信するNIR画像(.npy)が含まれるディレクトリ（未指定時はランダムなフレーム）')
+    parser.add_argument('--resolution', default='640x480', help='ランダムなフレームの解像度（幅x高さ）')
+    parser.add_argument('--limit', type=int, default=200, help='--dir から読み込む最大フレーム数')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8],
+                        help='並列数（複数指定すると順に計測）')
+    parser.add_argument('--requests', type=int, default=500, help='並列数ごとのリクエスト数')
+    parser.add_argument('--seed', type=int, default=0, help='ランダムなフレームの乱数シード')
+    parser.add_argument('--output', help='結果を保存するJSONファイルのパス')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    frames = load_frames(args.dir, (width, height), args.limit, args.seed)
+    if not frames:
+        print(f"エラー: {args.dir} 内に.npyファイルが見つかりません。")
+        exit(1)
+
+    def make_client() -> LandmarkClient:
+        return LandmarkClient(args.url, args.unix_socket)
+
+    results = []
+    print(f"\n{'='*80}")
+    print(f"📡 負荷生成（{args.unix_socket and 'unix:' + args.unix_socket or args.url}、"
+          f"{len(frames)} フレーム × 並列数ごとに {args.requests} リクエスト）")
+    print(f"{'='*80}")
+    print(f"{'並列数':>6} {'req/s':>10} {'平均ms':>9} {'p50ms':>9} {'p90ms':>9} {'p99ms':>9} {'検出':>7} {'エラー':>6}")
+    for concurrency in args.concurrency:
+        result = {'concurrency': concurrency, **run_load(make_client, frames, concurrency, args.requests)}
+        results.append(result)
+        print(f"{concurrency:>8} {result['requests_per_s']:>10.1f} {result['mean_ms']:>10.2f} "
+              f"{result['p50_ms']:>9.2f} {result['p90_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+              f"{result['detected']:>8} {result['errors']:>7}")
+        if result['first_error']:
+            print(f"   ⚠️ {result['first_error']}")
+    print(f"{'='*80}")
+
+    client = make_client()
+    server_metrics = client.metrics()
+    client.close()
+    print(f"🖥️ サーバーの統計: 平均バッチサイズ {server_metrics['mean_batch_size']:.2f}、"
+          f"キュー待ち平均 {server_metrics['queue_wait_ms']['mean']:.2f} ms、"
+          f"p90 {server_metrics['latency_ms']['p90']:.2f} ms、拒否 {server_metrics['rejected']} 件")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'results': results, 'server_metrics': server_metrics}, f, ensure_ascii=False, indent=2)
+        print(f"結果を {args.output} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
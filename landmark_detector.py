@@ -1,119 +1,313 @@
 """ランドマーク検出モジュール"""
 
+import cv2
 import dlib
 import numpy as np
 from typing import List, Optional, Tuple, TYPE_CHECKING
 
 # 定数定義
 NUM_LANDMARKS = 68
-from data_types import DetectionInfo, DetectionResult
+from data_types import DetectionInfo, DetectionResult, FaceDetection
+import detection_cache
+import model_registry
+import profiler
 
 if TYPE_CHECKING:
     from config import Config
     from logger import LogManager
 
 
-def detect_landmarks(
+def get_upsample_times(config: 'Config') -> List[int]:
+    """検出モードに応じたアップサンプリング回数のリストを返す
+    
+    cascade モードの1段目は normal と同じく0回のみで、失敗したフレームは
+    high モードで再検出される。
+    """
+    if config.DETECTION_MODE == 'high':
+        return [1, 2]  # high mode: 1, 2回（必ずアップサンプリング）
+    return [0]  # normal / cascade mode: 0回のみ
+
+
+def find_faces(
     processed_img: np.ndarray,
-    predictor: dlib.shape_predictor,
     config: 'Config',
-    log_manager: Optional['LogManager'] = None
-) -> DetectionResult:
-    """画像からランドマークを検出する
+    detector: Optional[dlib.fhog_object_detector] = None,
+    roi: Optional[Tuple[int, int, int, int]] = None
+) -> FaceDetection:
+    """顔検出のみを行い、調整前の検出矩形を返す
+    
+    アップサンプリング回数を get_upsample_times の順に試し、最初に顔が見つかった
+    回数での検出矩形をすべて返す。BOUNDING_BOX_SCALE_X/Y による調整は行わないため、
+    結果を保存しておけば fit_landmarks で矩形の倍率だけを変えて予測し直せる。
     
     Args:
         processed_img: 前処理済み画像
-        predictor: dlibのランドマーク予測器
-        config: 設定オブジェクト
-        log_manager: ログマネージャー（オプション）
+        config: 設定オブジェクト（DETECTION_MODE と DETECTION_SCALE を使用）
+        detector: dlibの顔検出器（未指定時はプロセス内で共有される検出器を使用）
+        roi: 顔検出を行う探索窓 (left, top, right, bottom)。未指定時は画像全体。
         
     Returns:
-        DetectionResult: 検出結果
+        FaceDetection: 検出矩形は画像全体の座標 (x, y, width, height)
+
+    Raises:
+        ValueError: DETECTION_SCALE が 0 より大きく 1 以下でない場合
     """
-    detector = dlib.get_frontal_face_detector()
-    best_rects = []
-    best_upsample = 0
-    detection_info: List[DetectionInfo] = []
-    best_bounding_box: Optional[Tuple[int, int, int, int]] = None
-    adjusted_bounding_box: Optional[Tuple[int, int, int, int]] = None
-    
-    # モードに応じてアップサンプリング回数を設定
-    if config.DETECTION_MODE == 'high':
-        upsample_times = [1, 2]  # high mode: 1, 2回（必ずアップサンプリング）
-    else:  # normal mode
-        upsample_times = [0]  # normal mode: 0回のみ
+    if detector is None:
+        detector = model_registry.get_detector()
+    
+    # 探索窓が指定されている場合はその範囲だけで顔検出を行う
+    if roi is not None:
+        roi_left, roi_top, roi_right, roi_bottom = roi
+        search_img = np.ascontiguousarray(processed_img[roi_top:roi_bottom, roi_left:roi_right])
+        reason_prefix = 'ROI: '
+    else:
+        roi_left, roi_top = 0, 0
+        search_img = processed_img
+        reason_prefix = ''
     
-    for upsample in upsample_times:
+    # 縮小画像で顔検出を行う（ランドマーク予測はフル解像度で行う）
+    scale = config.DETECTION_SCALE
+    if not 0 < scale <= 1.0:
+        raise ValueError(f"DETECTION_SCALE は 0 より大きく 1 以下で指定してください: {scale}")
+    if scale < 1.0:
+        with profiler.stage('detect.resize'):
+            search_img = cv2.resize(search_img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    result = FaceDetection(rects=[], best_upsample=None, detection_info=[])
+    for upsample in get_upsample_times(config):
+        current_info = DetectionInfo(
+            upsample=upsample,
+            reason=f'{reason_prefix}顔が検出されませんでした'
+        )
         try:
-            rects = detector(processed_img, upsample)
-            current_info = DetectionInfo(
-                upsample=upsample,
-                reason='顔が検出されませんでした'
-            )
+            with profiler.stage(f'detect.upsample{upsample}'):
+                rects = detector(search_img, upsample)
             
-            if len(rects) > 0:
-                # 最初に検出された顔を使用
-                if not best_rects:
-                    best_rects = [rects[0]]
-                    best_upsample = upsample
-                    # バウンディングボックス情報を保存（調整前の矩形）
-                    rect = rects[0]
-                    best_bounding_box = (rect.left(), rect.top(), rect.width(), rect.height())
-                    current_info.reason = '成功'
+            # 縮小率と探索窓の位置を戻して画像全体の座標に変換する
+            for rect in rects:
+                left = int(round(rect.left() / scale)) + roi_left
+                top = int(round(rect.top() / scale)) + roi_top
+                right = int(round(rect.right() / scale)) + roi_left
+                bottom = int(round(rect.bottom() / scale)) + roi_top
+                # dlib.rectangle と同じく幅・高さは両端を含む
+                result.rects.append((left, top, right - left + 1, bottom - top + 1))
+            if result.rects:
+                result.best_upsample = upsample
+                current_info.reason = f'{reason_prefix}成功'
             
         except Exception as e:
-            current_info.reason = f'エラー: {str(e)}'
+            current_info.reason = f'{reason_prefix}エラー: {str(e)}'
+            result.had_error = True
         
-        detection_info.append(current_info)
+        result.detection_info.append(current_info)
         
         # 検出に成功したら終了
-        if best_rects:
+        if result.rects:
             break
     
-    # 検出が成功したかどうかの判定
-    is_detected = len(best_rects) > 0
-    landmarks_list: List[np.ndarray] = []
-    
-    if is_detected:
-        for rect in best_rects:
-            try:
-                # 矩形のサイズを調整
-                x, y, w, h = rect.left(), rect.top(), rect.width(), rect.height()
-                center_x = x + w / 2
-                center_y = y + h / 2
-                new_w = w * config.BOUNDING_BOX_SCALE_X
-                new_h = h * config.BOUNDING_BOX_SCALE_Y
-                new_x = center_x - new_w / 2
-                new_y = center_y - new_h / 2
-                
-                # 調整された矩形を作成
-                adjusted_rect = dlib.rectangle(int(new_x), int(new_y), 
-                                             int(new_x + new_w), int(new_y + new_h))
-                
-                # 調整された矩形でランドマーク検出
-                shape = predictor(processed_img, adjusted_rect)
-                landmarks = np.array(
-                    [[shape.part(i).x, shape.part(i).y] for i in range(NUM_LANDMARKS)]
-                )
-                landmarks_list.append(landmarks.astype(np.int32))
-                
-                # 調整された矩形の情報を保存
-                adjusted_bounding_box = (int(new_x), int(new_y), int(new_w), int(new_h))
-            except Exception as e:
-                error_msg = f"ランドマーク処理エラー: {str(e)}"
-                if log_manager:
-                    log_manager.log_error(error_msg)
-                else:
-                    print(error_msg)
-                continue
-    
-    if not is_detected:
-        best_upsample = None
+    return result
+
+
+def get_box_scales(config: 'Config') -> Tuple[float, float]:
+    """設定のバウンディングボックス倍率 (BOUNDING_BOX_SCALE_X, BOUNDING_BOX_SCALE_Y) を返す"""
+    return config.BOUNDING_BOX_SCALE_X, config.BOUNDING_BOX_SCALE_Y
+
+
+def _scale_rect(
+    rect: Tuple[int, int, int, int],
+    scales: Tuple[float, float]
+) -> Tuple[float, float, float, float]:
+    """検出矩形を中心を保ったまま拡大縮小する（小数のまま返す）"""
+    x, y, w, h = rect
+    scale_x, scale_y = scales
+    center_x = x + w / 2
+    center_y = y + h / 2
+    new_w = w * scale_x
+    new_h = h * scale_y
+    return center_x - new_w / 2, center_y - new_h / 2, new_w, new_h
+
+
+def adjust_rect(
+    rect: Tuple[int, int, int, int],
+    scales: Tuple[float, float]
+) -> Tuple[int, int, int, int]:
+    """検出矩形を中心を保ったまま拡大縮小する
+    
+    Args:
+        rect: 検出矩形 (x, y, width, height)
+        scales: (横幅倍率, 縦幅倍率)
+        
+    Returns:
+        調整後の矩形 (x, y, width, height)
+    """
+    new_x, new_y, new_w, new_h = _scale_rect(rect, scales)
+    return int(new_x), int(new_y), int(new_w), int(new_h)
+
+
+def fit_landmarks(
+    processed_img: np.ndarray,
+    rects: List[Tuple[int, int, int, int]],
+    predictor: dlib.shape_predictor,
+    scales: Tuple[float, float],
+    log_manager: Optional['LogManager'] = None
+) -> List[Optional[np.ndarray]]:
+    """検出矩形を倍率で調整してランドマークを予測する
     
+    Args:
+        processed_img: 前処理済み画像
+        rects: find_faces の検出矩形 (x, y, width, height) のリスト
+        predictor: dlibのランドマーク予測器
+        scales: バウンディングボックスの (横幅倍率, 縦幅倍率)（get_box_scales など）
+        log_manager: ログマネージャー（オプション）
+        
+    Returns:
+        矩形ごとのランドマーク (68, 2) int32 のリスト（予測に失敗した矩形は None）
+    """
+    landmarks_list: List[Optional[np.ndarray]] = []
+    for rect in rects:
+        try:
+            # 調整された矩形でランドマーク検出
+            # 右端・下端は切り捨て前の値から求める（切り捨て後の幅を足すと1px小さくなる場合がある）
+            new_x, new_y, new_w, new_h = _scale_rect(rect, scales)
+            adjusted_rect = dlib.rectangle(
+                int(new_x), int(new_y), int(new_x + new_w), int(new_y + new_h)
+            )
+            with profiler.stage('predict'):
+                shape = predictor(processed_img, adjusted_rect)
+            landmarks = np.array(
+                [[shape.part(i).x, shape.part(i).y] for i in range(NUM_LANDMARKS)]
+            )
+            landmarks_list.append(landmarks.astype(np.int32))
+        except Exception as e:
+            error_msg = f"ランドマーク処理エラー: {str(e)}"
+            if log_manager:
+                log_manager.log_error(error_msg)
+            else:
+                print(error_msg)
+            landmarks_list.append(None)
+    return landmarks_list
+
+
+def _build_result(
+    face_rect: Optional[Tuple[int, int, int, int]],
+    best_upsample: Optional[int],
+    detection_info: List[DetectionInfo],
+    landmarks: Optional[np.ndarray],
+    config: 'Config',
+    roi: Optional[Tuple[int, int, int, int]]
+) -> DetectionResult:
+    """検出矩形とランドマークから DetectionResult を作成する"""
+    is_detected = face_rect is not None
+    landmarks_list = [landmarks] if is_detected and landmarks is not None else []
+    # ランドマークを予測できた場合は調整後の矩形、できなかった場合は調整前の矩形
+    bounding_box = adjust_rect(face_rect, get_box_scales(config)) if landmarks_list else face_rect
     return DetectionResult(
         landmarks_list=landmarks_list,
-        best_upsample=best_upsample,
+        best_upsample=best_upsample if is_detected else None,
         detection_info=detection_info,
         is_detected=is_detected,
-        bounding_box=adjusted_bounding_box if adjusted_bounding_box else best_bounding_box
+        bounding_box=bounding_box,
+        face_rect=face_rect,
+        roi_used=roi is not None
     )
+
+
+def landmarks_from_faces(
+    processed_img: np.ndarray,
+    faces: FaceDetection,
+    predictor: dlib.shape_predictor,
+    config: 'Config',
+    log_manager: Optional['LogManager'] = None,
+    landmarks: Optional[np.ndarray] = None
+) -> DetectionResult:
+    """記録済みの顔検出の結果から検出結果を作る（顔検出を行わない）
+    
+    再実行時に出力の設定だけが変わったフレームの成果物を作り直す場合に使う。
+    
+    Args:
+        processed_img: 前処理済み画像
+        faces: 記録済みの顔検出の結果（顔が無かったフレームは rects が空）
+        predictor: dlibのランドマーク予測器
+        config: 設定オブジェクト
+        log_manager: ログマネージャー（オプション）
+        landmarks: 保存済みのランドマーク（無い場合は検出矩形から予測し直す）
+        
+    Returns:
+        DetectionResult: 検出結果
+    """
+    face_rect = faces.rects[0] if faces.rects else None
+    if face_rect is not None and landmarks is None:
+        landmarks = fit_landmarks(processed_img, [face_rect], predictor, get_box_scales(config), log_manager)[0]
+    return _build_result(face_rect, faces.best_upsample, faces.detection_info, landmarks, config, None)
+
+
+def detect_landmarks(
+    processed_img: np.ndarray,
+    predictor: dlib.shape_predictor,
+    config: 'Config',
+    log_manager: Optional['LogManager'] = None,
+    detector: Optional[dlib.fhog_object_detector] = None,
+    roi: Optional[Tuple[int, int, int, int]] = None
+) -> DetectionResult:
+    """画像からランドマークを検出する
+    
+    find_faces で顔検出を行い、最初に検出された顔の矩形を fit_landmarks で
+    BOUNDING_BOX_SCALE_X/Y に従って調整してランドマークを予測する。
+    config.DETECTION_SCALE が1未満の場合は縮小画像で顔検出を行い、検出矩形を
+    元の解像度に戻してから、フル解像度の画像でランドマーク予測を行う。
+    
+    config.DETECTION_CACHE が有効な場合は、まず検出キャッシュ（detection_cache）を
+    参照する。ランドマークに影響する設定だけが異なる場合は、キャッシュの検出矩形から
+    ランドマーク予測のみやり直す。
+    
+    Args:
+        processed_img: 前処理済み画像
+        predictor: dlibのランドマーク予測器
+        config: 設定オブジェクト
+        log_manager: ログマネージャー（オプション）
+        detector: dlibの顔検出器（未指定時はプロセス内で共有される検出器を使用）
+        roi: 顔検出を行う探索窓 (left, top, right, bottom)。未指定時は画像全体。
+            ランドマーク予測は常に画像全体の座標系で行う。
+        
+    Returns:
+        DetectionResult: 検出結果
+    """
+    cache = detection_cache.get_cache(config)
+    key = None
+    fingerprint = None
+    if cache is not None:
+        with profiler.stage('detect.cache'):
+            fingerprint = detection_cache.landmark_fingerprint(config)
+            key = cache.make_key(
+                processed_img,
+                detection_cache.detection_fingerprint(config, get_upsample_times(config)),
+                roi
+            )
+            cached = cache.get(key)
+        if cached is not None:
+            landmarks = cached.landmarks
+            if cached.face_rect is not None and (
+                landmarks is None or cached.landmark_fingerprint != fingerprint
+            ):
+                landmarks = fit_landmarks(
+                    processed_img, [cached.face_rect], predictor, get_box_scales(config), log_manager
+                )[0]
+                if landmarks is not None:
+                    cache.put(key, cached.face_rect, cached.best_upsample, cached.detection_info,
+                              fingerprint, landmarks)
+            return _build_result(
+                cached.face_rect, cached.best_upsample, cached.detection_info, landmarks, config, roi
+            )
+    
+    # 最初に検出された顔を使用
+    faces = find_faces(processed_img, config, detector, roi)
+    face_rect = faces.rects[0] if faces.rects else None
+    landmarks = None
+    if face_rect is not None:
+        landmarks = fit_landmarks(processed_img, [face_rect], predictor, get_box_scales(config), log_manager)[0]
+    
+    # 例外による失敗は一時的な可能性があるためキャッシュしない
+    if cache is not None and not faces.had_error and (face_rect is None or landmarks is not None):
+        cache.put(key, face_rect, faces.best_upsample, faces.detection_info, fingerprint, landmarks)
+    
+    return _build_result(face_rect, faces.best_upsample, faces.detection_info, landmarks, config, roi)
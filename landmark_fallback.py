@@ -0,0 +1,154 @@
+"""検出失敗フレームのランドマーク補完モジュール
+
+処理の完了順ではなくフレーム番号（ファイル名順）で、検出に失敗したフレームを
+前後の最も近い成功フレームのランドマークで補完する。結果はフレーム番号で
+並べ直してから順に評価するため、ワーカー数や完了順によらず同じ結果になる。
+
+保持するのは並べ替え待ちの結果と、次の成功フレームを待っている失敗フレームだけで、
+メモリ使用量はディレクトリのフレーム数に比例しない。
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+FALLBACK_MODES = ('previous', 'nearest', 'interpolate')
+
+# 成功フレームのランドマーク（再実行時の引き継ぎ分は必要になった時点で読み込む）
+LandmarkSource = Union[np.ndarray, Callable[[], Optional[np.ndarray]]]
+
+_DETECTED = 'detected'
+_FAILED = 'failed'
+_SKIPPED = 'skipped'
+
+
+def fill_landmarks(
+    index: int,
+    prev: Optional[Tuple[int, np.ndarray]],
+    next_: Optional[Tuple[int, np.ndarray]],
+    mode: str
+) -> Optional[np.ndarray]:
+    """前後の成功フレームから失敗フレームのランドマークを求める
+
+    Args:
+        index: 失敗フレームのフレーム番号
+        prev: 直前の成功フレームの (フレーム番号, ランドマーク)
+        next_: 直後の成功フレームの (フレーム番号, ランドマーク)
+        mode: 'previous'（直前の成功フレーム）、'nearest'（前後で近い方、同じ距離なら直前）
+            または 'interpolate'（前後の線形補間）
+
+    Returns:
+        補完したランドマーク (68, 2)。使える成功フレームが無い場合は None
+    """
+    if mode == 'previous':
+        return prev[1] if prev is not None else None
+    if prev is None or next_ is None:
+        side = prev if prev is not None else next_
+        return side[1] if side is not None else None
+    if mode == 'nearest':
+        return prev[1] if index - prev[0] <= next_[0] - index else next_[1]
+    t = (index - prev[0]) / (next_[0] - prev[0])
+    interpolated = prev[1].astype(np.float64) * (1 - t) + next_[1].astype(np.float64) * t
+    return np.rint(interpolated).astype(prev[1].dtype)
+
+
+class _LazyLandmarks:
+    """必要になった時点で1回だけ読み込むランドマーク"""
+
+    def __init__(self, loader: Callable[[], Optional[np.ndarray]]):
+        self._loader: Optional[Callable[[], Optional[np.ndarray]]] = loader
+        self._value: Optional[np.ndarray] = None
+
+    def get(self) -> Optional[np.ndarray]:
+        if self._loader is not None:
+            self._value = self._loader()
+            self._loader = None
+        return self._value
+
+
+class FallbackFiller:
+    """フレーム番号順にランドマークを補完するクラス
+
+    各フレームの結果を任意の順序で add_* に渡すと、フレーム番号順に並べ直し、
+    補完先が確定した失敗フレームを (payload, ランドマーク) のリストとして返す。
+    ランドマークが None の場合は補完に使える成功フレームが無かったことを示す。
+    """
+
+    def __init__(self, mode: str = 'nearest'):
+        if mode not in FALLBACK_MODES:
+            raise ValueError(f"不明な補完モードです: {mode}")
+        self.mode = mode
+        self._cursor = 0
+        self._reorder: Dict[int, Tuple[str, Any]] = {}
+        self._last_success: Optional[Tuple[int, Any]] = None
+        self._waiting: List[Tuple[int, Any]] = []  # 次の成功フレームを待っている失敗フレーム
+
+    @property
+    def next_index(self) -> int:
+        """次に評価するフレーム番号"""
+        return self._cursor
+
+    def add_detected(self, index: int, landmarks: LandmarkSource) -> List[Tuple[Any, Optional[np.ndarray]]]:
+        """検出に成功したフレームを追加する"""
+        return self._add(index, _DETECTED, landmarks)
+
+    def add_failed(self, index: int, payload: Any) -> List[Tuple[Any, Optional[np.ndarray]]]:
+        """検出に失敗したフレーム（補完対象）を追加する"""
+        return self._add(index, _FAILED, payload)
+
+    def add_skipped(self, index: int) -> List[Tuple[Any, Optional[np.ndarray]]]:
+        """補完に関係しないフレーム（処理エラーや前回の失敗フレーム）を追加する"""
+        return self._add(index, _SKIPPED, None)
+
+    def finish(self) -> List[Tuple[Any, Optional[np.ndarray]]]:
+        """残りの失敗フレームを直前の成功フレームのみで補完する（全フレームの追加後に呼ぶ）"""
+        resolved = self._resolve_waiting(None)
+        self._reorder.clear()
+        return resolved
+
+    def _add(self, index: int, kind: str, value: Any) -> List[Tuple[Any, Optional[np.ndarray]]]:
+        self._reorder[index] = (kind, value)
+        resolved: List[Tuple[Any, Optional[np.ndarray]]] = []
+        while self._cursor in self._reorder:
+            kind, value = self._reorder.pop(self._cursor)
+            if kind == _DETECTED:
+                if callable(value):
+                    value = _LazyLandmarks(value)
+                resolved.extend(self._resolve_waiting((self._cursor, value)))
+                self._last_success = (self._cursor, value)
+            elif kind == _FAILED:
+                self._waiting.append((self._cursor, value))
+                if self.mode == 'previous':
+                    resolved.extend(self._resolve_waiting(None))
+            self._cursor += 1
+        return resolved
+
+    def _resolve_waiting(
+        self,
+        next_success: Optional[Tuple[int, Any]]
+    ) -> List[Tuple[Any, Optional[np.ndarray]]]:
+        """待機中の失敗フレームを前後の成功フレームで補完する"""
+        if not self._waiting:
+            return []
+        prev = self._materialize(self._last_success)
+        next_ = self._materialize(next_success)
+        resolved = [
+            (payload, fill_landmarks(index, prev, next_, self.mode))
+            for index, payload in self._waiting
+        ]
+        self._waiting = []
+        return resolved
+
+    def _materialize(
+        self,
+        success: Optional[Tuple[int, Any]]
+    ) -> Optional[Tuple[int, np.ndarray]]:
+        """遅延読み込みのランドマークを読み込む（読めない場合は None）"""
+        if success is None:
+            return None
+        index, landmarks = success
+        if isinstance(landmarks, _LazyLandmarks):
+            landmarks = landmarks.get()
+            if landmarks is None:
+                return None
+        return index, landmarks
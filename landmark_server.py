@@ -0,0 +1,391 @@
+"""ランドマーク検出サーバー
+
+モデルを常駐させたワーカープール（inference.LandmarkEngine）を保持し、
+HTTP（または Unix ソケット）で1フレームずつ検出リクエストを受け付ける。
+呼び出しごとの Python の起動・ライブラリの import・モデルのロードが不要になる。
+
+同時に届いたリクエストは最大 max_batch 件（最初のリクエストから最大 max_wait_ms 待つ）
+ずつまとめて1タスクとしてワーカーに投入する（マイクロバッチ）。
+
+エンドポイント:
+    POST /detect   本文: .npy 形式の配列（np.save の出力）、または
+                   X-Shape（例: 480,640）と X-Dtype（例: uint16）ヘッダーを付けた生のバイト列
+                   応答: {"landmarks": [[x, y], ...], "is_detected": bool,
+                          "bounding_box": [x, y, w, h] | null, "latency_ms": float}
+    GET  /metrics  スループット、レイテンシのパーセンタイル、バッチサイズなどの統計（JSON）
+    GET  /health   {"status": "ok"}
+
+使用例:
+    python landmark_server.py --port 8765 --workers 4
+    python landmark_server.py --unix-socket /tmp/landmark.sock
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from inference import LandmarkEngine
+
+
+class ServerMetrics:
+    """サーバーの統計情報（複数スレッドから更新される）"""
+
+    def __init__(self, window: int = 10000):
+        """
+        Args:
+            window: パーセンタイルの計算に使う直近のリクエスト数
+        """
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0  # キューが満杯で受け付けなかったリクエスト数
+        self.batches = 0
+        self.batched_frames = 0
+        self._latencies: deque = deque(maxlen=window)  # (完了時刻, リクエストのレイテンシ秒)
+        self._queue_waits: deque = deque(maxlen=window)  # バッチに入るまでの待ち時間（秒）
+        self._lock = threading.Lock()
+
+    def add_batch(self, size: int, queue_waits: List[float]) -> None:
+        with self._lock:
+            self.batches += 1
+            self.batched_frames += size
+            self._queue_waits.extend(queue_waits)
+
+    def add_request(self, latency: float, error: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            self._latencies.append((time.time(), latency))
+
+    def add_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self, queue_depth: int) -> Dict[str, Any]:
+        """統計情報を辞書で返す（レイテンシはミリ秒）"""
+        with self._lock:
+            now = time.time()
+            latencies = np.asarray([latency for _, latency in self._latencies], dtype=np.float64) * 1000
+            recent = sum(1 for finished, _ in self._latencies if finished >= now - 10.0)
+            waits = np.asarray(self._queue_waits, dtype=np.float64) * 1000
+            uptime = now - self.started
+            return {
+                'uptime_s': uptime,
+                'requests': self.requests,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'queue_depth': queue_depth,
+                'batches': self.batches,
+                'mean_batch_size': self.batched_frames / self.batches if self.batches else 0.0,
+                'requests_per_s': self.requests / uptime if uptime > 0 else 0.0,
+                'recent_requests_per_s': recent / min(10.0, uptime) if uptime > 0 else 0.0,
+                'latency_ms': {
+                    'mean': float(latencies.mean()) if len(latencies) else 0.0,
+                    'p50': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                    'p90': float(np.percentile(latencies, 90)) if len(latencies) else 0.0,
+                    'p99': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+                },
+                'queue_wait_ms': {
+                    'mean': float(waits.mean()) if len(waits) else 0.0,
+                    'p90': float(np.percentile(waits, 90)) if len(waits) else 0.0,
+                },
+            }
+
+
+class MicroBatcher:
+    """同時に届いたリクエストをまとめてワーカープールに投入する
+
+    リクエストは submit でキューに入り、バッチ化スレッドが最大 max_batch 件
+    （最初のリクエストから最大 max_wait_ms 待つ）ずつ LandmarkEngine.submit_batch に渡す。
+    ワーカーに投入済みのバッチが max_in_flight 件に達している間は次のバッチを作らないため、
+    負荷が高いほどキューにリクエストが溜まり、バッチが大きくなる。
+    """
+
+    def __init__(
+        self,
+        engine: LandmarkEngine,
+        metrics: ServerMetrics,
+        max_batch: int,
+        max_wait_ms: float,
+        max_queue: int,
+        max_in_flight: int
+    ):
+        self.engine = engine
+        self.metrics = metrics
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: 'queue.Queue[Tuple[np.ndarray, Future, float]]' = queue.Queue(maxsize=max_queue)
+        self._in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, img: np.ndarray) -> Optional[Future]:
+        """1フレームの検出を依頼する
+
+        Returns:
+            Future: (landmarks, is_detected, bounding_box) を返す。キューが満杯の場合は None
+        """
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((img, future, time.perf_counter()))
+        except queue.Full:
+            return None
+        return future
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future, float]]:
+        """キューから1バッチ分のリクエストを取り出す"""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._in_flight.acquire()
+            batch = self._collect()
+            if not batch:
+                self._in_flight.release()
+                continue
+            now = time.perf_counter()
+            self.metrics.add_batch(len(batch), [now - enqueued for _, _, enqueued in batch])
+            try:
+                task = self.engine.submit_batch([img for img, _, _ in batch])
+            except Exception as e:
+                self._in_flight.release()
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            task.add_done_callback(lambda task, batch=batch: self._resolve(task, batch))
+
+    def _resolve(self, task: Future, batch: List[Tuple[np.ndarray, Future, float]]) -> None:
+        """バッチの結果を各リクエストに返す"""
+        self._in_flight.release()
+        try:
+            outputs = task.result()
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), output in zip(batch, outputs):
+            future.set_result(output)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def decode_array(body: bytes, headers) -> np.ndarray:
+    """リクエストの本文を配列に変換する（.npy 形式、または X-Shape / X-Dtype 付きの生のバイト列）
+
+    Raises:
+        ValueError: 本文を配列として解釈できない場合
+    """
+    shape = headers.get('X-Shape')
+    if shape:
+        dims = tuple(int(dim) for dim in shape.split(','))
+        dtype = np.dtype(headers.get('X-Dtype', 'uint8'))
+        expected = int(np.prod(dims)) * dtype.itemsize
+        if len(body) != expected:
+            raise ValueError(f"本文のサイズ {len(body)} が X-Shape / X-Dtype から求めたサイズ {expected} と一致しません")
+        return np.frombuffer(body, dtype=dtype).reshape(dims)
+    return np.load(io.BytesIO(body), allow_pickle=False)
+
+
+class LandmarkRequestHandler(BaseHTTPRequestHandler):
+    """検出リクエストのハンドラー（server.batcher / server.metrics を使用）"""
+
+    protocol_version = 'HTTP/1.1'  # 接続を使い回す（負荷生成時の接続コストを除くため）
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == '/metrics':
+            self._send_json(200, self.server.metrics.snapshot(self.server.batcher.queue_depth))
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"不明なパスです: {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path != '/detect':
+            self._send_json(404, {'error': f"不明なパスです: {self.path}"})
+            return
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            img = decode_array(body, self.headers)
+        except Exception as e:
+            self.server.metrics.add_request(time.perf_counter() - start, error=True)
+            self._send_json(400, {'error': f"配列の読み込みに失敗しました: {str(e)}"})
+            return
+
+        future = self.server.batcher.submit(img)
+        if future is None:
+            self.server.metrics.add_rejected()
+            self._send_json(503, {'error': "リクエストのキューが満杯です"})
+            return
+        try:
+            landmarks, is_detected, bounding_box = future.result()
+        except Exception as e:
+            self.server.metrics.add_request(time.perf_counter() - start, error=True)
+            self._send_json(500, {'error': f"検出エラー: {str(e)}"})
+            return
+        latency = time.perf_counter() - start
+        self.server.metrics.add_request(latency)
+        self._send_json(200, {
+            'landmarks': np.asarray(landmarks).tolist(),
+            'is_detected': bool(is_detected),
+            'bounding_box': [int(v) for v in bounding_box] if bounding_box is not None else None,
+            'latency_ms': latency * 1000,
+        })
+
+    def log_message(self, format: str, *args) -> None:
+        # リクエストごとのアクセスログは出力しない（統計は /metrics で確認する）
+        pass
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+        """Unix ソケットで待ち受ける HTTP サーバー"""
+
+        daemon_threads = True
+
+        def get_request(self):
+            request, _ = super().get_request()
+            # BaseHTTPRequestHandler はクライアントのアドレスを (host, port) として扱う
+            return request, ('unix', 0)
+else:
+    UnixHTTPServer = None  # Windows では Unix ソケットを使用できない
+
+
+def create_server(
+    config: Config,
+    engine: LandmarkEngine,
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    unix_socket: Optional[str] = None
+) -> socketserver.BaseServer:
+    """検出サーバーを作成する（serve_forever は呼び出し側で行う）
+
+    Args:
+        config: 設定オブジェクト（SERVER の設定を使用）
+        engine: 検出に使うエンジン
+        host: 待ち受けるホスト（未指定時は config.SERVER['host']）
+        port: 待ち受けるポート（未指定時は config.SERVER['port']。0 の場合は空きポート）
+        unix_socket: Unix ソケットのパス（指定時は TCP の代わりに使用）
+
+    Returns:
+        サーバー（server.batcher / server.metrics を持つ）
+    """
+    settings = config.SERVER
+    if unix_socket:
+        if UnixHTTPServer is None:
+            raise RuntimeError("この環境では Unix ソケットを使用できません")
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, LandmarkRequestHandler)
+    else:
+        server = ThreadingHTTPServer(
+            (host or settings['host'], settings['port'] if port is None else port), LandmarkRequestHandler
+        )
+    server.metrics = ServerMetrics()
+    server.batcher = MicroBatcher(
+        engine, server.metrics,
+        max_batch=settings['max_batch'],
+        max_wait_ms=settings['max_wait_ms'],
+        max_queue=settings['max_queue'],
+        max_in_flight=engine.max_workers * 2
+    )
+    return server
+
+
+def warm_up(engine: LandmarkEngine) -> None:
+    """全ワーカーを起動してモデルをロードしておく（最初のリクエストの遅延を避ける）"""
+    futures = [engine.submit_batch([]) for _ in range(engine.max_workers)]
+    for future in futures:
+        future.result()
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description='ランドマーク検出サーバー（モデル常駐・マイクロバッチ）')
+    parser.add_argument('--host', help='待ち受けるホスト（デフォルト: Config.SERVER）')
+    parser.add_argument('--port', type=int, help='待ち受けるポート（デフォルト: Config.SERVER）')
+    parser.add_argument('--unix-socket', help='Unix ソケットのパス（指定時は TCP の代わりに使用）')
+    parser.add_argument('--workers', type=int, help='ワーカー数（デフォルト: CPUコア数）')
+    parser.add_argument('--executor', choices=['process', 'thread'], default='process',
+                        help='ワーカープールの種類')
+    parser.add_argument('--mode', choices=['normal', 'high'], default='normal', help='検出モード')
+    parser.add_argument('--max-batch', type=int, help='1タスクにまとめる最大リクエスト数')
+    parser.add_argument('--max-wait-ms', type=float, help='バッチを作るまでに待つ最大時間(ms)')
+    args = parser.parse_args()
+
+    config = Config()
+    config.DETECTION_MODE = args.mode
+    if args.max_batch is not None or args.max_wait_ms is not None:
+        config.SERVER = {**Config.SERVER}
+        if args.max_batch is not None:
+            config.SERVER['max_batch'] = args.max_batch
+        if args.max_wait_ms is not None:
+            config.SERVER['max_wait_ms'] = args.max_wait_ms
+
+    engine = LandmarkEngine(config, max_workers=args.workers, executor=args.executor)
+    start = time.perf_counter()
+    warm_up(engine)
+    print(f"🧠 ワーカー {engine.max_workers} 個の準備が完了しました（{time.perf_counter() - start:.2f}秒）")
+
+    server = create_server(config, engine, args.host, args.port, args.unix_socket)
+    if args.unix_socket:
+        print(f"🚀 ランドマーク検出サーバーを起動しました: unix:{args.unix_socket}")
+    else:
+        host, port = server.server_address[:2]
+        print(f"🚀 ランドマーク検出サーバーを起動しました: http://{host}:{port}")
+    print(f"   • マイクロバッチ: 最大 {config.SERVER['max_batch']} 件 / 最大待ち {config.SERVER['max_wait_ms']} ms")
+    print(f"   • 統計: GET /metrics（Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        engine.close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        print(f"\n📊 統計: {json.dumps(server.metrics.snapshot(0), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
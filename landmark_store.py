@@ -0,0 +1,222 @@
+"""ディレクトリ単位のランドマークストアモジュール
+
+ディレクトリ内の全フレームのランドマークを、1つの (N, 68, 2) のメモリマップ配列と
+並列配列（検出フラグ、最適アップサンプリング回数、バウンディングボックス）および
+ファイル名インデックスにまとめて保存する。ワーカーは自分の行だけをその場で書き込み、
+読み込み側はコピーせずにメモリマップとして開く。
+
+ストアの構成:
+    landmarks.npy       (N, 68, 2) int32
+    is_detected.npy     (N,) bool
+    best_upsample.npy   (N,) int8   （検出失敗時は -1）
+    bounding_boxes.npy  (N, 4) int32 （x, y, width, height。無い場合は -1）
+    filenames.txt       ファイル名（1行1フレーム、行番号がインデックス）
+"""
+
+import os
+from multiprocessing import util
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+NUM_LANDMARKS = 68
+STORE_DIRNAME = 'landmark_store'
+
+# ワーカープロセス内で開いたストアのキャッシュ
+_writers: Dict[str, 'LandmarkStore'] = {}
+
+# ワーカーが書き込んだ行をディスクに反映する間隔（フレーム数）。
+# フレームごとの msync は NFS などでは遅いため、まとめて反映し、残りはワーカーの終了時に反映する
+WRITER_FLUSH_INTERVAL = 256
+
+
+class LandmarkStore:
+    """メモリマップによるランドマークストア"""
+
+    def __init__(
+        self,
+        store_dir: str,
+        landmarks: np.ndarray,
+        is_detected: np.ndarray,
+        best_upsample: np.ndarray,
+        bounding_boxes: np.ndarray,
+        filenames: List[str]
+    ):
+        self.store_dir = store_dir
+        self.landmarks = landmarks
+        self.is_detected = is_detected
+        self.best_upsample = best_upsample
+        self.bounding_boxes = bounding_boxes
+        self.filenames = filenames
+        self.flush_interval = 0  # write() の回数がこの値に達するごとに flush する（0: 自動では反映しない）
+        self._index: Optional[Dict[str, int]] = None
+        self._unflushed = 0
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    @classmethod
+    def create(cls, store_dir: str, filenames: List[str], carry_over: bool = False) -> 'LandmarkStore':
+        """ストアを事前確保して作成する（既存のストアは上書き）
+
+        Args:
+            store_dir: ストアの保存先ディレクトリ
+            filenames: フレームのファイル名（この順序がインデックスになる）
+            carry_over: Trueの場合、既存のストアに含まれるフレームの行を新しいストアに引き継ぐ
+                （再実行時に処理をスキップしたフレームの結果を保持するため）
+
+        Returns:
+            LandmarkStore: 書き込み可能なストア
+        """
+        previous = None
+        if carry_over and os.path.exists(os.path.join(store_dir, 'filenames.txt')):
+            try:
+                old = cls.open(store_dir, mode='r')
+                # 上書き前にメモリへ読み込み、メモリマップを閉じる
+                previous = (
+                    {name: i for i, name in enumerate(old.filenames)},
+                    np.array(old.landmarks), np.array(old.is_detected),
+                    np.array(old.best_upsample), np.array(old.bounding_boxes)
+                )
+                del old
+            except (OSError, ValueError):
+                previous = None
+
+        os.makedirs(store_dir, exist_ok=True)
+        n = len(filenames)
+        landmarks = np.lib.format.open_memmap(
+            os.path.join(store_dir, 'landmarks.npy'), mode='w+',
+            dtype=np.int32, shape=(n, NUM_LANDMARKS, 2)
+        )
+        is_detected = np.lib.format.open_memmap(
+            os.path.join(store_dir, 'is_detected.npy'), mode='w+', dtype=np.bool_, shape=(n,)
+        )
+        best_upsample = np.lib.format.open_memmap(
+            os.path.join(store_dir, 'best_upsample.npy'), mode='w+', dtype=np.int8, shape=(n,)
+        )
+        bounding_boxes = np.lib.format.open_memmap(
+            os.path.join(store_dir, 'bounding_boxes.npy'), mode='w+', dtype=np.int32, shape=(n, 4)
+        )
+        best_upsample[:] = -1
+        bounding_boxes[:] = -1
+        if previous is not None:
+            old_index, old_landmarks, old_detected, old_upsample, old_boxes = previous
+            for i, filename in enumerate(filenames):
+                j = old_index.get(filename)
+                if j is not None:
+                    landmarks[i] = old_landmarks[j]
+                    is_detected[i] = old_detected[j]
+                    best_upsample[i] = old_upsample[j]
+                    bounding_boxes[i] = old_boxes[j]
+        with open(os.path.join(store_dir, 'filenames.txt'), 'w', encoding='utf-8') as f:
+            for filename in filenames:
+                f.write(f"{filename}\n")
+        store = cls(store_dir, landmarks, is_detected, best_upsample, bounding_boxes, list(filenames))
+        store.flush()
+        return store
+
+    @classmethod
+    def open(cls, store_dir: str, mode: str = 'r') -> 'LandmarkStore':
+        """既存のストアを開く
+
+        Args:
+            store_dir: ストアのディレクトリ
+            mode: 'r'（読み込み専用、ゼロコピー）または 'r+'（書き込み可能）
+
+        Returns:
+            LandmarkStore: ストア
+        """
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(store_dir, name), mmap_mode=mode)
+
+        with open(os.path.join(store_dir, 'filenames.txt'), 'r', encoding='utf-8') as f:
+            filenames = [line.rstrip('\n') for line in f]
+        return cls(
+            store_dir,
+            load('landmarks.npy'),
+            load('is_detected.npy'),
+            load('best_upsample.npy'),
+            load('bounding_boxes.npy'),
+            filenames
+        )
+
+    def index_of(self, filename: str) -> int:
+        """ファイル名からインデックスを返す
+
+        Raises:
+            KeyError: ストアに含まれないファイル名の場合
+        """
+        if self._index is None:
+            self._index = {name: i for i, name in enumerate(self.filenames)}
+        return self._index[filename]
+
+    def write(
+        self,
+        index: int,
+        landmarks: np.ndarray,
+        is_detected: bool,
+        best_upsample: Optional[int] = None,
+        bounding_box: Optional[Tuple[int, int, int, int]] = None
+    ) -> None:
+        """1フレーム分の結果をその場で書き込む
+
+        Args:
+            index: フレームのインデックス
+            landmarks: ランドマーク (68, 2)
+            is_detected: 検出成功フラグ
+            best_upsample: 最適なアップサンプリング回数
+            bounding_box: バウンディングボックス (x, y, width, height)
+        """
+        self.landmarks[index] = landmarks
+        self.is_detected[index] = is_detected
+        self.best_upsample[index] = -1 if best_upsample is None else best_upsample
+        self.bounding_boxes[index] = -1 if bounding_box is None else bounding_box
+        if self.flush_interval:
+            self._unflushed += 1
+            if self._unflushed >= self.flush_interval:
+                self.flush()
+
+    def flush(self) -> None:
+        """変更をディスクに反映する"""
+        self._unflushed = 0
+        for array in (self.landmarks, self.is_detected, self.best_upsample, self.bounding_boxes):
+            if isinstance(array, np.memmap) and array.mode != 'r':
+                array.flush()
+
+
+def get_store_dir(orignorm_dir: str) -> str:
+    """出力ディレクトリに対応するストアのディレクトリを返す"""
+    return os.path.join(os.path.dirname(orignorm_dir), STORE_DIRNAME)
+
+
+def get_writer(store_dir: str) -> LandmarkStore:
+    """ワーカープロセス内で書き込み用に開いたストアを返す（プロセスごとにキャッシュ）
+
+    書き込んだ行は WRITER_FLUSH_INTERVAL フレームごと、およびワーカーの終了時にディスクに反映する。
+    """
+    store = _writers.get(store_dir)
+    if store is None:
+        if not _writers:
+            util.Finalize(None, flush_writers, exitpriority=20)
+        store = LandmarkStore.open(store_dir, mode='r+')
+        store.flush_interval = WRITER_FLUSH_INTERVAL
+        _writers[store_dir] = store
+    return store
+
+
+def flush_writers() -> None:
+    """ワーカープロセス内で開いたすべてのストアの変更をディスクに反映する"""
+    for store in _writers.values():
+        store.flush()
+
+
+def open_store(store_dir: str) -> LandmarkStore:
+    """ストアを読み込み専用で開く（ゼロコピー）
+
+    Args:
+        store_dir: ストアのディレクトリ（processed_data/<ディレクトリ名>/landmark_store）
+
+    Returns:
+        LandmarkStore: 各配列が読み込み専用のメモリマップになったストア
+    """
+    return LandmarkStore.open(store_dir, mode='r')
@@ -1,10 +1,119 @@
 """NIR画像の顔ランドマーク検出メインスクリプト"""
 
-import os
 import argparse
 import tkinter as tk
 from gui import FolderListCreator
-from directory_processor import process_directory
+from config import Config
+from run_scheduler import process_directories
+from streaming import process_directories_streaming
+from cluster import run_cluster_worker
+
+
+def detection_scale(value: str) -> float:
+    """--detection-scale の値を検証する（0 より大きく 1 以下）"""
+    scale = float(value)
+    if not 0 < scale <= 1.0:
+        raise argparse.ArgumentTypeError(f"0 より大きく 1 以下で指定してください: {value}")
+    return scale
+
+
+def frame_level(value: str) -> int:
+    """--frame-level の値を検証する（0-9）"""
+    level = int(value)
+    if not 0 <= level <= 9:
+        raise argparse.ArgumentTypeError(f"0 から 9 の整数で指定してください: {value}")
+    return level
+
+
+def positive_int(value: str) -> int:
+    """1 以上の整数を受け付ける引数の値を検証する"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"1 以上の整数で指定してください: {value}")
+    return number
+
+
+def check_frame_level(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """--frame-level が保存形式で使える値かを処理の開始前に検証する
+
+    .npz の bzip2 は圧縮レベル 0 を受け付けないため、ワーカーの書き込みで
+    全フレームの保存に失敗しないよう、ここでエラーにする。
+    """
+    fmt = args.frame_format or Config.FRAME_STORAGE['format']
+    codec = args.frame_codec or Config.FRAME_STORAGE['codec']
+    level = args.frame_level if args.frame_level is not None else Config.FRAME_STORAGE['level']
+    if fmt == 'npz' and codec == 'bzip2' and level < 1:
+        parser.error(f"--frame-codec bzip2 の --frame-level は 1-9 で指定してください: {level}")
+
+
+def build_config(args: argparse.Namespace) -> Config:
+    """コマンドライン引数から設定オブジェクトを作成する"""
+    config = Config()
+    if args.detection_scale is not None:
+        config.DETECTION_SCALE = args.detection_scale
+    if (args.landmarks_only or args.no_orignorm or args.no_processed or args.no_landmarks
+            or args.no_comparison or args.landmark_store):
+        config.OUTPUTS = dict(Config.OUTPUTS)
+        if args.landmarks_only:
+            config.OUTPUTS.update({'orignorm': False, 'processed': False, 'comparison': False})
+        if args.no_orignorm:
+            config.OUTPUTS['orignorm'] = False
+        if args.no_processed:
+            config.OUTPUTS['processed'] = False
+        if args.no_landmarks:
+            config.OUTPUTS['landmarks'] = False
+        if args.no_comparison:
+            config.OUTPUTS['comparison'] = False
+        if args.landmark_store:
+            config.OUTPUTS['landmark_store'] = True
+    if args.comparison_every is not None or args.comparison_failures_only:
+        config.COMPARISON_SAMPLING = dict(Config.COMPARISON_SAMPLING)
+        if args.comparison_every is not None:
+            config.COMPARISON_SAMPLING['every_n'] = args.comparison_every
+        if args.comparison_failures_only:
+            config.COMPARISON_SAMPLING['failures_only'] = True
+    if args.render_backend or args.image_format or args.compression is not None:
+        config.RENDERING = dict(Config.RENDERING)
+        if args.render_backend:
+            config.RENDERING['backend'] = args.render_backend
+        if args.image_format:
+            config.RENDERING['format'] = args.image_format
+        if args.compression is not None:
+            key = 'jpeg_quality' if config.RENDERING['format'] == 'jpg' else 'png_compression'
+            config.RENDERING[key] = args.compression
+    if args.resume or args.resume_hash:
+        config.RESUME = {'enabled': True, 'content_hash': args.resume_hash}
+    if args.profile:
+        config.PROFILE = {'enabled': True, 'cprofile': args.profile == 'cprofile'}
+    if args.fallback:
+        config.FALLBACK = {**Config.FALLBACK, 'mode': args.fallback}
+    if args.detection_cache:
+        config.DETECTION_CACHE = {**Config.DETECTION_CACHE, 'enabled': True}
+        if args.detection_cache is not True:
+            config.DETECTION_CACHE['path'] = args.detection_cache
+    if args.sync_writes:
+        config.WRITER = {**Config.WRITER, 'enabled': False}
+    if args.frame_format or args.frame_codec or args.frame_level is not None:
+        config.FRAME_STORAGE = {**Config.FRAME_STORAGE}
+        if args.frame_format:
+            config.FRAME_STORAGE['format'] = args.frame_format
+        if args.frame_codec:
+            config.FRAME_STORAGE['codec'] = args.frame_codec
+        if args.frame_level is not None:
+            config.FRAME_STORAGE['level'] = args.frame_level
+    if args.workers is not None or args.max_memory is not None:
+        config.WORKERS = {**Config.WORKERS}
+        if args.workers is not None:
+            config.WORKERS['max_workers'] = args.workers
+        if args.max_memory is not None:
+            config.WORKERS['max_memory_mb'] = args.max_memory
+    if args.stack_mode:
+        config.STACK_INPUT = {**Config.STACK_INPUT, 'mode': args.stack_mode}
+    if args.track:
+        config.TRACKING = {**Config.TRACKING, 'enabled': True}
+        if args.track_chunk is not None:
+            config.TRACKING['chunk_size'] = args.track_chunk
+    return config
 
 
 def main():
@@ -21,9 +130,160 @@ def main():
     )
     parser.add_argument(
         '--mode',
-        choices=['normal', 'high'],
+        choices=['normal', 'high', 'cascade'],
         default='normal',
-        help='検出モード: normal (0回) または high (0, 1, 2回)'
+        help='検出モード: normal (0回)、high (0, 1, 2回) または cascade (0回で失敗したフレームのみ1, 2回)'
+    )
+    parser.add_argument(
+        '--detection-scale',
+        type=detection_scale,
+        help='顔検出を行う画像の縮小率（例: 0.5）。ランドマーク予測はフル解像度で行う'
+    )
+    parser.add_argument(
+        '--landmarks-only',
+        action='store_true',
+        help='ランドマークのみ保存（orignorm・processed・比較画像を計算・保存しない）'
+    )
+    parser.add_argument(
+        '--no-orignorm',
+        action='store_true',
+        help='正規化済みオリジナル画像 (_orignorm) を保存しない'
+    )
+    parser.add_argument(
+        '--no-processed',
+        action='store_true',
+        help='前処理済み画像 (_processed) を保存しない'
+    )
+    parser.add_argument(
+        '--no-landmarks',
+        action='store_true',
+        help='フレームごとのランドマーク (_landmarks.npy) を保存しない（--landmark-store と併用）'
+    )
+    parser.add_argument(
+        '--no-comparison',
+        action='store_true',
+        help='比較画像を保存しない'
+    )
+    parser.add_argument(
+        '--landmark-store',
+        action='store_true',
+        help='ディレクトリ内の全ランドマークを1つのメモリマップ配列 (landmark_store/) にまとめて保存'
+    )
+    parser.add_argument(
+        '--comparison-every',
+        type=int,
+        help='比較画像をNフレームごとに1枚だけ保存（検出失敗フレームは常に保存）'
+    )
+    parser.add_argument(
+        '--comparison-failures-only',
+        action='store_true',
+        help='検出失敗フレームの比較画像のみ保存'
+    )
+    parser.add_argument(
+        '--render-backend',
+        choices=['opencv', 'matplotlib'],
+        help='比較画像の描画バックエンド: opencv (高速) または matplotlib (論文用)'
+    )
+    parser.add_argument(
+        '--image-format',
+        choices=['png', 'jpg'],
+        help='比較画像の保存形式（opencvバックエンドのみ）'
+    )
+    parser.add_argument(
+        '--compression',
+        type=int,
+        help='比較画像の圧縮設定: PNGは圧縮レベル (0-9)、JPEGは品質 (0-100)'
+    )
+    parser.add_argument(
+        '--track',
+        action='store_true',
+        help='トラッキングモード: 連番フレームをファイル名順に処理し、前フレームの顔位置周辺のみで検出'
+    )
+    parser.add_argument(
+        '--track-chunk',
+        type=int,
+        help='トラッキングモードで1ワーカーが連続処理するフレーム数（デフォルト: Config.TRACKINGの値）'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='再実行モード: 前回から新規・変更・エラーのフレームのみ処理し、サマリーはマニフェストから再構築'
+    )
+    parser.add_argument(
+        '--resume-hash',
+        action='store_true',
+        help='再実行モードで入力ファイルの変更をサイズ・更新日時に加えて内容のハッシュで検知'
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='timers',
+        choices=['timers', 'cprofile'],
+        help='段階別の処理時間を profile.json / profile_*.csv に出力（cprofile 指定時はワーカーごとの cProfile も出力）'
+    )
+    parser.add_argument(
+        '--fallback',
+        choices=['nearest', 'previous', 'interpolate'],
+        help='検出失敗フレームの補完方法: nearest (前後で近い成功フレーム)、previous (直前) または interpolate (線形補間)'
+    )
+    parser.add_argument(
+        '--detection-cache',
+        nargs='?',
+        const=True,
+        metavar='PATH',
+        help='検出キャッシュを使用（PATH 省略時は Config.DETECTION_CACHE のパス）。同じフレームの顔検出結果を再利用'
+    )
+    parser.add_argument(
+        '--sync-writes',
+        action='store_true',
+        help='成果物をワーカーがその場で書き込む（バックグラウンドの書き込みスレッドを使わない）'
+    )
+    parser.add_argument(
+        '--frame-format',
+        choices=['npy', 'png', 'npz'],
+        help='orignorm・processed の保存形式（npy: 非圧縮、png: 可逆圧縮、npz: 圧縮した .npy）'
+    )
+    parser.add_argument(
+        '--frame-codec',
+        choices=['deflate', 'bzip2', 'lzma'],
+        help='--frame-format npz の圧縮方式'
+    )
+    parser.add_argument(
+        '--frame-level',
+        type=frame_level,
+        metavar='{0-9}',
+        help='orignorm・processed の圧縮レベル（png・deflate: 0-9、bzip2: 1-9、lzma では無視）'
+    )
+    parser.add_argument(
+        '--workers',
+        type=positive_int,
+        help='ワーカー数を固定（未指定時はメモリとCPUコア数から決め、処理速度を見ながら同時実行数を調整）'
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=int,
+        metavar='MB',
+        help='ワーカーに使うメモリの上限(MB)（未指定時は空きメモリの70%%）'
+    )
+    parser.add_argument(
+        '--stack-mode',
+        choices=['auto', 'always', 'never'],
+        help='複数フレームを積み重ねた入力 (T, H, W) の判定: auto、always (3次元以上はスタック) または never'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='ストリーミングモード: ファイルを逐次列挙し、投入数を制限して結果を順に処理（巨大ディレクトリ向け）'
+    )
+    parser.add_argument(
+        '--max-in-flight',
+        type=positive_int,
+        help='ストリーミングモードで同時に投入しておくタスクの最大数（デフォルト: ワーカー数 × 4）'
+    )
+    parser.add_argument(
+        '--worker',
+        action='store_true',
+        help='クラスタのワーカーノードとして実行（--list と同じ場所の作業キューを複数ノードで共有）'
     )
     parser.add_argument(
         '--create-list',
@@ -31,6 +291,7 @@ def main():
         help='フォルダリスト作成ツールを起動し、処理を開始'
     )
     args = parser.parse_args()
+    check_frame_level(parser, args)
     
     # フォルダリスト作成モード
     if args.create_list:
@@ -57,14 +318,16 @@ def main():
         # デフォルトでカレントディレクトリを使用
         input_dirs = ['.']
     
-    # 各ディレクトリを順番に処理
-    for input_dir in input_dirs:
-        if not os.path.isdir(input_dir):
-            print(f"警告: {input_dir} は有効なディレクトリではありません。スキップします。")
-            continue
-        print(f"\n=== ディレクトリ {input_dir} の処理を開始します ===")
-        process_directory(input_dir, args.mode)
-        print(f"=== ディレクトリ {input_dir} の処理が完了しました ===\n")
+    # 全ディレクトリを1つのワーカープールで処理
+    if args.worker:
+        if not args.list:
+            print("エラー: --worker には作業キューの場所を決める --list の指定が必要です。")
+            exit(1)
+        run_cluster_worker(args.list, input_dirs, args.mode, build_config(args))
+    elif args.stream:
+        process_directories_streaming(input_dirs, args.mode, build_config(args), args.max_in_flight)
+    else:
+        process_directories(input_dirs, args.mode, build_config(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,298 @@
+"""処理マニフェストモジュール
+
+ディレクトリごとに、入力ファイルのサイズ・更新日時（オプションで内容のハッシュ）、
+設定のフィンガープリント、処理結果を記録する。再実行時には新規・変更・エラーの
+フレームだけを処理し、サマリーはマニフェストから再構築する。
+
+処理結果には調整前の検出矩形も記録し、BOUNDING_BOX_SCALE_X/Y だけを変えて
+ランドマークを予測し直す場合（box_scale_sweep.py）は顔検出を省略できる。
+
+出力の設定（OUTPUTS、保存形式、比較画像の描画）は検出結果のフィンガープリントに含めず、
+成果物ごとのフィンガープリント（artifact_fingerprints）として記録する。再実行時に
+出力の設定だけが変わったフレームは、顔検出をやり直さずに成果物だけを作り直す。
+
+処理中の結果は manifest.journal に1行ずつ追記し（中断されても失われない）、
+ディレクトリの処理完了時に manifest.json にまとめて書き出す。
+"""
+
+import os
+import json
+import hashlib
+from typing import Any, Dict, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from config import Config
+
+MANIFEST_FILENAME = 'manifest.json'
+JOURNAL_FILENAME = 'manifest.journal'
+
+# 検出結果（ランドマーク）に影響する設定項目
+_FINGERPRINT_FIELDS = (
+    'LEARNED_MODEL_PATH',
+    'DETECTION_MODE',
+    'DETECTION_SCALE',
+    'TRACKING',
+    'IMAGE_PROCESSING',
+    'FALLBACK',
+    'BOUNDING_BOX_SCALE_X',
+    'BOUNDING_BOX_SCALE_Y',
+)
+
+# 成果物（OUTPUTS のキー）ごとに、内容に影響する出力の設定項目
+_ARTIFACT_FIELDS = {
+    'orignorm': ('FRAME_STORAGE',),
+    'processed': ('FRAME_STORAGE',),
+    'landmarks': (),
+    'comparison': ('RENDERING', 'COMPARISON_SAMPLING'),
+    'landmark_store': (),
+}
+
+
+# 検出矩形に影響する設定項目
+_RECT_FINGERPRINT_FIELDS = (
+    'DETECTION_MODE',
+    'DETECTION_SCALE',
+    'TRACKING',
+    'IMAGE_PROCESSING',
+)
+
+
+def _fingerprint(values: Dict[str, Any]) -> str:
+    """設定項目の値のフィンガープリント（16進文字列）を返す"""
+    encoded = json.dumps(values, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def config_fingerprint(config: 'Config') -> str:
+    """検出結果に影響する設定項目のフィンガープリントを返す
+
+    出力の設定は含まない（成果物ごとに artifact_fingerprints で管理する）。
+
+    Args:
+        config: 設定オブジェクト
+
+    Returns:
+        フィンガープリント（16進文字列）
+    """
+    values: Dict[str, Any] = {
+        field: getattr(config, field) for field in _FINGERPRINT_FIELDS
+    }
+    values['TEMPLATE_LANDMARKS'] = config.TEMPLATE_LANDMARKS.tolist()
+    return _fingerprint(values)
+
+
+def artifact_fingerprints(config: 'Config') -> Dict[str, str]:
+    """OUTPUTS で有効な成果物ごとに、内容に影響する出力の設定のフィンガープリントを返す
+
+    Args:
+        config: 設定オブジェクト
+
+    Returns:
+        成果物の種類（OUTPUTS のキー）をキーとしたフィンガープリント
+    """
+    return {
+        kind: _fingerprint({field: getattr(config, field) for field in fields})
+        for kind, fields in _ARTIFACT_FIELDS.items() if config.OUTPUTS.get(kind)
+    }
+
+
+def rect_fingerprint(config: 'Config') -> str:
+    """検出矩形に影響する設定項目のフィンガープリントを返す
+
+    BOUNDING_BOX_SCALE_X/Y や出力の設定を含まないため、これらだけを変えた場合は
+    記録した検出矩形をそのまま使える。
+
+    Args:
+        config: 設定オブジェクト
+
+    Returns:
+        フィンガープリント（16進文字列）
+    """
+    return _fingerprint({field: getattr(config, field) for field in _RECT_FINGERPRINT_FIELDS})
+
+
+def file_signature(path: str, content_hash: bool = False) -> Dict[str, Any]:
+    """入力ファイルの変更検知用の情報を返す
+
+    Args:
+        path: ファイルパス
+        content_hash: Trueの場合は内容のハッシュも計算する
+
+    Returns:
+        size, mtime_ns（と hash）を含む辞書
+    """
+    stat = os.stat(path)
+    signature: Dict[str, Any] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if content_hash:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        signature['hash'] = digest.hexdigest()
+    return signature
+
+
+class Manifest:
+    """ディレクトリ単位の処理マニフェスト"""
+
+    def __init__(self, output_dir: str, fingerprint: str, rect_fingerprint: Optional[str] = None):
+        """
+        Args:
+            output_dir: ディレクトリの出力先（processed_data/<ディレクトリ名>）
+            fingerprint: 現在の設定のフィンガープリント
+            rect_fingerprint: 現在の設定の検出矩形のフィンガープリント（rect_fingerprint）
+        """
+        self.output_dir = output_dir
+        self.fingerprint = fingerprint
+        self.rect_fingerprint = rect_fingerprint
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.journal_path = os.path.join(output_dir, JOURNAL_FILENAME)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._journal = None
+
+    @classmethod
+    def load(cls, output_dir: str, fingerprint: str, rect_fingerprint: Optional[str] = None) -> 'Manifest':
+        """既存のマニフェストとジャーナルを読み込む
+
+        Args:
+            output_dir: ディレクトリの出力先
+            fingerprint: 現在の設定のフィンガープリント
+            rect_fingerprint: 現在の設定の検出矩形のフィンガープリント
+
+        Returns:
+            Manifest: マニフェスト（存在しない場合は空）
+        """
+        manifest = cls(output_dir, fingerprint, rect_fingerprint)
+        if os.path.exists(manifest.path):
+            try:
+                with open(manifest.path, 'r', encoding='utf-8') as f:
+                    manifest.entries = json.load(f).get('entries', {})
+            except (OSError, ValueError):
+                manifest.entries = {}
+        if os.path.exists(manifest.journal_path):
+            with open(manifest.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 中断時に途中まで書かれた行は無視する
+                        continue
+                    manifest.entries[record.pop('file')] = record
+        return manifest
+
+    def get_valid_entry(self, filename: str, signature: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """検出結果を再利用できる記録を返す
+
+        現在の設定で処理済みで、入力ファイルが変更されておらず、
+        処理エラーでなかった場合のみ記録を返す。成果物が現在の出力の設定で
+        作られているかどうかは has_artifacts で判定する。
+
+        Args:
+            filename: ファイル名
+            signature: 現在の入力ファイルの情報（file_signature の戻り値）
+
+        Returns:
+            再利用できる記録。再処理が必要な場合は None
+        """
+        entry = self.entries.get(filename)
+        if entry is None or entry.get('fingerprint') != self.fingerprint:
+            return None
+        if entry.get('status') == 'error':
+            return None
+        for key, value in signature.items():
+            if entry.get(key) != value:
+                return None
+        return entry
+
+    def has_artifacts(self, entry: Dict[str, Any], artifacts: Dict[str, str]) -> bool:
+        """記録の成果物が現在の出力の設定ですべて作られているかどうかを返す
+
+        Args:
+            entry: get_valid_entry が返した記録
+            artifacts: 現在の設定の成果物ごとのフィンガープリント（artifact_fingerprints）
+
+        Returns:
+            有効な成果物がすべて同じ設定で作られている場合True（無効な成果物は問わない）
+        """
+        recorded = entry.get('artifacts') or {}
+        return all(recorded.get(kind) == fingerprint for kind, fingerprint in artifacts.items())
+
+    def get_face_rect(
+        self,
+        filename: str,
+        signature: Dict[str, Any],
+        rect_fingerprint: str
+    ) -> Tuple[bool, Optional[Tuple[int, int, int, int]]]:
+        """記録された検出矩形を返す
+
+        検出矩形に影響する設定が同じで、入力ファイルが変更されておらず、
+        処理エラーでなかった場合のみ使える。
+
+        Args:
+            filename: ファイル名
+            signature: 現在の入力ファイルの情報（file_signature の戻り値）
+            rect_fingerprint: 現在の設定の検出矩形のフィンガープリント
+
+        Returns:
+            (記録を使えるかどうか, 検出矩形 (x, y, width, height)。顔が検出されなかった場合は None)
+        """
+        entry = self.entries.get(filename)
+        if entry is None or entry.get('rect_fingerprint') != rect_fingerprint:
+            return False, None
+        if entry.get('status') == 'error' or 'face_rect' not in entry:
+            return False, None
+        for key, value in signature.items():
+            if entry.get(key) != value:
+                return False, None
+        face_rect = entry['face_rect']
+        return True, tuple(face_rect) if face_rect is not None else None
+
+    def record(
+        self,
+        filename: str,
+        signature: Dict[str, Any],
+        status: str,
+        best_upsample: Optional[int] = None,
+        message: str = '',
+        face_rect: Optional[Tuple[int, int, int, int]] = None,
+        artifacts: Optional[Dict[str, str]] = None
+    ) -> None:
+        """処理結果を記録し、ジャーナルに追記する
+
+        Args:
+            filename: ファイル名
+            signature: 入力ファイルの情報
+            status: 'detected'、'not_detected' または 'error'
+            best_upsample: 最適なアップサンプリング回数
+            message: 失敗時のメッセージ
+            face_rect: 調整前の検出矩形 (x, y, width, height)（BOUNDING_BOX_SCALE_X/Y を
+                変えてランドマーク予測だけをやり直す際に顔検出を省略するために記録する）
+            artifacts: 作成した成果物ごとのフィンガープリント（artifact_fingerprints。エラー時は None）
+        """
+        entry = dict(signature)
+        entry.update({
+            'fingerprint': self.fingerprint,
+            'status': status,
+            'best_upsample': best_upsample,
+            'message': message,
+            'face_rect': [int(v) for v in face_rect] if face_rect is not None else None,
+            'rect_fingerprint': self.rect_fingerprint,
+            'artifacts': artifacts or {},
+        })
+        self.entries[filename] = entry
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(json.dumps({'file': filename, **entry}, ensure_ascii=False) + '\n')
+        self._journal.flush()
+
+    def save(self) -> None:
+        """マニフェストを書き出し、ジャーナルを削除する"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': self.fingerprint, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
@@ -0,0 +1,107 @@
+"""ワーカー常駐モデル管理モジュール
+
+ProcessPoolExecutor の initializer から呼び出し、shape_predictor と顔検出器を
+プロセスごとに1回だけロードして、そのプロセスで実行される全タスクで再利用する。
+"""
+
+import os
+import sys
+import time
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
+
+import dlib
+
+from data_types import WorkerStats
+import frame_ring
+import output_writer
+
+if TYPE_CHECKING:
+    import multiprocessing
+
+try:
+    import psutil  # オプション依存（メモリ計測用）
+except ImportError:
+    psutil = None
+
+try:
+    import resource  # Windowsには存在しない
+except ImportError:
+    resource = None
+
+
+_predictors: Dict[str, dlib.shape_predictor] = {}
+_detector: Optional[dlib.fhog_object_detector] = None
+_model_load_time: float = 0.0
+
+
+def get_memory_usage_mb() -> Optional[float]:
+    """現在のプロセスのメモリ使用量(MB)を返す
+
+    psutil があれば現在のRSS、無ければ resource のピークRSSを返す。
+    どちらも利用できない環境では None を返す。
+    """
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux は KB 単位、macOS は byte 単位
+        if sys.platform == 'darwin':
+            return max_rss / (1024 * 1024)
+        return max_rss / 1024
+    return None
+
+
+def get_predictor(model_path: str) -> dlib.shape_predictor:
+    """ロード済みの shape_predictor を返す（未ロードの場合はロードする）
+
+    Args:
+        model_path: 学習済みモデルのパス
+
+    Returns:
+        dlibのランドマーク予測器
+    """
+    global _model_load_time
+    predictor = _predictors.get(model_path)
+    if predictor is None:
+        start = time.perf_counter()
+        predictor = dlib.shape_predictor(model_path)
+        _model_load_time += time.perf_counter() - start
+        _predictors[model_path] = predictor
+    return predictor
+
+
+def get_detector() -> dlib.fhog_object_detector:
+    """ロード済みの顔検出器を返す（未ロードの場合は生成する）"""
+    global _detector, _model_load_time
+    if _detector is None:
+        start = time.perf_counter()
+        _detector = dlib.get_frontal_face_detector()
+        _model_load_time += time.perf_counter() - start
+    return _detector
+
+
+def init_worker(
+    model_path: str,
+    ring_spec: Optional[Tuple] = None,
+    ack_queue: Optional['multiprocessing.Queue'] = None
+) -> None:
+    """ProcessPoolExecutor の initializer
+
+    Args:
+        model_path: 学習済みモデルのパス
+        ring_spec: 共有メモリのフレームリングの接続情報（FrameRing.spec、未使用時は None）
+        ack_queue: 成果物の書き込みの完了通知のキュー（未指定時はタスクが書き込みの完了を待つ）
+    """
+    get_predictor(model_path)
+    get_detector()
+    frame_ring.init_worker_ring(ring_spec)
+    output_writer.init_worker_acks(ack_queue)
+
+
+def get_worker_stats() -> WorkerStats:
+    """このプロセスのモデルロード時間とメモリ使用量を返す"""
+    return WorkerStats(
+        pid=os.getpid(),
+        model_load_time=_model_load_time,
+        memory_mb=get_memory_usage_mb()
+    )
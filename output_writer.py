@@ -0,0 +1,313 @@
+"""成果物のバックグラウンド書き込みモジュール
+
+ワーカープロセスごとに書き込みスレッドを持ち、orignorm / processed / landmarks の .npy と
+エンコード済みの比較画像の書き込み（および orignorm / processed の圧縮）を検出処理から切り離す。NFS などの書き込みの遅い
+保存先でも、ワーカーは書き込みの完了を待たずに次のフレームの検出に進める。
+
+- 書き込みはキュー（WRITER['max_queue'] 件）を通して行い、キューが満杯の場合は
+  空きができるまで投入側が待つ（書き込みが追いつかない場合に未書き込みの画像が溜まり続けない）
+- 書き込みスレッドはキューに溜まった書き込みを最大 WRITER['coalesce'] 件まとめて取り出し、
+  同じパスへの書き込みは最後のものだけを、ディレクトリごとにまとめて書き込む
+- 出力ディレクトリの作成はプロセスごとに1回だけ行う（フレームごとの makedirs を省く）
+- 書き込みのエラーはエラーログに記録し、take_failures で呼び出し元に返す
+- ワーカープールでは、フレームごとの書き込みをチケットでまとめ（open_ticket / seal_ticket）、
+  チケットの書き込みがすべて終わった時点で (チケット, 失敗した書き込み) を完了通知のキューで
+  親プロセスに送る。タスクは書き込みの完了を待たずに結果を返し、親プロセスは完了通知を
+  受け取ってからフレームをマニフェストに記録する（書き込まれていない成果物のフレームが
+  処理済みとして記録されないようにする）。ディレクトリの完了時に残りの通知をまとめて待つ
+- 完了通知のキューが無い場合（ワーカープールの外）は、タスクが flush_writer で自分の書き込みの完了を待つ
+- ワーカーの終了時には残りの書き込みを完了させる
+
+比較画像の描画自体は呼び出し元で行い、エンコード済みのバイト列のみを書き込みスレッドに渡す。
+"""
+
+import io
+import os
+import queue
+import threading
+import itertools
+import multiprocessing
+from multiprocessing import util
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+
+import numpy as np
+
+from logger import LogManager
+
+if TYPE_CHECKING:
+    from config import Config
+
+# 書き込む内容: .npy として保存する配列、バイト列 または 書き込みスレッドでバイト列を作る関数
+WriteData = Union[np.ndarray, bytes, Callable[[], bytes]]
+# (チケット, 書き込み先のパス, 書き込む内容)（チケットはチケットを開いていない場合 None）
+WriteItem = Tuple[Optional[str], str, WriteData]
+# 失敗した書き込みの (パス, エラーメッセージ) のリスト
+WriteFailures = List[Tuple[str, str]]
+
+# 書き込みの完了通知のキュー（親プロセスが作成し、ワーカーは init_worker_acks で受け取る）
+_ack_queue: Optional['multiprocessing.Queue'] = None
+
+_created_dirs: Set[str] = set()
+_created_dirs_lock = threading.Lock()
+
+
+def ensure_dir(path: str) -> None:
+    """ディレクトリを作成する（プロセス内で作成済みのディレクトリは確認しない）"""
+    if path in _created_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    with _created_dirs_lock:
+        _created_dirs.add(path)
+
+
+class _Ticket:
+    """1フレーム分の書き込みの完了状況"""
+
+    __slots__ = ('pending', 'sealed', 'failures')
+
+    def __init__(self):
+        self.pending = 0  # 完了していない書き込みの件数
+        self.sealed = False  # フレームの書き込みをすべて投入したかどうか
+        self.failures: WriteFailures = []
+
+
+class OutputWriter:
+    """成果物をバックグラウンドのスレッドで書き込む
+
+    投入した配列は書き込みが終わるまで参照されるため、投入後に書き換えてはならない。
+    """
+
+    def __init__(
+        self,
+        threads: int = 2,
+        max_queue: int = 16,
+        coalesce: int = 8,
+        acks: Optional['multiprocessing.Queue'] = None
+    ):
+        """
+        Args:
+            threads: 書き込みスレッド数
+            max_queue: 書き込み待ちの最大件数（満杯の場合は投入側が待つ）
+            coalesce: 書き込みスレッドが1回にまとめて取り出す最大件数
+            acks: チケットの完了通知を送るキュー（None の場合はチケットを使わない）
+        """
+        self.coalesce = max(1, coalesce)
+        self.written_count = 0
+        self.error_count = 0
+        self._failures: WriteFailures = []
+        self._queue: 'queue.Queue[Optional[WriteItem]]' = queue.Queue(maxsize=max(1, max_queue))
+        self._lock = threading.Lock()
+        self._acks = acks
+        self._tickets: Dict[str, _Ticket] = {}
+        self._ticket: Optional[str] = None  # 投入中のチケット
+        self._ticket_ids = itertools.count()
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(max(1, threads))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def open_ticket(self) -> Optional[str]:
+        """以降の書き込みをまとめるチケットを開始する
+
+        Returns:
+            チケット（完了通知のキューが無い場合は None）
+        """
+        if self._acks is None:
+            return None
+        self._ticket = f"{os.getpid()}-{next(self._ticket_ids)}"
+        with self._lock:
+            self._tickets[self._ticket] = _Ticket()
+        return self._ticket
+
+    def seal_ticket(self) -> None:
+        """チケットの書き込みの投入を終える（書き込みがすべて完了した時点で完了通知を送る）"""
+        ticket, self._ticket = self._ticket, None
+        if ticket is None:
+            return
+        with self._lock:
+            self._tickets[ticket].sealed = True
+        self._send_ack_if_done(ticket)
+
+    def _put(self, path: str, data: WriteData) -> None:
+        """書き込みをキューに投入する（キューが満杯の場合は空くまで待つ）"""
+        if self._ticket is not None:
+            with self._lock:
+                self._tickets[self._ticket].pending += 1
+        self._queue.put((self._ticket, path, data))
+
+    def save_npy(self, path: str, array: np.ndarray) -> None:
+        """配列を .npy として書き込む（キューが満杯の場合は空くまで待つ）"""
+        self._put(path, array)
+
+    def write_bytes(self, path: str, data: bytes) -> None:
+        """バイト列をファイルに書き込む（キューが満杯の場合は空くまで待つ）"""
+        self._put(path, data)
+
+    def write_encoded(self, path: str, encode: Callable[[], bytes]) -> None:
+        """encode() の戻り値をファイルに書き込む（圧縮などのエンコードも書き込みスレッドで行う）"""
+        self._put(path, encode)
+
+    def _take_batch(self) -> List[Optional[WriteItem]]:
+        """キューから最大 coalesce 件の書き込みを取り出す（最初の1件は届くまで待つ）"""
+        batch = [self._queue.get()]
+        while len(batch) < self.coalesce and batch[-1] is not None:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            stop = batch[-1] is None
+            items = [item for item in batch if item is not None]
+            # 同じパスへの書き込みは最後のものだけを残し、ディレクトリごとにまとめて書き込む
+            latest: Dict[str, WriteData] = {}
+            for _, path, data in items:
+                latest.pop(path, None)
+                latest[path] = data
+            errors = {path: self._write(path, latest[path]) for path in sorted(latest, key=os.path.dirname)}
+            for ticket, path, _ in items:
+                # 上書きされた書き込みは、同じパスに最後に書き込んだ内容の結果を引き継ぐ
+                self._finish_item(ticket, path, errors[path])
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _finish_item(self, ticket: Optional[str], path: str, error: Optional[str]) -> None:
+        """チケットの書き込みを1件完了にし、すべて完了した場合は完了通知を送る"""
+        if ticket is None:
+            return
+        with self._lock:
+            state = self._tickets[ticket]
+            state.pending -= 1
+            if error is not None:
+                state.failures.append((path, error))
+        self._send_ack_if_done(ticket)
+
+    def _send_ack_if_done(self, ticket: str) -> None:
+        """チケットの書き込みがすべて投入・完了していれば完了通知を送る（1回だけ送る）"""
+        with self._lock:
+            state = self._tickets.get(ticket)
+            if state is None or not state.sealed or state.pending > 0:
+                return
+            del self._tickets[ticket]
+        self._acks.put((ticket, state.failures))
+
+    def _write(self, path: str, data: WriteData) -> Optional[str]:
+        """1ファイルを書き込む（失敗した場合はエラーメッセージを返す）"""
+        try:
+            ensure_dir(os.path.dirname(path))
+            if callable(data):
+                data = data()
+            elif isinstance(data, np.ndarray):
+                # ヘッダーと本体を1回の書き込みで行う
+                buffer = io.BytesIO()
+                np.save(buffer, data)
+                data = buffer.getvalue()
+            with open(path, 'wb') as f:
+                f.write(data)
+            with self._lock:
+                self.written_count += 1
+            return None
+        except Exception as e:
+            with self._lock:
+                self.error_count += 1
+                self._failures.append((path, str(e)))
+            LogManager().log_error(f"成果物の書き込みエラー: {path} - {str(e)}")
+            return str(e)
+
+    def flush(self) -> None:
+        """投入済みの書き込みがすべて完了するまで待つ"""
+        self._queue.join()
+
+    def take_failures(self) -> WriteFailures:
+        """前回の呼び出し以降に失敗した書き込みの (パス, エラーメッセージ) を返す"""
+        with self._lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+    def close(self) -> None:
+        """残りの書き込みを完了させてスレッドを終了する"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+_writer: Optional[OutputWriter] = None
+
+
+def get_writer(config: 'Config') -> Optional[OutputWriter]:
+    """このプロセスの書き込みスレッドを返す（無効な場合は None）
+
+    初回の呼び出しで作成し、プロセスの終了時に残りの書き込みを完了させる。
+    """
+    global _writer
+    settings = config.WRITER
+    if not settings['enabled']:
+        return None
+    if _writer is None:
+        _writer = OutputWriter(settings['threads'], settings['max_queue'], settings['coalesce'], _ack_queue)
+        # ワーカーの終了時（executor の shutdown）に書き込みが途中で失われないようにする
+        util.Finalize(None, close_writer, exitpriority=20)
+    return _writer
+
+
+def flush_writer() -> WriteFailures:
+    """このプロセスの書き込みの完了を待ち、失敗した書き込みの (パス, エラーメッセージ) を返す"""
+    if _writer is None:
+        return []
+    _writer.flush()
+    return _writer.take_failures()
+
+
+def close_writer() -> None:
+    """このプロセスの書き込みスレッドを終了する（残りの書き込みは完了させる）"""
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+
+def get_ack_queue() -> 'multiprocessing.Queue':
+    """親プロセスで書き込みの完了通知のキューを返す（初回の呼び出しで作成し、init_worker でワーカーに渡す）"""
+    global _ack_queue
+    if _ack_queue is None:
+        _ack_queue = multiprocessing.Queue()
+    return _ack_queue
+
+
+def init_worker_acks(ack_queue: Optional['multiprocessing.Queue']) -> None:
+    """ワーカープロセスで完了通知のキューを設定する（model_registry.init_worker から呼ばれる）"""
+    global _ack_queue
+    _ack_queue = ack_queue
+
+
+def acks_enabled() -> bool:
+    """このプロセスの書き込みの完了を親プロセスに通知するかどうか"""
+    return _ack_queue is not None
+
+
+def take_write_acks(timeout: float = 0) -> List[Tuple[str, WriteFailures]]:
+    """親プロセスで届いている書き込みの完了通知をすべて取り出す
+
+    Args:
+        timeout: 通知が1件も無い場合に待つ最大秒数（0 の場合は待たない）
+
+    Returns:
+        (チケット, 失敗した書き込み) のリスト（待っても届かなかった場合は空）
+    """
+    if _ack_queue is None:
+        return []
+    acks = []
+    try:
+        acks.append(_ack_queue.get(timeout=timeout) if timeout > 0 else _ack_queue.get_nowait())
+        while True:
+            acks.append(_ack_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return acks
@@ -0,0 +1,147 @@
+"""前処理の段階別キャッシュモジュール
+
+前処理（グレースケール変換 → 正規化とガンマ補正 → バイラテラルフィルタ → CLAHE →
+convertScaleAbs → クロージング）を段階のグラフとして扱い、各段階の出力を
+「入力のキー + その段階のパラメータ」をキーとしてメモリ上にキャッシュする。
+IMAGE_PROCESSING のうち下流の段階のパラメータ（contrast_clip や alpha/beta など）だけを
+変えて前処理をやり直す場合は、上流の段階（バイラテラルフィルタなど）の結果を再利用する。
+
+キャッシュはバイト数の上限を持ち、超えた分は最後に参照された時刻の古い順に削除する（LRU）。
+パラメータのスイープ（preprocess_sweep.py）など、同じフレームを繰り返し前処理する用途向け。
+"""
+
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from image_processor import PREPROCESS_STAGES, Preprocessor
+from detection_cache import frame_hash
+
+
+def stage_key(input_key: str, stage: str, params: Dict[str, Any]) -> str:
+    """段階の出力のキーを返す（入力のキーと段階のパラメータから決まる）"""
+    param_names = dict(PREPROCESS_STAGES)[stage]
+    encoded = repr((input_key, stage, [(name, params[name]) for name in param_names])).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class StageCache:
+    """バイト数の上限を持つ LRU キャッシュ"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.evicted_count = 0
+        self._entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        """値を追加する（上限を超えた分は古い順に削除。上限より大きい値は保持しない）"""
+        if value.nbytes > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evicted_count += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.nbytes = 0
+
+
+class CachedPreprocessor:
+    """段階ごとの結果をキャッシュする前処理
+
+    同じ入力・同じパラメータに対しては Preprocessor.process と同じ結果を返す。
+    返す配列はキャッシュと共有されるため、呼び出し側で書き換えてはならない。
+    1つのインスタンスを複数スレッドから同時に使用してはならない。
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: キャッシュするバイト数の上限
+        """
+        self.cache = StageCache(max_bytes)
+        self._preprocessors: Dict[Tuple[Tuple[str, Any], ...], Preprocessor] = {}
+        self.hits: Dict[str, int] = {stage: 0 for stage, _ in PREPROCESS_STAGES}
+        self.misses: Dict[str, int] = {stage: 0 for stage, _ in PREPROCESS_STAGES}
+        self.compute_time: Dict[str, float] = {stage: 0.0 for stage, _ in PREPROCESS_STAGES}
+
+    def _get_preprocessor(self, params: Dict[str, Any]) -> Preprocessor:
+        key = tuple(sorted(params.items()))
+        preprocessor = self._preprocessors.get(key)
+        if preprocessor is None:
+            preprocessor = self._preprocessors[key] = Preprocessor(params)
+        return preprocessor
+
+    def process(
+        self,
+        img: np.ndarray,
+        params: Dict[str, Any],
+        frame_key: Optional[str] = None
+    ) -> np.ndarray:
+        """画像の前処理を行う
+
+        Args:
+            img: 入力画像
+            params: 前処理パラメータ（Config.IMAGE_PROCESSING と同じ形式）
+            frame_key: 入力画像を識別するキー（未指定時は画像の内容のハッシュ）
+
+        Returns:
+            前処理済み画像
+        """
+        keys: List[str] = []
+        input_key = frame_key or frame_hash(img)
+        for stage, _ in PREPROCESS_STAGES:
+            input_key = stage_key(input_key, stage, params)
+            keys.append(input_key)
+
+        # キャッシュにある最も下流の段階から再開する
+        src: Optional[np.ndarray] = None
+        resume = 0
+        for i in range(len(keys) - 1, -1, -1):
+            src = self.cache.get(keys[i])
+            if src is not None:
+                resume = i + 1
+                break
+        for stage, _ in PREPROCESS_STAGES[:resume]:
+            self.hits[stage] += 1
+
+        preprocessor = self._get_preprocessor(params)
+        if src is None:
+            src = preprocessor.to_gray(img)
+        for i in range(resume, len(keys)):
+            stage = PREPROCESS_STAGES[i][0]
+            start = time.perf_counter()
+            src = preprocessor.apply_stage(stage, src, np.empty(src.shape[:2], np.uint8))
+            self.compute_time[stage] += time.perf_counter() - start
+            self.misses[stage] += 1
+            self.cache.put(keys[i], src)
+        return src
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """段階ごとのヒット数・計算回数・平均計算時間(ms)・推定削減時間(ms)を返す"""
+        result = {}
+        for stage, _ in PREPROCESS_STAGES:
+            mean = self.compute_time[stage] / self.misses[stage] if self.misses[stage] else 0.0
+            result[stage] = {
+                'hits': self.hits[stage],
+                'computed': self.misses[stage],
+                'mean_ms': mean * 1000,
+                'saved_ms': mean * self.hits[stage] * 1000,
+            }
+        return result
@@ -0,0 +1,169 @@
+"""前処理パラメータのスイープ
+
+IMAGE_PROCESSING のパラメータの組み合わせ（グリッド）ごとに前処理と顔検出を行い、
+検出率を比較する。前処理は段階別キャッシュ（preprocess_cache）を通して行うため、
+下流の段階のパラメータだけが異なる組み合わせでは上流の段階の結果を再利用する。
+
+組み合わせは前処理の段階順（上流のパラメータほど外側のループ）に並べ、
+フレームごとにすべての組み合わせを処理するため、キャッシュに必要なメモリは
+1フレーム分の中間画像程度で済む。
+
+使用例:
+    python preprocess_sweep.py --dir folder1 --grid contrast_clip=1.5,2.0,3.0 alpha=1.0,1.02,1.1 --limit 200
+"""
+
+import os
+import csv
+import copy
+import glob
+import time
+import argparse
+import itertools
+from typing import Any, Dict, List, Tuple
+
+from config import Config
+from image_processor import PREPROCESS_STAGES
+from landmark_detector import detect_landmarks
+from frame_source import list_frames, load_frame
+from preprocess_cache import CachedPreprocessor
+import model_registry
+
+
+def parse_grid_value(value: str) -> Any:
+    """グリッドの値を int / float / 文字列として解析する"""
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def build_param_sets(base: Dict[str, Any], grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """グリッドからパラメータの組み合わせを作成する
+
+    上流の段階のパラメータほど外側のループになるよう並べる（キャッシュの再利用のため）。
+
+    Args:
+        base: 基準のパラメータ（Config.IMAGE_PROCESSING）
+        grid: {パラメータ名: 値のリスト}
+
+    Returns:
+        パラメータの組み合わせのリスト（グリッドで指定しないパラメータは基準の値）
+    """
+    order = [name for _, names in PREPROCESS_STAGES for name in names]
+    names = sorted(grid, key=lambda name: order.index(name) if name in order else len(order))
+    return [
+        {**base, **dict(zip(names, values))}
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def run_sweep(
+    frame_ids: List[str],
+    param_sets: List[Dict[str, Any]],
+    config: Config,
+    max_bytes: int
+) -> Tuple[List[Dict[str, Any]], CachedPreprocessor]:
+    """パラメータの組み合わせごとに前処理と顔検出を行い、検出率を集計する
+
+    Returns:
+        (組み合わせごとの集計結果のリスト, 使用した前処理キャッシュ)
+    """
+    predictor = model_registry.get_predictor(config.LEARNED_MODEL_PATH)
+    detector = model_registry.get_detector()
+    preprocessor = CachedPreprocessor(max_bytes)
+
+    configs = []
+    for params in param_sets:
+        set_config = copy.copy(config)
+        set_config.IMAGE_PROCESSING = params
+        configs.append(set_config)
+
+    detected = [0] * len(param_sets)
+    preprocess_times = [0.0] * len(param_sets)
+    detect_times = [0.0] * len(param_sets)
+    for frame_id in frame_ids:
+        img = load_frame(frame_id)
+        for i, set_config in enumerate(configs):
+            start = time.perf_counter()
+            processed = preprocessor.process(img, set_config.IMAGE_PROCESSING, frame_key=frame_id)
+            preprocess_times[i] += time.perf_counter() - start
+            start = time.perf_counter()
+            result = detect_landmarks(processed, predictor, set_config, detector=detector)
+            detect_times[i] += time.perf_counter() - start
+            if result.is_detected and result.landmarks_list:
+                detected[i] += 1
+
+    rows = []
+    n = len(frame_ids)
+    swept = [name for name in param_sets[0] if len({repr(p[name]) for p in param_sets}) > 1]
+    for i, params in enumerate(param_sets):
+        rows.append({
+            **{name: params[name] for name in swept},
+            'frames': n,
+            'detected': detected[i],
+            'detection_rate': detected[i] / n * 100 if n else 0.0,
+            'preprocess_ms': preprocess_times[i] / n * 1000 if n else 0.0,
+            'detect_ms': detect_times[i] / n * 1000 if n else 0.0,
+        })
+    return rows, preprocessor
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description='前処理パラメータのスイープ（段階別キャッシュで上流の結果を再利用）')
+    parser.add_argument('--dir', required=True, help='NIR画像(.npy)が含まれるディレクトリ')
+    parser.add_argument('--grid', nargs='+', required=True, metavar='NAME=V1,V2,...',
+                        help='スイープする IMAGE_PROCESSING のパラメータと値（例: contrast_clip=1.5,2.0）')
+    parser.add_argument('--mode', choices=['normal', 'high'], default='normal', help='検出モード')
+    parser.add_argument('--limit', type=int, help='使用する最大フレーム数')
+    parser.add_argument('--max-mb', type=int, help='前処理キャッシュの上限(MB)（デフォルト: Config.PREPROCESS_CACHE）')
+    parser.add_argument('--csv', help='結果を保存するCSVファイルのパス')
+    args = parser.parse_args()
+
+    config = Config()
+    config.DETECTION_MODE = args.mode
+    grid: Dict[str, List[Any]] = {}
+    for item in args.grid:
+        name, _, values = item.partition('=')
+        if name not in config.IMAGE_PROCESSING or not values:
+            print(f"エラー: 不正なグリッドの指定です: {item}（IMAGE_PROCESSING のキー=値1,値2,... の形式）")
+            exit(1)
+        grid[name] = [parse_grid_value(value) for value in values.split(',')]
+
+    frame_ids = list_frames(sorted(glob.glob(os.path.join(args.dir, '*.npy'))), config)
+    if args.limit:
+        frame_ids = frame_ids[:args.limit]
+    if not frame_ids:
+        print(f"エラー: {args.dir} 内に.npyファイルが見つかりません。")
+        exit(1)
+
+    param_sets = build_param_sets(config.IMAGE_PROCESSING, grid)
+    max_mb = args.max_mb if args.max_mb is not None else config.PREPROCESS_CACHE['max_mb']
+    rows, preprocessor = run_sweep(frame_ids, param_sets, config, max_mb * 1024 * 1024)
+
+    swept = [key for key in rows[0] if key not in ('frames', 'detected', 'detection_rate', 'preprocess_ms', 'detect_ms')]
+    print(f"\n{'='*86}")
+    print(f"🔬 前処理パラメータのスイープ（{len(param_sets)} 通り × {len(frame_ids)} フレーム）")
+    print(f"{'='*86}")
+    print(f"{'  '.join(f'{name:>14}' for name in swept)}  {'検出率':>8} {'前処理ms':>9} {'検出ms':>8}")
+    for row in sorted(rows, key=lambda r: -r['detection_rate']):
+        values = '  '.join(f"{str(row[name]):>14}" for name in swept)
+        print(f"{values}  {row['detection_rate']:>9.1f}% {row['preprocess_ms']:>10.2f} {row['detect_ms']:>9.2f}")
+    print(f"{'='*86}")
+    print(f"♻️ 前処理キャッシュ（上限 {max_mb} MB、削除 {preprocessor.cache.evicted_count} 件）:")
+    for stage, stats in preprocessor.stats().items():
+        print(f"   {stage:<20} 再利用 {stats['hits']:>7} / 計算 {stats['computed']:>7}  "
+              f"平均 {stats['mean_ms']:>7.2f} ms  削減 {stats['saved_ms'] / 1000:>8.1f} 秒")
+
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"レポートを {args.csv} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 """画像処理実行モジュール"""
 
 import os
-import cv2
 import dlib
 import numpy as np
-from typing import Tuple, Optional
+from typing import Dict, List, Optional
 
 from config import Config
-from data_types import ProcessResult
+from data_types import FaceDetection, ProcessResult, RenderRequest
 from logger import LogManager
-from image_processor import preprocess_image
-from landmark_detector import detect_landmarks
-from image_utils import save_processed_files
+from image_processor import get_preprocessor
+from landmark_detector import detect_landmarks, landmarks_from_faces
+from image_utils import save_processed_files, should_save_comparison, visualize_comparison
+from face_tracker import FaceTracker
+from frame_source import READ_ERRORS, frame_base_name, load_frame
+from frame_ring import get_worker_ring
+from frame_storage import find_saved_frame, load_saved_frame
+from output_writer import acks_enabled, ensure_dir, flush_writer, get_writer
+import landmark_store
+import model_registry
+import profiler
 
 
 def process_image(
@@ -21,47 +28,82 @@ def process_image(
     landmarks_dir: str,
     predictor: dlib.shape_predictor,
     config: Config,
-    log_manager: Optional[LogManager] = None
+    log_manager: Optional[LogManager] = None,
+    detector: Optional[dlib.fhog_object_detector] = None,
+    tracker: Optional[FaceTracker] = None,
+    frame_index: Optional[int] = None,
+    recorded: Optional[FaceDetection] = None
 ) -> ProcessResult:
     """画像を処理してランドマークを検出する
     
     Args:
-        img_path: 画像ファイルパス
+        img_path: 画像ファイルパス または スタック内のフレームID（frame_source.make_frame_id）
         orignorm_dir: 正規化画像の保存先
         processed_dir: 処理済み画像の保存先
         landmarks_dir: ランドマークの保存先
         predictor: dlibのランドマーク予測器
         config: 設定オブジェクト
         log_manager: ログマネージャー（オプション）
+        detector: dlibの顔検出器（オプション）
+        tracker: 時系列トラッカー（指定時は前フレームの結果から探索窓を予測して検出）
+        frame_index: ディレクトリ内でのフレーム番号（比較画像の間引きに使用）
+        recorded: マニフェストに記録された顔検出の結果（指定時は顔検出を行わず、
+            成果物だけを作り直す）
         
     Returns:
         ProcessResult: 処理結果
     """
     try:
-        # メモリ効率を改善するために、必要な部分だけを読み込む
-        original_img = np.load(img_path, mmap_mode='r')
-        original_img = np.array(original_img)
-        
-        # オリジナル画像を0-255に正規化
-        orig_norm = cv2.normalize(original_img, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        # メモリマップのまま処理する（スタックの場合は該当フレームのみ読み込まれる）
+        with profiler.stage('load'):
+            original_img = load_frame(img_path)
         
         # 前処理画像
-        processed = preprocess_image(original_img, config)
-        
-        # メモリ解放
-        del original_img
+        preprocessor = get_preprocessor(config)
+        processed = preprocessor.process(original_img)
+        profiler.add_all('preprocess.', preprocessor.last_timings)
         
         # ランドマーク検出
-        detection_result = detect_landmarks(processed, predictor, config, log_manager)
+        if recorded is not None:
+            saved = _load_saved_landmarks(landmarks_dir, img_path) if recorded.rects else None
+            detection_result = landmarks_from_faces(processed, recorded, predictor, config, log_manager, saved)
+        elif tracker is not None:
+            detection_result = tracker.detect(processed, predictor, log_manager, detector)
+        else:
+            detection_result = detect_landmarks(processed, predictor, config, log_manager, detector)
         
         # is_detectedの値とlandmarks_listの内容に整合性があることを確認
         if detection_result.is_detected and len(detection_result.landmarks_list) == 0:
             detection_result.is_detected = False
             detection_result.best_upsample = None
         
+        # カスケードモードの1段目で失敗した場合は保存せず、2段目に回す
+        if not detection_result.is_detected and config.DETECTION_MODE == 'cascade' and recorded is None:
+            return ProcessResult(
+                is_detected=False,
+                message="",
+                best_upsample=None,
+                detection_info=detection_result.detection_info,
+                roi_used=detection_result.roi_used,
+                deferred=True
+            )
+        
+        # 保存しない成果物は計算もしない
+        save_comparison = should_save_comparison(config, frame_index, detection_result.is_detected)
+        
+        # オリジナル画像を0-255に正規化（orignorm か比較画像を保存する場合のみ）
+        orig_norm = None
+        if config.OUTPUTS['orignorm'] or save_comparison:
+            with profiler.stage('normalize'):
+                orig_norm = preprocessor.normalize(original_img)
+        
+        # メモリ解放
+        del original_img
+        
         # 比較画像の保存ディレクトリを設定
         comparison_dir = os.path.join(os.path.dirname(orignorm_dir), 'comparisons')
-        os.makedirs(comparison_dir, exist_ok=True)
+        if save_comparison:
+            ensure_dir(comparison_dir)
         
         # ランドマークの決定と保存
         if detection_result.is_detected:
@@ -71,25 +113,58 @@ def process_image(
             landmarks = config.TEMPLATE_LANDMARKS
             message = "顔が検出できませんでした"
         
-        # ファイルの保存
-        save_processed_files(
-            img_path=img_path,
-            orig_norm=orig_norm,
-            processed=processed,
-            landmarks=landmarks,
-            orignorm_dir=orignorm_dir,
-            processed_dir=processed_dir,
-            landmarks_dir=landmarks_dir,
-            comparison_dir=comparison_dir,
-            is_detected=detection_result.is_detected,
-            bounding_box=detection_result.bounding_box
-        )
+        # 成功フレームの成果物はバックグラウンドで書き込む（書き込みはチケットにまとめ、
+        # 完了通知を親プロセスに送る）。失敗フレームの成果物は親プロセスの補完
+        # （_landmarks_ng.npy の上書き）と比較画像の描き直しで参照されるため、結果を返す前に書き込んでおく
+        writer = get_writer(config) if detection_result.is_detected else None
+        write_ticket = writer.open_ticket() if writer is not None else None
+        try:
+            save_processed_files(
+                img_path=img_path,
+                orig_norm=orig_norm,
+                processed=processed,
+                landmarks=landmarks,
+                orignorm_dir=orignorm_dir,
+                processed_dir=processed_dir,
+                landmarks_dir=landmarks_dir,
+                comparison_dir=comparison_dir,
+                is_detected=detection_result.is_detected,
+                bounding_box=detection_result.bounding_box,
+                config=config,
+                save_comparison=save_comparison,
+                writer=writer
+            )
+        finally:
+            if writer is not None:
+                writer.seal_ticket()
+        
+        # ディレクトリ単位のランドマークストアに自分の行を書き込む
+        if config.OUTPUTS['landmark_store'] and frame_index is not None:
+            with profiler.stage('save'):
+                store = landmark_store.get_writer(landmark_store.get_store_dir(orignorm_dir))
+                store.write(
+                    frame_index, landmarks, detection_result.is_detected,
+                    detection_result.best_upsample, detection_result.bounding_box
+                )
+        
+        # 検出失敗フレームの比較画像は補完したランドマークで描き直されるため、
+        # 画像を共有メモリに置いてディスクからの読み直しを避ける
+        shared_frame = None
+        ring = get_worker_ring()
+        if ring is not None and save_comparison and not detection_result.is_detected:
+            shared_frame = ring.publish(orig_norm, processed)
         
         return ProcessResult(
             is_detected=detection_result.is_detected,
             message=message,
             best_upsample=detection_result.best_upsample,
-            detection_info=detection_result.detection_info
+            detection_info=detection_result.detection_info,
+            roi_used=detection_result.roi_used,
+            shared_frame=shared_frame,
+            landmarks=landmarks if detection_result.is_detected else None,
+            comparison_saved=save_comparison,
+            face_rect=detection_result.face_rect,
+            write_ticket=write_ticket
         )
         
     except Exception as e:
@@ -102,27 +177,91 @@ def process_image(
             is_detected=False,
             message=error_msg,
             best_upsample=None,
-            detection_info=[]
+            detection_info=[],
+            error=True
         )
 
 
-def process_image_wrapper(args: Tuple[str, str, str, str, Config]) -> ProcessResult:
+def _load_saved_landmarks(landmarks_dir: str, img_path: str) -> Optional[np.ndarray]:
+    """前回の実行で保存された成功フレームのランドマークを読み込む（無い場合は None）"""
+    path = os.path.join(landmarks_dir, f"{frame_base_name(img_path)}_landmarks.npy")
+    try:
+        return np.load(path)
+    except READ_ERRORS:
+        return None
+
+
+def start_profiling(config: Config) -> None:
+    """プロファイリングが有効な場合、1フレーム分の処理時間の記録を開始する"""
+    if config.PROFILE['enabled']:
+        if config.PROFILE['cprofile']:
+            profiler.ensure_worker_cprofile(config.OUTPUT_BASE_DIR)
+        profiler.start_frame()
+
+
+def _output_base_name(path: str) -> str:
+    """成果物のパスからフレームのベース名を返す（<ベース名>_<種類>[_ng].<拡張子>）"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.endswith('_ng'):
+        name = name[:-len('_ng')]
+    return name.rpartition('_')[0]
+
+
+def finish_writes(img_files: List[str], results: List[ProcessResult]) -> None:
+    """完了通知を使わない場合に、タスクの成果物の書き込み完了を待つ
+
+    ワーカープールでは書き込みの完了は親プロセスに通知されるため、待たずに戻る。
+    それ以外では完了を待ち、書き込みに失敗したフレームをエラーにする
+    （マニフェストに 'error' として記録され、再実行時に処理し直される）。
+
+    Args:
+        img_files: タスクのフレーム（results と同じ順序）
+        results: 処理結果（書き込みに失敗したフレームの error と message を更新する）
+    """
+    if acks_enabled():
+        return
+    failures: Dict[str, str] = {}
+    for path, error in flush_writer():
+        failures.setdefault(_output_base_name(path), f"書き込みエラー: {path} - {error}")
+    if not failures:
+        return
+    for img_file, result in zip(img_files, results):
+        error_msg = failures.get(frame_base_name(img_file))
+        if error_msg is not None:
+            result.error = True
+            result.message = error_msg
+
+
+def process_image_wrapper(args: tuple) -> ProcessResult:
     """マルチプロセス用のラッパー関数
     
+    モデルは model_registry.init_worker によりワーカーごとに1回だけロードされ、
+    以降のタスクでは再利用される。
+    
     Args:
-        args: (img_file, orignorm_dir, processed_dir, landmarks_dir, config)のタプル
+        args: (img_file, orignorm_dir, processed_dir, landmarks_dir, config[, frame_index[, recorded]])のタプル
+            recorded は成果物だけを作り直すフレームの記録済みの顔検出の結果
         
     Returns:
         ProcessResult: 処理結果
     """
     try:
-        img_file, orignorm_dir, processed_dir, landmarks_dir, config = args
-        predictor = dlib.shape_predictor(config.LEARNED_MODEL_PATH)
+        img_file, orignorm_dir, processed_dir, landmarks_dir, config = args[:5]
+        frame_index = args[5] if len(args) > 5 else None
+        recorded = args[6] if len(args) > 6 else None
+        predictor = model_registry.get_predictor(config.LEARNED_MODEL_PATH)
+        detector = model_registry.get_detector()
         log_manager = LogManager()
-        return process_image(
+        start_profiling(config)
+        result = process_image(
             img_file, orignorm_dir, processed_dir, landmarks_dir,
-            predictor, config, log_manager
+            predictor, config, log_manager, detector, frame_index=frame_index, recorded=recorded
         )
+        with profiler.stage('save.wait'):
+            finish_writes([img_file], [result])
+        result.timings = profiler.stop_frame()
+        result.worker_stats = model_registry.get_worker_stats()
+        return result
     except Exception as e:
         error_msg = f"ラッパーエラー: {str(e)}"
         log_manager = LogManager()
@@ -131,5 +270,99 @@ def process_image_wrapper(args: Tuple[str, str, str, str, Config]) -> ProcessRes
             is_detected=False,
             message=error_msg,
             best_upsample=None,
-            detection_info=[]
+            detection_info=[],
+            error=True
         )
+
+
+def process_sequence_wrapper(args: tuple) -> List[ProcessResult]:
+    """連続フレーム用のラッパー関数
+    
+    連続するフレームをファイル名順（スタックの場合はフレーム番号順）に1つのワーカーで処理する。
+    トラッキングモードでは前フレームの検出結果を次フレームの探索窓に利用する。
+    
+    Args:
+        args: (img_files, orignorm_dir, processed_dir, landmarks_dir, config[, frame_indices[, recorded]])のタプル
+            frame_indices は img_files の各フレームのディレクトリ内でのフレーム番号、
+            recorded は各フレームの記録済みの顔検出の結果（成果物だけを作り直すフレーム以外は None）
+        
+    Returns:
+        List[ProcessResult]: img_files と同じ順序の処理結果
+    """
+    img_files, orignorm_dir, processed_dir, landmarks_dir, config = args[:5]
+    frame_indices = args[5] if len(args) > 5 else list(range(len(img_files)))
+    recorded_list = args[6] if len(args) > 6 else [None] * len(img_files)
+    predictor = model_registry.get_predictor(config.LEARNED_MODEL_PATH)
+    detector = model_registry.get_detector()
+    log_manager = LogManager()
+    tracker = FaceTracker(config) if config.TRACKING['enabled'] else None
+    
+    results = []
+    for img_file, frame_index, recorded in zip(img_files, frame_indices, recorded_list):
+        start_profiling(config)
+        result = process_image(
+            img_file, orignorm_dir, processed_dir, landmarks_dir,
+            predictor, config, log_manager, detector, tracker,
+            frame_index=frame_index, recorded=recorded
+        )
+        result.timings = profiler.stop_frame()
+        results.append(result)
+    finish_writes(img_files, results)
+    
+    worker_stats = model_registry.get_worker_stats()
+    for result in results:
+        result.worker_stats = worker_stats
+    return results
+
+
+def render_fallback_comparison(request: RenderRequest, config: Config) -> None:
+    """検出失敗フレームの比較画像を補完したランドマークで描き直す
+    
+    画像は共有メモリ、ワーカーが保存した _orignorm_ng / _processed_ng（.npy / .png / .npz）、
+    入力フレームからの再計算の順に、利用できるものを使う。
+    
+    Args:
+        request: 描き直しの依頼
+        config: 設定オブジェクト
+    """
+    ring = get_worker_ring()
+    if request.shared_frame is not None and ring is not None:
+        try:
+            orig_norm, processed = ring.read(request.shared_frame)
+            visualize_comparison(
+                orig_norm, processed, [request.landmarks], request.comparison_path, None, config
+            )
+        finally:
+            ring.release(request.shared_frame)
+        return
+    
+    orignorm_path = find_saved_frame(request.orignorm_path)
+    processed_path = find_saved_frame(request.processed_path)
+    if orignorm_path is not None and processed_path is not None:
+        orig_norm = load_saved_frame(orignorm_path)
+        processed = load_saved_frame(processed_path)
+    else:
+        # 保存していない成果物は入力フレームから作り直す
+        original_img = load_frame(request.frame_id)
+        preprocessor = get_preprocessor(config)
+        processed = preprocessor.process(original_img)
+        orig_norm = preprocessor.normalize(original_img)
+    visualize_comparison(orig_norm, processed, [request.landmarks], request.comparison_path, None, config)
+
+
+def render_fallback_wrapper(args: tuple) -> bool:
+    """比較画像の描き直し用のラッパー関数
+    
+    Args:
+        args: (RenderRequest, config)のタプル
+        
+    Returns:
+        描き直しに成功した場合True
+    """
+    request, config = args
+    try:
+        render_fallback_comparison(request, config)
+        return True
+    except Exception as e:
+        LogManager().log_error(f"比較画像の描き直しエラー: {str(e)}")
+        return False
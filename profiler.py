@@ -0,0 +1,258 @@
+"""処理段階ごとのプロファイリングモジュール
+
+ワーカー側では1フレームの処理中に stage() / add() で各段階の処理時間を記録し、
+ProcessResult.timings として親プロセスに返す。親プロセスでは ProfileCollector が
+ディレクトリごとに段階別のヒストグラムへ集計し、JSON/CSV に書き出す。
+
+記録する段階:
+    load                 入力ファイルのオープン（メモリマップのため実際の読み込みは
+                         最初に画素を参照する前処理段階に含まれる）
+    preprocess.<処理名>  前処理の各OpenCV処理（Preprocessor.last_timings）
+    detect.cache         検出キャッシュの参照（画像のハッシュ計算を含む）
+    detect.resize        縮小画像での検出用のリサイズ
+    detect.upsample<N>   アップサンプリングN回での顔検出（HOG）
+    predict              ランドマーク予測
+    normalize            オリジナル画像の0-255正規化
+    save                 .npy の保存（ランドマークストアへの書き込みを含む）
+    render               比較画像の描画と保存
+    total                1フレームの処理全体
+
+プロファイリングが無効な場合（start_frame を呼んでいない場合）は何も記録しない。
+"""
+
+import os
+import csv
+import json
+import time
+import bisect
+import cProfile
+import threading
+from multiprocessing import util
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+PROFILE_JSON = 'profile.json'
+PROFILE_STAGES_CSV = 'profile_stages.csv'
+PROFILE_FRAMES_CSV = 'profile_frames.csv'
+CPROFILE_DIRNAME = 'cprofile'
+
+# ヒストグラムのビン境界（1µs〜100秒、1桁を10分割した対数スケール）
+_BIN_EDGES: List[float] = [10 ** (exponent / 10) for exponent in range(-60, 21)]
+
+# スレッドごとの記録中のフレーム
+_local = threading.local()
+
+# ワーカープロセスの cProfile
+_cprofile: Optional[cProfile.Profile] = None
+
+
+def start_frame() -> None:
+    """1フレーム分の記録を開始する"""
+    _local.timings = {}
+    _local.start = time.perf_counter()
+
+
+def stop_frame() -> Optional[Dict[str, float]]:
+    """記録を終了し、段階ごとの処理時間（秒）を返す（total を含む）"""
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return None
+    timings['total'] = time.perf_counter() - _local.start
+    _local.timings = None
+    return timings
+
+
+def is_active() -> bool:
+    """このスレッドで記録中かどうか"""
+    return getattr(_local, 'timings', None) is not None
+
+
+def add(stage_name: str, seconds: float) -> None:
+    """段階の処理時間を加算する（記録中でなければ何もしない）"""
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+
+def add_all(prefix: str, timings: Dict[str, float]) -> None:
+    """複数の段階の処理時間を prefix を付けて加算する"""
+    if is_active():
+        for stage_name, seconds in timings.items():
+            add(prefix + stage_name, seconds)
+
+
+@contextmanager
+def stage(stage_name: str) -> Iterator[None]:
+    """with ブロックの処理時間を段階の処理時間として加算する"""
+    if not is_active():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(stage_name, time.perf_counter() - start)
+
+
+def _dump_cprofile(path: str) -> None:
+    """ワーカー終了時に cProfile の結果を書き出す"""
+    if _cprofile is not None:
+        _cprofile.disable()
+        _cprofile.dump_stats(path)
+
+
+def ensure_worker_cprofile(output_base_dir: str) -> None:
+    """ワーカープロセスで cProfile を開始する（プロセスごとに1回）
+
+    結果はワーカーの終了時に <output_base_dir>/cprofile/worker_<PID>.prof に書き出す。
+    python -m pstats などで確認できる。
+    """
+    global _cprofile
+    if _cprofile is not None:
+        return
+    profile_dir = os.path.join(output_base_dir, CPROFILE_DIRNAME)
+    os.makedirs(profile_dir, exist_ok=True)
+    _cprofile = cProfile.Profile()
+    # multiprocessing のワーカーは atexit を実行しないため、終了時のファイナライザーに登録する
+    util.Finalize(
+        None, _dump_cprofile,
+        args=(os.path.join(profile_dir, f'worker_{os.getpid()}.prof'),),
+        exitpriority=10
+    )
+    _cprofile.enable()
+
+
+class StageHistogram:
+    """1段階分の処理時間のヒストグラム（フレーム数によらず一定のメモリ）"""
+
+    def __init__(self):
+        self.counts = [0] * (len(_BIN_EDGES) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(_BIN_EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """パーセンタイルの推定値（該当するビンの上端、秒）"""
+        if not self.count:
+            return 0.0
+        threshold = q / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return min(_BIN_EDGES[i] if i < len(_BIN_EDGES) else self.max, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_ms': self.mean * 1000,
+            'min_ms': (self.min if self.count else 0.0) * 1000,
+            'max_ms': self.max * 1000,
+            'p50_ms': self.percentile(50) * 1000,
+            'p90_ms': self.percentile(90) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'histogram': {
+                'bin_upper_edges_s': _BIN_EDGES,
+                'counts': self.counts,
+            },
+        }
+
+
+class ProfileCollector:
+    """1ディレクトリ分のプロファイル結果を集計するクラス
+
+    段階ごとのヒストグラムを保持し、フレームごとの処理時間は
+    profile_frames.csv（frame, stage, seconds の縦持ち）に逐次書き出す。
+    CSV は最初のフレームの追加時に開き、write で閉じる（多数のディレクトリを
+    prepare しても、処理中のディレクトリの分しかファイルを開かない）。
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.stages: Dict[str, StageHistogram] = {}
+        self.frame_count = 0
+        self._frames_fp: Optional[TextIO] = None
+        self._frames_writer = None
+
+    def _open_frames_csv(self) -> None:
+        """profile_frames.csv を開いてヘッダーを書き込む"""
+        self._frames_fp = open(
+            os.path.join(self.output_dir, PROFILE_FRAMES_CSV), 'w', encoding='utf-8', newline=''
+        )
+        self._frames_writer = csv.writer(self._frames_fp)
+        self._frames_writer.writerow(['frame', 'stage', 'seconds'])
+
+    def add(self, frame: str, timings: Optional[Dict[str, float]]) -> None:
+        """1フレーム分の処理時間を追加する"""
+        if not timings:
+            return
+        if self._frames_fp is None:
+            self._open_frames_csv()
+        self.frame_count += 1
+        for stage_name, seconds in timings.items():
+            histogram = self.stages.get(stage_name)
+            if histogram is None:
+                histogram = self.stages[stage_name] = StageHistogram()
+            histogram.add(seconds)
+            self._frames_writer.writerow([frame, stage_name, f"{seconds:.6f}"])
+
+    def summary(self) -> Dict[str, Any]:
+        """段階ごとの集計結果を返す（total に対する割合を含む）"""
+        total = self.stages['total'].total if 'total' in self.stages else 0.0
+        stages = {}
+        for stage_name in sorted(self.stages):
+            stats = self.stages[stage_name].to_dict()
+            stats['share'] = stats['total_s'] / total if total > 0 else 0.0
+            stages[stage_name] = stats
+        return {'frames': self.frame_count, 'stages': stages}
+
+    def write(self) -> str:
+        """profile.json と profile_stages.csv を書き出す
+
+        Returns:
+            profile.json のパス
+        """
+        if self._frames_fp is None and self.frame_count == 0:
+            self._open_frames_csv()  # フレームが無い場合もヘッダーのみのファイルを残す
+        if self._frames_fp is not None:
+            self._frames_fp.close()
+            self._frames_fp = None
+            self._frames_writer = None
+        summary = self.summary()
+        json_path = os.path.join(self.output_dir, PROFILE_JSON)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        fields = ['stage', 'count', 'total_s', 'mean_ms', 'min_ms', 'max_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'share']
+        with open(os.path.join(self.output_dir, PROFILE_STAGES_CSV), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for stage_name, stats in summary['stages'].items():
+                writer.writerow({'stage': stage_name, **stats})
+        return json_path
+
+    def print_summary(self) -> None:
+        """段階ごとの処理時間を表示する（合計時間の多い順）"""
+        summary = self.summary()
+        if not summary['stages']:
+            return
+        print(f"⏱️ 段階別処理時間（{summary['frames']} フレーム）:")
+        print(f"   {'段階':<28} {'平均ms':>9} {'p50ms':>9} {'p90ms':>9} {'割合':>7}")
+        ordered = sorted(summary['stages'].items(), key=lambda item: -item[1]['total_s'])
+        for stage_name, stats in ordered:
+            print(f"   {stage_name:<28} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>9.2f} "
+                  f"{stats['p90_ms']:>9.2f} {stats['share']*100:>6.1f}%")
+        print(f"")
@@ -0,0 +1,77 @@
+"""実行全体のスケジューラーモジュール
+
+実行全体で1つのワーカープールを維持し、全ディレクトリの画像を
+1つのグローバルキューとして投入する。ディレクトリごとにプロセスの起動と
+モデルのウォームアップを繰り返さないため、多数のフォルダを含む
+--list 実行でもオーバーヘッドが1回分で済む。
+"""
+
+import os
+from typing import List, Optional
+
+from tqdm import tqdm
+
+from config import Config
+from directory_processor import DirectoryJob, create_executor, create_frame_ring, run_jobs
+from worker_scheduler import ConcurrencyController, plan_workers, print_plan
+
+
+def process_directories(
+    input_dirs: List[str],
+    detection_mode: str = 'normal',
+    config: Optional[Config] = None
+) -> None:
+    """複数ディレクトリを1つのワーカープールで処理する
+
+    ディレクトリごとの出力とサマリーは process_directory と同じになる。
+
+    Args:
+        input_dirs: 入力ディレクトリパスのリスト
+        detection_mode: 検出モード ('normal'、'high' または 'cascade')
+        config: 設定オブジェクト（未指定時は Config() を使用）
+    """
+    config = config or Config()
+    config.DETECTION_MODE = detection_mode
+
+    jobs: List[DirectoryJob] = []
+    for input_dir in input_dirs:
+        if not os.path.isdir(input_dir):
+            print(f"警告: {input_dir} は有効なディレクトリではありません。スキップします。")
+            continue
+        jobs.append(DirectoryJob(input_dir, config))
+
+    # 入力の列挙は最初に処理するディレクトリの分だけ先に行い、
+    # 残りのディレクトリは run_jobs がタスクを投入しながら順に行う
+    first_job = next((job for job in jobs if job.prepare()), None)
+    if first_job is None:
+        return
+
+    def on_job_start(job: DirectoryJob) -> None:
+        tqdm.write(f"\n=== ディレクトリ {job.input_dir} の処理を開始します ===")
+
+    def on_job_done(job: DirectoryJob) -> None:
+        print(f"=== ディレクトリ {job.input_dir} の処理が完了しました ===\n")
+
+    # ワーカー数は最初のディレクトリの先頭フレームの大きさとメモリから決める
+    # （より大きいフレームのディレクトリでは、ワーカーが報告するメモリ使用量で同時実行数を減らす）
+    plan = plan_workers(config, first_job.all_files[:1])
+    print_plan(plan)
+    controller = ConcurrencyController(plan, config)
+    # 検出失敗フレームの画像は共有メモリ経由で受け取る（実行全体で1つ。
+    # スロットに収まらない大きさのフレームはディスク経由になる）
+    ring = create_frame_ring(config, [first_job], plan.pool_size)
+    for job in jobs:
+        job.frame_ring = ring
+    try:
+        with create_executor(config, plan.pool_size, ring) as executor:
+            run_jobs(
+                executor, jobs,
+                max_in_flight=plan.initial_limit,
+                on_job_start=on_job_start,
+                on_job_done=on_job_done,
+                controller=controller
+            )
+    finally:
+        if ring is not None:
+            ring.close()
+    controller.print_summary()
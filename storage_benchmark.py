@@ -0,0 +1,212 @@
+"""orignorm・processed の保存形式の比較ベンチマーク
+
+正規化済みオリジナル画像と前処理済み画像を、非圧縮の .npy（np.save）を基準として
+frame_storage の各形式（PNG、.npz の deflate / bzip2 / lzma、圧縮レベル）で保存し、
+書き込み時間・読み込み時間・ファイルサイズを比較する。
+--workers を指定すると、ワーカーと同じく複数プロセスで並列に圧縮・書き込みした場合の
+スループットも計測する。
+
+使用例:
+    python storage_benchmark.py --dir folder1 --limit 100
+    python storage_benchmark.py --resolution 1280x1024 --frames 50 --levels 1 6 9 --workers 1 4
+"""
+
+import os
+import csv
+import glob
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from config import Config
+from image_processor import preprocess_image
+from frame_storage import STORAGE_EXTENSIONS, load_saved_frame, save_frame
+from benchmark import generate_frames
+
+
+def prepare_images(frames: List[np.ndarray], config: Config) -> List[Tuple[str, np.ndarray]]:
+    """入力フレームから orignorm・processed の画像を作成する
+
+    Returns:
+        (種類, 画像) のリスト（種類は 'orignorm' または 'processed'）
+    """
+    images = []
+    for img in frames:
+        images.append(('orignorm', cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)))
+        images.append(('processed', preprocess_image(img, config)))
+    return images
+
+
+def storage_variants(formats: List[str], codecs: List[str], levels: List[int]) -> List[Dict[str, Any]]:
+    """比較する保存形式の設定（Config.FRAME_STORAGE）のリストを返す（先頭は基準の npy）"""
+    variants = [{'format': 'npy', 'codec': 'deflate', 'level': 0}]
+    for fmt in formats:
+        if fmt == 'png':
+            variants.extend({'format': 'png', 'codec': 'deflate', 'level': level} for level in levels)
+        elif fmt == 'npz':
+            for codec in codecs:
+                # lzma は圧縮レベルを指定できないため1つだけ
+                codec_levels = levels[:1] if codec == 'lzma' else levels
+                variants.extend({'format': 'npz', 'codec': codec, 'level': level} for level in codec_levels)
+    return variants
+
+
+def variant_label(storage: Dict[str, Any]) -> str:
+    """保存形式の表示名を返す（例: npz/deflate/6）"""
+    if storage['format'] == 'npy':
+        return 'npy'
+    if storage['format'] == 'npz' and storage['codec'] == 'lzma':
+        return 'npz/lzma'
+    codec = f"/{storage['codec']}" if storage['format'] == 'npz' else ''
+    return f"{storage['format']}{codec}/{storage['level']}"
+
+
+def _save_images(args: tuple) -> int:
+    """画像をまとめて保存する（並列書き込みの計測用。ワーカープロセスで実行）"""
+    items, config = args
+    for path, img in items:
+        save_frame(path, img, config)
+    return len(items)
+
+
+def measure_variant(
+    images: List[Tuple[str, np.ndarray]],
+    storage: Dict[str, Any],
+    work_dir: str,
+    workers: List[int]
+) -> Dict[str, Any]:
+    """1つの保存形式で書き込み・読み込みを計測する
+
+    Args:
+        images: (種類, 画像) のリスト
+        storage: 保存形式の設定
+        work_dir: 書き込み先の作業ディレクトリ
+        workers: 並列書き込みを計測するプロセス数のリスト
+
+    Returns:
+        集計結果（書き込み・読み込みの平均ms、合計サイズ、並列書き込みのスループット）
+    """
+    config = Config()
+    config.FRAME_STORAGE = storage
+    out_dir = os.path.join(work_dir, variant_label(storage).replace('/', '_'))
+    os.makedirs(out_dir, exist_ok=True)
+    ext = STORAGE_EXTENSIONS[storage['format']]
+    paths = [os.path.join(out_dir, f'frame_{i:06d}_{kind}{ext}') for i, (kind, _) in enumerate(images)]
+
+    write_times = []
+    for path, (_, img) in zip(paths, images):
+        start = time.perf_counter()
+        save_frame(path, img, config)
+        write_times.append(time.perf_counter() - start)
+
+    # PNG にできない画像は .npz で保存されるため、実際に保存されたファイルを読む
+    saved = []
+    for path in paths:
+        if not os.path.exists(path):
+            path = os.path.splitext(path)[0] + STORAGE_EXTENSIONS['npz']
+        saved.append(path)
+
+    read_times = []
+    for path, (_, img) in zip(saved, images):
+        start = time.perf_counter()
+        loaded = load_saved_frame(path)
+        read_times.append(time.perf_counter() - start)
+        if loaded.shape != img.shape or not np.array_equal(loaded, img):
+            raise RuntimeError(f"読み込んだ画像が一致しません: {path}")
+
+    row = {
+        'format': variant_label(storage),
+        'write_ms': float(np.mean(write_times)) * 1000,
+        'read_ms': float(np.mean(read_times)) * 1000,
+        'bytes': sum(os.path.getsize(path) for path in saved),
+    }
+
+    for n_workers in workers:
+        chunks = [list(zip(paths[i::n_workers], [img for _, img in images[i::n_workers]]))
+                  for i in range(n_workers)]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # プロセスの起動を計測に含めない
+            list(executor.map(_save_images, [([], config)] * n_workers))
+            start = time.perf_counter()
+            list(executor.map(_save_images, [(chunk, config) for chunk in chunks]))
+            elapsed = time.perf_counter() - start
+        row[f'images_per_s_w{n_workers}'] = len(images) / elapsed if elapsed > 0 else 0.0
+    return row
+
+
+def load_input_frames(args: argparse.Namespace) -> List[np.ndarray]:
+    """計測に使う入力フレームを用意する（ディレクトリの .npy、無い場合は合成フレーム）"""
+    if args.dir:
+        paths = sorted(glob.glob(os.path.join(args.dir, '*.npy')))[:args.limit]
+        return [np.load(path) for path in paths]
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    return generate_frames(args.frames, (width, height), args.bit_depth, args.seed)
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description='orignorm・processed の保存形式の比較ベンチマーク')
+    parser.add_argument('--dir', help='NIR画像(.npy)が含まれるディレクトリ（未指定時は合成フレーム）')
+    parser.add_argument('--limit', type=int, default=100, help='--dir から読み込む最大フレーム数')
+    parser.add_argument('--resolution', default='640x480', help='合成フレームの解像度（幅x高さ）')
+    parser.add_argument('--bit-depth', type=int, default=16, help='合成フレームのビット深度')
+    parser.add_argument('--frames', type=int, default=30, help='合成フレームの数')
+    parser.add_argument('--seed', type=int, default=0, help='合成フレームの乱数シード')
+    parser.add_argument('--formats', nargs='+', choices=['png', 'npz'], default=['png', 'npz'],
+                        help='比較する保存形式（npy は常に基準として含まれる）')
+    parser.add_argument('--codecs', nargs='+', choices=['deflate', 'bzip2', 'lzma'], default=['deflate'],
+                        help='npz の圧縮方式')
+    parser.add_argument('--levels', nargs='+', type=int, choices=range(10), default=[1, 6], metavar='{0-9}',
+                        help='圧縮レベル（bzip2 は 1-9）')
+    parser.add_argument('--workers', nargs='+', type=int, default=[],
+                        help='並列書き込みを計測するプロセス数（複数指定可能）')
+    parser.add_argument('--csv', help='結果を保存するCSVファイルのパス')
+    args = parser.parse_args()
+    if 'npz' in args.formats and 'bzip2' in args.codecs and min(args.levels) < 1:
+        parser.error('--codecs bzip2 の --levels は 1-9 で指定してください')
+
+    frames = load_input_frames(args)
+    if not frames:
+        print(f"エラー: {args.dir} 内に.npyファイルが見つかりません。")
+        exit(1)
+    images = prepare_images(frames, Config())
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='nir_storage_benchmark_') as work_dir:
+        for storage in storage_variants(args.formats, args.codecs, args.levels):
+            rows.append(measure_variant(images, storage, work_dir, args.workers))
+    baseline = rows[0]
+    for row in rows:
+        row['ratio'] = row['bytes'] / baseline['bytes'] if baseline['bytes'] else 0.0
+
+    width = 72 + 12 * len(args.workers)
+    print(f"\n{'='*width}")
+    print(f"💾 保存形式の比較（基準: npy, {len(frames)} フレーム × orignorm・processed）")
+    print(f"{'='*width}")
+    header = f"{'形式':<16} {'書き込みms':>10} {'読み込みms':>10} {'合計MB':>10} {'サイズ比':>8}"
+    for n_workers in args.workers:
+        header += f" {f'枚/秒 w{n_workers}':>11}"
+    print(header)
+    for row in rows:
+        line = (f"{row['format']:<18} {row['write_ms']:>12.2f} {row['read_ms']:>12.2f} "
+                f"{row['bytes'] / (1024 * 1024):>10.1f} {row['ratio']:>9.2f}")
+        for n_workers in args.workers:
+            line += f" {row[f'images_per_s_w{n_workers}']:>12.1f}"
+        print(line)
+    print(f"{'='*width}")
+
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"結果を {args.csv} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
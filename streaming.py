@@ -0,0 +1,284 @@
+"""ストリーミング処理モジュール
+
+ディレクトリ内のファイルを os.scandir で逐次列挙し、同時に投入するタスクを
+最大K個に制限したまま、処理結果を投入順に返すジェネレーターとして処理する。
+サマリーファイルは1フレームごとに追記するため、ファイル数に比例して
+メモリ使用量が増えず、最初の結果もファイルの列挙を待たずに得られる。
+
+ファイルの順序は os.scandir が返す順序（NTFSではファイル名順、ext4等では不定）になる。
+カスケードモード、トラッキングモード、再実行モード、ランドマークストアは
+ディレクトリ全体の一覧を必要とするため、ストリーミングモードでは使用できない。
+"""
+
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Deque, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from tqdm import tqdm
+
+from config import Config
+from data_types import DetectionInfo, ProcessResult
+from directory_processor import (
+    DETECTION_RESULTS_HEADER, DirectoryJob, Task, create_executor, deliver_write_acks, format_detection_result,
+    wait_for_writes
+)
+from frame_source import iter_file_frames
+from image_utils import setup_directories
+from output_writer import WriteFailures
+from processor import process_image_wrapper
+from worker_scheduler import plan_workers, print_plan
+
+
+def iter_npy_files(input_dir: str) -> Iterator[str]:
+    """ディレクトリ内の.npyファイルを逐次列挙する（一覧をメモリに保持しない）
+
+    Args:
+        input_dir: 入力ディレクトリパス
+
+    Yields:
+        .npyファイルのパス
+    """
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.npy') and entry.is_file():
+                yield entry.path
+
+
+def get_unsupported_options(config: Config) -> List[str]:
+    """ストリーミングモードと併用できない設定の一覧を返す"""
+    options = []
+    if config.DETECTION_MODE == 'cascade':
+        options.append('--mode cascade')
+    if config.TRACKING['enabled']:
+        options.append('--track')
+    if config.RESUME['enabled']:
+        options.append('--resume')
+    if config.OUTPUTS['landmark_store']:
+        options.append('--landmark-store')
+    return options
+
+
+class StreamingDirectoryJob(DirectoryJob):
+    """1ディレクトリ分のストリーミング処理の状態を管理するクラス
+
+    結果のリストを保持せず、detection_results.txt と not_detected.txt に
+    1フレームずつ追記する。
+    """
+
+    def __init__(self, input_dir: str, config: Config, log_manager=None):
+        super().__init__(input_dir, config, log_manager)
+        self.submitted_count = 0
+        self.not_detected_count = 0
+        self.result_file = os.path.join(config.OUTPUT_BASE_DIR, 'detection_results.txt')
+        self._result_fp: Optional[TextIO] = None
+        self._not_detected_fp: Optional[TextIO] = None
+
+    @property
+    def total(self) -> int:
+        """これまでに投入した画像数（ファイル数は事前に分からない）"""
+        return self.submitted_count
+
+    def _all_results_recorded(self) -> bool:
+        """ファイル数が事前に分からないため、補完の確定は stream_results が列挙の終了時に行う"""
+        return False
+
+    def prepare(self) -> bool:
+        """出力ディレクトリを作成し、検出結果ファイルを開く
+
+        Returns:
+            常にTrue（ファイルの有無は処理終了時に判定する）
+        """
+        self.orignorm_dir, self.processed_dir, self.landmarks_dir = setup_directories(
+            self.config.OUTPUT_BASE_DIR, self.input_dir
+        )
+        self.output_dir = os.path.dirname(self.orignorm_dir)
+        self.comparison_dir = os.path.join(self.output_dir, 'comparisons')
+        self._setup_profile()
+
+        # 前回の失敗一覧が残らないよう削除しておく（失敗が出た時点で作り直す）
+        not_detected_path = os.path.join(self.output_dir, 'not_detected.txt')
+        if os.path.exists(not_detected_path):
+            os.remove(not_detected_path)
+
+        self._result_fp = open(self.result_file, 'w', encoding='utf-8')
+        self._result_fp.write(DETECTION_RESULTS_HEADER)
+        return True
+
+    def iter_tasks(self) -> Iterator[Task]:
+        """ファイルを列挙しながらワーカーに投入するタスクを返す
+
+        スタック (T, H, W) はフレーム単位のタスクに展開する。
+        """
+        for img_file in iter_npy_files(self.input_dir):
+            for frame in iter_file_frames(img_file, self.config):
+                frame_index = self.submitted_count
+                self.submitted_count += 1
+                yield process_image_wrapper, (
+                    frame, self.orignorm_dir, self.processed_dir, self.landmarks_dir, self.config,
+                    frame_index
+                )
+
+    def _add_summary(
+        self,
+        base_filename: str,
+        best_upsample: Optional[int],
+        is_detected: bool,
+        message: str,
+        detection_info: List[DetectionInfo]
+    ) -> None:
+        """サマリーファイルに1フレーム分の結果を追記する"""
+        self._result_fp.write(format_detection_result(base_filename, best_upsample, is_detected))
+        self._result_fp.flush()
+        if not is_detected:
+            if self._not_detected_fp is None:
+                self._not_detected_fp = open(
+                    os.path.join(self.output_dir, 'not_detected.txt'), 'w', encoding='utf-8'
+                )
+            self._not_detected_fp.write(f"{base_filename}_ng.npy - {message}\n")
+            self._not_detected_fp.flush()
+            self.not_detected_count += 1
+
+    def finalize(self) -> None:
+        """サマリーファイルを閉じ、サマリーを表示する"""
+        for fp in (self._result_fp, self._not_detected_fp):
+            if fp is not None:
+                fp.close()
+        self._result_fp = self._not_detected_fp = None
+        self._finish_profile()
+
+        if self.submitted_count == 0:
+            print(f"エラー: {self.input_dir} 内に.npyファイルが見つかりません。")
+            return
+        if self.not_detected_count:
+            out_txt = os.path.join(self.output_dir, 'not_detected.txt')
+            print(f"\n顔が検出できなかったファイル一覧を {out_txt} に保存しました（{self.not_detected_count}件）")
+        else:
+            print("\nすべての画像で顔が検出されました！")
+        self.print_summary(self.result_file)
+
+
+def stream_results(
+    executor: ProcessPoolExecutor,
+    job: StreamingDirectoryJob,
+    max_in_flight: int
+) -> Iterator[Tuple[str, ProcessResult]]:
+    """タスクを最大 max_in_flight 個ずつ投入し、結果を投入順に返す
+
+    結果は返す前に job に集計される（サマリーへの追記を含む）。検出失敗フレームの
+    補完は前後の成功フレームが確定した時点で行われ、比較画像の描き直しは
+    同じワーカープールで実行される。処理中の例外は error=True の結果として返す。
+
+    Args:
+        executor: ワーカープール
+        job: prepare 済みのストリーミングジョブ
+        max_in_flight: 同時に投入しておくタスクの最大数
+
+    Yields:
+        (画像ファイルパスまたはフレームID, 処理結果) のタプル
+    """
+    tasks = job.iter_tasks()
+    pending: Deque[Tuple[Future, tuple]] = deque()
+    renders: Deque[Tuple[Future, tuple]] = deque()
+    write_acks: Dict[str, WriteFailures] = {}
+
+    def fill() -> None:
+        for fn, args in islice(tasks, max_in_flight - len(pending)):
+            pending.append((executor.submit(fn, args), args))
+
+    def collect_renders(block: bool) -> None:
+        # 補完で追加された比較画像の描き直しを投入し、完了したものを集計する
+        while job.followup_tasks:
+            fn, args = job.followup_tasks.popleft()
+            renders.append((executor.submit(fn, args), args))
+        while renders and (block or renders[0][0].done()):
+            future, args = renders.popleft()
+            try:
+                job.handle_output(args, future.result())
+            except Exception as e:
+                job.handle_failure(args, e)
+
+    fill()
+    while pending:
+        future, args = pending.popleft()
+        # 先頭の結果を待つ間もワーカーが空かないよう、先に補充しておく
+        fill()
+        try:
+            result = future.result()
+            job.handle_output(args, result)
+        except Exception as e:
+            job.handle_failure(args, e)
+            result = ProcessResult(
+                is_detected=False,
+                message=f"処理例外: {str(e)}",
+                best_upsample=None,
+                detection_info=[],
+                error=True
+            )
+        collect_renders(block=False)
+        deliver_write_acks([job], write_acks)
+        yield args[0], result
+
+    # 列挙が終わったので、残りの失敗フレームの補完を確定させる
+    job.finish_fallback()
+    collect_renders(block=True)
+    wait_for_writes([job], job, write_acks)
+
+
+def process_directories_streaming(
+    input_dirs: List[str],
+    detection_mode: str = 'normal',
+    config: Optional[Config] = None,
+    max_in_flight: Optional[int] = None
+) -> None:
+    """複数ディレクトリを1つのワーカープールでストリーミング処理する
+
+    Args:
+        input_dirs: 入力ディレクトリパスのリスト
+        detection_mode: 検出モード ('normal' または 'high')
+        config: 設定オブジェクト（未指定時は Config() を使用）
+        max_in_flight: 同時に投入しておくタスクの最大数（未指定時はワーカー数 × 4）
+    """
+    config = config or Config()
+    config.DETECTION_MODE = detection_mode
+
+    unsupported = get_unsupported_options(config)
+    if unsupported:
+        print(f"エラー: ストリーミングモードでは {', '.join(unsupported)} を使用できません。")
+        return
+
+    # ワーカー数は最初のフレームの大きさとメモリから決める（投入数は固定のため同時実行数は調整しない）
+    sample = next((
+        frame for input_dir in input_dirs if os.path.isdir(input_dir)
+        for img_file in iter_npy_files(input_dir) for frame in iter_file_frames(img_file, config)
+    ), None)
+    plan = plan_workers(config, [sample] if sample is not None else [])
+    print_plan(plan)
+    max_workers = plan.initial_limit if plan.adaptive else plan.pool_size
+    max_in_flight = max_in_flight or max_workers * 4
+    with create_executor(config, max_workers) as executor:
+        for input_dir in input_dirs:
+            if not os.path.isdir(input_dir):
+                print(f"警告: {input_dir} は有効なディレクトリではありません。スキップします。")
+                continue
+            print(f"\n=== ディレクトリ {input_dir} の処理を開始します（ストリーミング） ===")
+            job = StreamingDirectoryJob(input_dir, config)
+            job.prepare()
+
+            # 総数は事前に分からないため、処理済み数と処理速度のみ表示する
+            pbar = tqdm(desc="画像処理中", unit="枚")
+            try:
+                for _ in stream_results(executor, job, max_in_flight):
+                    pbar.update(1)
+                    processed = job.success_count + job.failure_count
+                    pbar.set_postfix({
+                        '成功': job.success_count,
+                        '失敗': job.failure_count,
+                        '成功率': f"{job.success_count/processed*100:.1f}%"
+                    })
+            finally:
+                pbar.close()
+                tqdm.write("")
+                job.finalize()
+            print(f"=== ディレクトリ {input_dir} の処理が完了しました ===\n")
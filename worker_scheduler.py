@@ -0,0 +1,217 @@
+"""ワーカー数の決定と同時実行数の調整モジュール
+
+ワーカープールの大きさを CPU コア数だけでなくメモリから決める。各ワーカーは
+学習済みモデル（約100MB）とフレームの作業領域（正規化・前処理の中間画像、
+アップサンプルした画像、比較画像の描画）を持つため、4K のフレームでは
+コア数分のワーカーがメモリに収まらないことがある。
+
+- ワーカー1つあたりのメモリ = モデル + フレームの画素数 × WORKERS['bytes_per_pixel']
+  （処理開始後はワーカーが報告する実際のメモリ使用量で置き換える）
+- ワーカー数 = min(メモリの予算 / ワーカー1つあたりのメモリ, CPUコア数 × oversubscribe)
+- 同時に実行するタスク数は処理速度（フレーム/秒）を見ながら1つずつ増減する（山登り法）。
+  小さいフレームでI/O待ちが多い場合はコア数より多く、メモリに余裕が無い場合は少なくなる
+"""
+
+import os
+import math
+import time
+import multiprocessing
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from config import Config
+from data_types import WorkerPlan, WorkerStats
+from frame_source import READ_ERRORS, frame_shape
+from model_registry import get_memory_usage_mb
+
+try:
+    import psutil  # オプション依存（空きメモリの取得用）
+except ImportError:
+    psutil = None
+
+
+def get_cpu_workers() -> int:
+    """CPUコア数から決めたワーカー数を返す（CPUコア数 - 2、最低1）"""
+    if multiprocessing.cpu_count() > 2:
+        return multiprocessing.cpu_count() - 2
+    return 1
+
+
+def get_available_memory_mb() -> Optional[float]:
+    """使用可能なメモリ(MB)を返す（取得できない環境では None）
+
+    解放可能なページキャッシュを含む値（psutil の available、Linux の MemAvailable）を使う。
+    空きメモリ（MemFree）だけでは、NAS からの読み込みでページキャッシュが増えると
+    実際には使えるメモリが少なく見積もられ、ワーカー数が不必要に減る。
+    """
+    if psutil is not None:
+        return psutil.virtual_memory().available / (1024 * 1024)
+    try:
+        with open('/proc/meminfo', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024  # kB 単位
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # MemAvailable が無い環境（macOS など）では空きメモリで代用する
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None  # Windows など
+
+
+def estimate_task_mb(frame_ids: Iterable[str], config: Config) -> float:
+    """ワーカー1つあたりの推定メモリ(MB)を返す
+
+    Args:
+        frame_ids: 大きさを調べるフレーム（各ディレクトリの先頭フレームなど）
+        config: 設定オブジェクト
+
+    Returns:
+        モデル + 最も大きいフレームの作業領域と書き込み待ちの画像 (MB)
+    """
+    pixels = 0
+    for frame_id in frame_ids:
+        try:
+            shape = frame_shape(frame_id)
+        except READ_ERRORS:
+            continue  # 読み込めないフレームはそのフレームの処理でエラーとして記録される
+        pixels = max(pixels, int(np.prod(shape[:2])))
+    settings = config.WORKERS
+    task_bytes = pixels * settings['bytes_per_pixel']
+    if config.WRITER['enabled']:
+        # 書き込み待ちのキューに置かれる画像（orignorm / processed は1画素1バイト）
+        task_bytes += pixels * config.WRITER['max_queue']
+    return settings['model_mb'] + task_bytes / (1024 * 1024)
+
+
+def plan_workers(
+    config: Config,
+    frame_ids: Iterable[str],
+    max_workers: Optional[int] = None
+) -> WorkerPlan:
+    """ワーカー数と同時実行数の初期値を決める
+
+    Args:
+        config: 設定オブジェクト（WORKERS の設定を使用）
+        frame_ids: 大きさを調べるフレーム
+        max_workers: 固定するワーカー数（指定時は config.WORKERS['max_workers'] より優先）
+
+    Returns:
+        WorkerPlan: ワーカー数の計画
+    """
+    settings = config.WORKERS
+    task_mb = estimate_task_mb(frame_ids, config)
+    fixed = max_workers or settings['max_workers']
+    budget_mb = settings['max_memory_mb']
+    if budget_mb is None:
+        available = get_available_memory_mb()
+        if available is not None:
+            budget_mb = available * settings['memory_fraction']
+
+    if fixed:
+        # ワーカー数の指定がある場合は調整しない（従来どおりタスクを多めに投入しておく）
+        return WorkerPlan(fixed, fixed * 4, budget_mb, task_mb, False, 'ワーカー数の指定')
+
+    cpu_limit = max(1, math.ceil(multiprocessing.cpu_count() * settings['oversubscribe']))
+    pool_size, reason = cpu_limit, 'CPUコア数'
+    if budget_mb is not None:
+        memory_limit = max(1, int(budget_mb // task_mb))
+        if memory_limit < pool_size:
+            pool_size, reason = memory_limit, 'メモリ'
+    if not settings['adaptive']:
+        pool_size = min(pool_size, get_cpu_workers())
+        return WorkerPlan(pool_size, pool_size * 4, budget_mb, task_mb, False, reason)
+    return WorkerPlan(pool_size, min(pool_size, get_cpu_workers()), budget_mb, task_mb, True, reason)
+
+
+def print_plan(plan: WorkerPlan) -> None:
+    """ワーカー数の計画を表示する"""
+    budget = f"{plan.budget_mb:.0f}MB" if plan.budget_mb is not None else "不明"
+    mode = f"同時実行数 {plan.initial_limit} から自動調整" if plan.adaptive else "固定"
+    print(f"⚙️ ワーカー数: {plan.pool_size}（{plan.reason}で決定、{mode}）"
+          f" / メモリ予算 {budget}、ワーカーあたり推定 {plan.task_mb:.0f}MB")
+
+
+class ConcurrencyController:
+    """処理速度とメモリ使用量を見ながら同時に実行するタスク数を調整する
+
+    window_s 秒ごとの処理速度（完了したフレーム数/秒）を前の区間と比べ、
+    tolerance を超えて改善した場合は同じ方向に、それ以外は逆方向に1つずつ増減する。
+    ワーカーが報告したメモリ使用量から、予算に収まる上限も更新する。
+    """
+
+    def __init__(self, plan: WorkerPlan, config: Config):
+        settings = config.WORKERS
+        self.plan = plan
+        self.limit = plan.initial_limit
+        self.max_limit = plan.pool_size
+        self.window_s = settings['window_s']
+        self.tolerance = settings['tolerance']
+        self.history: List[Tuple[float, int, float]] = []  # (経過秒, 同時実行数, 処理速度)
+        self._start = time.perf_counter()
+        self._window_start = self._start
+        self._window_completed = 0
+        self._last_rate: Optional[float] = None
+        self._direction = 1
+        self._parent_mb = get_memory_usage_mb() or 0.0
+
+    def record(self, completed: int, worker_stats: Iterable[WorkerStats]) -> None:
+        """完了したフレーム数とワーカーの統計を記録し、必要なら同時実行数を変更する
+
+        Args:
+            completed: 前回の呼び出し以降に完了したフレーム数
+            worker_stats: ワーカーが報告した統計情報
+        """
+        if not self.plan.adaptive:
+            return
+        self._window_completed += completed
+        self._update_memory_cap(worker_stats)
+
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        # 区間の処理数が少なすぎると速度の比較が不安定になるため、同時実行数分は待つ
+        if elapsed < self.window_s or self._window_completed < self.limit:
+            return
+        rate = self._window_completed / elapsed
+        self.history.append((now - self._start, self.limit, rate))
+        if self._last_rate is not None and rate <= self._last_rate * (1 + self.tolerance):
+            self._direction = -self._direction
+        self._last_rate = rate
+        self._set_limit(self.limit + self._direction)
+        self._window_start = now
+        self._window_completed = 0
+
+    def _update_memory_cap(self, worker_stats: Iterable[WorkerStats]) -> None:
+        """ワーカーの実際のメモリ使用量から同時実行数の上限を求め直す"""
+        if self.plan.budget_mb is None:
+            return
+        memories = [stats.memory_mb for stats in worker_stats if stats.memory_mb is not None]
+        if not memories:
+            return
+        cap = max(1, int((self.plan.budget_mb - self._parent_mb) // max(memories)))
+        if cap < self.max_limit:
+            self.max_limit = cap
+            if self.limit > cap:
+                tqdm.write(f"⚙️ ワーカーのメモリ使用量（最大 {max(memories):.0f}MB）から"
+                           f"同時実行数を {self.limit} → {cap} に減らします")
+                self.limit = cap
+
+    def _set_limit(self, limit: int) -> None:
+        limit = max(1, min(self.max_limit, limit))
+        if limit == self.limit:
+            # 上限・下限に達した場合は次の区間で逆方向を試す
+            self._direction = -self._direction
+            return
+        self.limit = limit
+
+    def print_summary(self) -> None:
+        """同時実行数の調整結果を表示する"""
+        if not self.plan.adaptive or not self.history:
+            return
+        best = max(self.history, key=lambda item: item[2])
+        limits = [limit for _, limit, _ in self.history]
+        print(f"⚙️ 同時実行数の調整: {self.plan.initial_limit} → {self.limit}"
+              f"（範囲 {min(limits)}〜{max(limits)}、最速 {best[2]:.1f} フレーム/秒 @ {best[1]}）")